@@ -57,7 +57,8 @@ export const login = (credentials) => API.post("token/", credentials);
 export const register = (data) => API.post("users/", data);
 
 // Notes APIs
-export const fetchNotes = () => API.get("notes/");
+// Pass the `next` URL from a previous page to fetch the following one
+export const fetchNotes = (url = "notes/") => API.get(url);
 export const createNote = (noteData) =>
     API.post("notes/", noteData, { headers: { "Content-Type": "multipart/form-data" } });
 export const updateNote = (id, noteData) =>
@@ -3,6 +3,7 @@ import React, { useState, useEffect, useRef } from "react";
 const NoteForm = ({ onSubmit, existingNote, onCancel }) => {
     const [formData, setFormData] = useState({ title: "", description: "" });
     const [recordings, setRecordings] = useState([]);
+    const [removedAudioIds, setRemovedAudioIds] = useState([]);
     const [isRecording, setIsRecording] = useState(false);
     const [isPaused, setIsPaused] = useState(false);
     const [recordTime, setRecordTime] = useState("00:00:00.0");
@@ -51,7 +52,8 @@ const NoteForm = ({ onSubmit, existingNote, onCancel }) => {
         mediaRecorder.ondataavailable = (event) => chunks.push(event.data);
 
         mediaRecorder.onstop = () => {
-            const blob = new Blob(chunks, { type: "audio/wav" });
+            // Keep the container the browser recorded to (WebM or Ogg), not a WAV label
+            const blob = new Blob(chunks, { type: mediaRecorder.mimeType || "audio/webm" });
             setRecordings((prev) => [...prev, { blob, id: Date.now() }]);
             stopTimer();
             setIsRecording(false);
@@ -83,11 +85,19 @@ const NoteForm = ({ onSubmit, existingNote, onCancel }) => {
         mediaRecorderRef.current?.stop();
     };
 
+    // File extension matching a recording's container
+    const recordingExtension = (blob) => (blob.type.includes("ogg") ? "ogg" : "webm");
+
     // Delete Recording
     const deleteRecording = (id) => {
         setRecordings((prev) => prev.filter((rec) => rec.id !== id));
     };
 
+    // Mark an attached audio file of the note being edited for removal
+    const removeExistingAudio = (id) => {
+        setRemovedAudioIds((prev) => [...prev, id]);
+    };
+
     // Handle Form Submit
     const handleSubmit = async (e) => {
         e.preventDefault();
@@ -105,9 +115,14 @@ const NoteForm = ({ onSubmit, existingNote, onCancel }) => {
     
         // Append each recording under the field 'uploaded_audios'
         recordings.forEach((recording, index) => {
-            const fileName = `audio_${index + 1}.wav`;
+            const fileName = `audio_${index + 1}.${recordingExtension(recording.blob)}`;
             formDataToSend.append("uploaded_audios", recording.blob, fileName);
         });
+
+        // Existing audio files removed while editing
+        removedAudioIds.forEach((id) => {
+            formDataToSend.append("removed_audio_ids", id);
+        });
     
         try {
             // Send form data to the API
@@ -117,6 +132,7 @@ const NoteForm = ({ onSubmit, existingNote, onCancel }) => {
             // Reset the form and recordings
             setFormData({ title: "", description: "" });
             setRecordings([]);
+            setRemovedAudioIds([]);
         } catch (error) {
             console.error("Error submitting note:", error.response?.data || error.message);
             alert("Failed to save note. Please try again.");
@@ -130,8 +146,14 @@ const NoteForm = ({ onSubmit, existingNote, onCancel }) => {
         } else {
             setFormData({ title: "", description: "" });
         }
+        setRemovedAudioIds([]);
     }, [existingNote]);
 
+    // Attached audio files of the note being edited that are still kept
+    const keptAudioFiles = (existingNote?.audio_files || []).filter(
+        (audio) => !removedAudioIds.includes(audio.id)
+    );
+
     return (
         <form onSubmit={handleSubmit} className="p-4 bg-white shadow-md rounded">
             <div>
@@ -191,6 +213,30 @@ const NoteForm = ({ onSubmit, existingNote, onCancel }) => {
                 )}
             </div>
 
+            {/* Display Attached Files of the Note Being Edited */}
+            {keptAudioFiles.length > 0 && (
+                <div className="mt-4">
+                    <h3 className="font-semibold">Attached Files</h3>
+                    {keptAudioFiles.map((audio) => (
+                        <div
+                            key={audio.id}
+                            className="flex items-center justify-between mt-2 border p-2 rounded"
+                        >
+                            <audio controls>
+                                <source src={audio.audio} />
+                            </audio>
+                            <button
+                                type="button"
+                                onClick={() => removeExistingAudio(audio.id)}
+                                className="bg-red-500 text-white px-2 py-1 rounded"
+                            >
+                                Remove
+                            </button>
+                        </div>
+                    ))}
+                </div>
+            )}
+
             {/* Display Recorded Files */}
             {recordings.length > 0 && (
                 <div className="mt-4">
@@ -201,7 +247,7 @@ const NoteForm = ({ onSubmit, existingNote, onCancel }) => {
                             className="flex items-center justify-between mt-2 border p-2 rounded"
                         >
                             <audio controls>
-                                <source src={URL.createObjectURL(recording.blob)} type="audio/wav" />
+                                <source src={URL.createObjectURL(recording.blob)} type={recording.blob.type} />
                             </audio>
                             <button
                                 type="button"
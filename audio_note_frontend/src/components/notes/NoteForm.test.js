@@ -39,6 +39,29 @@ describe("NoteForm", () => {
         }));
     });
 
+    test("sends removed audio ids when editing a note", async () => {
+        const handleSubmit = jest.fn();
+        const existingNote = {
+            id: 1,
+            title: "Existing",
+            description: "Body",
+            audio_files: [
+                { id: 7, audio: "/media/a.wav" },
+                { id: 8, audio: "/media/b.wav" },
+            ],
+        };
+        render(<NoteForm onSubmit={handleSubmit} existingNote={existingNote} />);
+
+        userEvent.click(screen.getAllByText(/remove/i)[0]);
+        expect(screen.getAllByText(/remove/i)).toHaveLength(1);
+
+        userEvent.click(screen.getByText(/update note/i));
+
+        await waitFor(() => expect(handleSubmit).toHaveBeenCalled());
+        const sent = handleSubmit.mock.calls[0][0];
+        expect(sent.getAll("removed_audio_ids")).toEqual(["7"]);
+    });
+
     test("shows error message if required fields are empty", async () => {
         const handleSubmit = jest.fn();
         render(<NoteForm onSubmit={handleSubmit} />);
@@ -6,17 +6,30 @@ import { createNote, updateNote, fetchNotes, deleteNote } from "../api/api";
 const Home = () => {
     const [notes, setNotes] = useState([]);
     const [editingNote, setEditingNote] = useState(null);
+    const [nextUrl, setNextUrl] = useState(null);
 
     // Load notes from the API
     const loadNotes = async () => {
         try {
             const response = await fetchNotes();
-            setNotes(response.data); // Update the notes state
+            setNotes(response.data.results); // Update the notes state (first page)
+            setNextUrl(response.data.next);
         } catch (err) {
             console.error("Failed to fetch notes:", err);
         }
     };
 
+    // Append the next page of notes using the cursor link from the last response
+    const loadMore = async () => {
+        try {
+            const response = await fetchNotes(nextUrl);
+            setNotes((prevNotes) => [...prevNotes, ...response.data.results]);
+            setNextUrl(response.data.next);
+        } catch (err) {
+            console.error("Failed to fetch more notes:", err);
+        }
+    };
+
     // Fetch notes on component mount
     useEffect(() => {
         loadNotes();
@@ -67,6 +80,16 @@ const Home = () => {
                 onEdit={setEditingNote}
                 onDelete={handleDelete}
             />
+            {nextUrl && (
+                <div className="text-center mt-4">
+                    <button
+                        onClick={loadMore}
+                        className="bg-gray-200 px-4 py-2 rounded hover:bg-gray-300"
+                    >
+                        Load more
+                    </button>
+                </div>
+            )}
         </div>
     );
 };
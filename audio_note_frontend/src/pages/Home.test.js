@@ -22,7 +22,7 @@ describe("Home Component", () => {
     });
 
     it("fetches and displays notes on mount", async () => {
-        fetchNotes.mockResolvedValueOnce({ data: sampleNotes });
+        fetchNotes.mockResolvedValueOnce({ data: { results: sampleNotes } });
 
         render(<Home />);
 
@@ -37,8 +37,30 @@ describe("Home Component", () => {
         expect(screen.getByText("Note 2")).toBeInTheDocument();
     });
 
+    it("appends the next page when Load more is clicked", async () => {
+        const nextUrl = "http://127.0.0.1:8000/api/notes/?cursor=abc";
+        fetchNotes
+            .mockResolvedValueOnce({ data: { results: sampleNotes, next: nextUrl } })
+            .mockResolvedValueOnce({
+                data: { results: [{ id: 3, title: "Note 3", content: "Content 3" }], next: null },
+            });
+
+        render(<Home />);
+
+        fireEvent.click(await screen.findByText("Load more"));
+
+        await waitFor(() => {
+            expect(fetchNotes).toHaveBeenLastCalledWith(nextUrl);
+        });
+
+        // Both pages are listed and the button disappears on the last page
+        expect(await screen.findByText("Note 3")).toBeInTheDocument();
+        expect(screen.getByText("Note 1")).toBeInTheDocument();
+        expect(screen.queryByText("Load more")).not.toBeInTheDocument();
+    });
+
     it("creates a new note and updates the list", async () => {
-        fetchNotes.mockResolvedValueOnce({ data: [] }); // Initially empty notes
+        fetchNotes.mockResolvedValueOnce({ data: { results: [] } }); // Initially empty notes
         const newNote = { id: 3, title: "New Note", content: "New Content" };
         createNote.mockResolvedValueOnce({ data: newNote });
 
@@ -69,7 +91,7 @@ describe("Home Component", () => {
     });
 
     it("updates an existing note", async () => {
-        fetchNotes.mockResolvedValueOnce({ data: sampleNotes });
+        fetchNotes.mockResolvedValueOnce({ data: { results: sampleNotes } });
         const updatedNote = { id: 1, title: "Updated Note", content: "Updated Content" };
         updateNote.mockResolvedValueOnce({ data: updatedNote });
 
@@ -103,7 +125,7 @@ describe("Home Component", () => {
     });
 
     it("deletes a note and updates the list", async () => {
-        fetchNotes.mockResolvedValueOnce({ data: sampleNotes });
+        fetchNotes.mockResolvedValueOnce({ data: { results: sampleNotes } });
         deleteNote.mockResolvedValueOnce();
 
         render(<Home />);
@@ -13,4 +13,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "audio_note_taking.settings")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported after setup: audio uploads and downloads are served on the event loop.
+from notes.asgi import AudioTransferMiddleware  # noqa: E402
+
+application = AudioTransferMiddleware(django_application)
@@ -36,6 +36,57 @@ CORS_ALLOW_ALL_ORIGINS = True
 MEDIA_URL = config("MEDIA_URL", default="/media/") 
 MEDIA_ROOT = os.path.join(BASE_DIR, config("MEDIA_ROOT", default="media/")) 
 
+# Largest audio file accepted through the chunked upload API (bytes)
+AUDIO_UPLOAD_MAX_SIZE = config("AUDIO_UPLOAD_MAX_SIZE", default=1024 * 1024 * 1024, cast=int)
+
+# Largest audio file and most audio files accepted in one multipart request to
+# /api/notes/; larger or extra files stop the upload while it is being received
+NOTE_AUDIO_MAX_SIZE = config("NOTE_AUDIO_MAX_SIZE", default=10 * 1024 * 1024, cast=int)
+NOTE_AUDIO_MAX_FILES = config("NOTE_AUDIO_MAX_FILES", default=10, cast=int)
+
+# Audio bytes each user may store across all notes; 0 means no limit
+AUDIO_QUOTA_BYTES = config("AUDIO_QUOTA_BYTES", default=0, cast=int)
+
+# Hand audio streaming to the front proxy, e.g. "X-Accel-Redirect" (nginx) or
+# "X-Sendfile" (Apache). Empty means Django streams the bytes itself.
+AUDIO_SENDFILE_HEADER = config("AUDIO_SENDFILE_HEADER", default="")
+# Internal location nginx maps onto MEDIA_ROOT when using X-Accel-Redirect
+AUDIO_SENDFILE_PREFIX = config("AUDIO_SENDFILE_PREFIX", default="/protected-media/")
+
+# Background jobs (see `manage.py runworker`)
+JOB_MAX_ATTEMPTS = config("JOB_MAX_ATTEMPTS", default=5, cast=int)
+# Retry delay in seconds: base * 2 ** (attempt - 1), capped at the maximum
+JOB_RETRY_BACKOFF = config("JOB_RETRY_BACKOFF", default=10, cast=int)
+JOB_RETRY_BACKOFF_MAX = config("JOB_RETRY_BACKOFF_MAX", default=3600, cast=int)
+# Running jobs whose worker has been silent this long are claimed again
+JOB_LOCK_TIMEOUT = config("JOB_LOCK_TIMEOUT", default=600, cast=int)
+
+# Dotted paths of callables run by a worker for each new AudioBlob
+AUDIO_PROCESSING_STAGES = [
+    "notes.waveform.generate_peaks",
+]
+
+# Find speech in uploaded WAV audio for GET /api/audio/<id>/segments/ (see
+# notes/vad.py): frames louder than AUDIO_VAD_THRESHOLD_DB (dBFS) are speech,
+# and quieter stretches of at least AUDIO_VAD_MIN_SILENCE_MS (keep above 400)
+# separate segments. AUDIO_VAD_TRIM also replaces the audio with a copy
+# without those silences.
+AUDIO_VAD = config("AUDIO_VAD", default=False, cast=bool)
+AUDIO_VAD_THRESHOLD_DB = config("AUDIO_VAD_THRESHOLD_DB", default=-45.0, cast=float)
+AUDIO_VAD_MIN_SILENCE_MS = config("AUDIO_VAD_MIN_SILENCE_MS", default=1000, cast=int)
+AUDIO_VAD_TRIM = config("AUDIO_VAD_TRIM", default=False, cast=bool)
+if AUDIO_VAD:
+    AUDIO_PROCESSING_STAGES.insert(0, "notes.vad.detect_speech")
+
+# Rewrite uploaded WAV audio as mono 16-bit PCM at AUDIO_COMPACT_SAMPLE_RATE
+# before the other stages run (see notes/compaction.py)
+AUDIO_COMPACTION = config("AUDIO_COMPACTION", default=False, cast=bool)
+AUDIO_COMPACT_SAMPLE_RATE = config("AUDIO_COMPACT_SAMPLE_RATE", default=16000, cast=int)
+# Processes doing the compaction; 0 means one per CPU
+AUDIO_COMPACT_PROCESSES = config("AUDIO_COMPACT_PROCESSES", default=0, cast=int)
+if AUDIO_COMPACTION:
+    AUDIO_PROCESSING_STAGES.insert(0, "notes.compaction.compact_blob")
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -60,6 +111,7 @@ SIMPLE_JWT = {
 }
 
 MIDDLEWARE = [
+    "notes.middleware.RequestMetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -102,13 +154,61 @@ DATABASES = {
     }
 }
 
+# Optional read replica: note list and detail reads go there, writes and
+# everything else stay on the primary
+if config("DB_REPLICA_HOST", default=""):
+    DATABASES["replica"] = {
+        **DATABASES["default"],
+        "HOST": config("DB_REPLICA_HOST"),
+        "PORT": config("DB_REPLICA_PORT", default=DATABASES["default"]["PORT"]),
+        "TEST": {"MIRROR": "default"},
+    }
+
+DATABASE_ROUTERS = ["notes.routers.ReplicaRouter"]
+DATABASE_READ_REPLICAS = [alias for alias in DATABASES if alias != "default"]
+# Seconds a user's reads stay on the primary after they write; keep above the replication lag
+DATABASE_REPLICA_STICKY_SECONDS = config("DATABASE_REPLICA_STICKY_SECONDS", default=5, cast=int)
+
+# Cache
+# Local memory by default; point CACHE_BACKEND/CACHE_LOCATION at a shared
+# backend such as Redis or Memcached when running more than one process.
+CACHES = {
+    "default": {
+        "BACKEND": config("CACHE_BACKEND", default="django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": config("CACHE_LOCATION", default=""),
+    }
+}
+
+# Seconds a rendered notes list/detail response stays cached
+NOTES_CACHE_TIMEOUT = config("NOTES_CACHE_TIMEOUT", default=300, cast=int)
+
+# Largest number of operations accepted by POST /api/notes/bulk/
+NOTES_BULK_MAX_ITEMS = config("NOTES_BULK_MAX_ITEMS", default=1000, cast=int)
+
+# Changes feed (GET /api/notes/changes/): largest page, how far behind the
+# clock the cursor stays to catch slow commits, and how long deletions are kept
+SYNC_PAGE_SIZE = config("SYNC_PAGE_SIZE", default=500, cast=int)
+SYNC_COMMIT_LAG_SECONDS = config("SYNC_COMMIT_LAG_SECONDS", default=5, cast=int)
+SYNC_TOMBSTONE_RETENTION_DAYS = config("SYNC_TOMBSTONE_RETENTION_DAYS", default=30, cast=int)
+
 # Rest Framework Validation
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'notes.authentication.CachedJWTAuthentication',
     )
 }
 
+# Request metrics at /api/metrics/, served only with `Authorization: Bearer <METRICS_TOKEN>`
+METRICS_TOKEN = config("METRICS_TOKEN", default="")
+# Fraction of requests run under cProfile; profiles of those slower than
+# PROFILE_SLOW_REQUEST_MS are written to PROFILE_DIR
+PROFILE_SAMPLE_RATE = config("PROFILE_SAMPLE_RATE", default=0.0, cast=float)
+PROFILE_SLOW_REQUEST_MS = config("PROFILE_SLOW_REQUEST_MS", default=500, cast=int)
+PROFILE_DIR = config("PROFILE_DIR", default=str(BASE_DIR / "profiles"))
+
+# Seconds an authenticated user row is cached; saving or deleting the user drops it
+AUTH_USER_CACHE_TIMEOUT = config("AUTH_USER_CACHE_TIMEOUT", default=60, cast=int)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
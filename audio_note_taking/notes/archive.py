@@ -0,0 +1,250 @@
+"""
+Streaming ZIP export and import of a user's notes and audio.
+
+An archive holds `export.json`, then for every note its audio files as
+`notes/<note id>/<audio id><ext>` followed by `notes/<note id>/note.json`,
+which lists them. Export writes the ZIP through `_ZipSink`, which the
+response generator drains after every chunk, so memory stays at a chunk or
+two however large the archive; notes are read a batch at a time by id.
+Import checks the whole archive, reading every member through so a damaged
+one is caught by its CRC, before writing anything, then reads the members one
+at a time and inserts notes and audio files in batches.
+"""
+import json
+import os
+import zipfile
+import zlib
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import audio_meta, response_cache, routers, storage, usage
+from .models import Note
+from .serializers import NoteBulkCreateSerializer
+
+FORMAT_VERSION = 1
+MANIFEST = "export.json"
+NOTE_FILE = "note.json"
+BATCH_SIZE = 200
+# Largest note.json accepted on import
+MAX_NOTE_BYTES = 1024 * 1024
+AUDIO_FIELDS = ("size", "duration_ms", "sample_rate", "channels", "bitrate")
+
+
+class ArchiveError(ValueError):
+    """
+    An uploaded archive that cannot be imported.
+    """
+
+
+class _ZipSink:
+    """
+    Write-only file object that keeps what ZipFile writes until it is drained.
+
+    Without `seek`, ZipFile writes each entry's sizes and CRC after its data,
+    so entries can be streamed without knowing their content up front.
+    """
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _zip_info(name, when, compress_type, size=0):
+    info = zipfile.ZipInfo(name, timezone.localtime(when).timetuple()[:6])
+    info.compress_type = compress_type
+    info.file_size = size
+    return info
+
+
+def _note_batches(user_id):
+    """
+    Yield the user's notes with their audio files, BATCH_SIZE at a time in id order.
+    """
+    last_id = 0
+    while True:
+        notes = list(
+            Note.objects.filter(user_id=user_id, pk__gt=last_id)
+            .defer("search_vector")
+            .prefetch_related("audio_files")
+            .order_by("pk")[:BATCH_SIZE]
+        )
+        if not notes:
+            return
+        yield notes
+        last_id = notes[-1].pk
+
+
+def export_chunks(user):
+    """
+    Yield the bytes of a ZIP archive of all of `user`'s notes and audio.
+
+    Audio is stored as is, since recordings barely compress, and a file that
+    disappears while the archive is written is left out of its note's listing.
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, "w") as archive:
+        manifest = {"format": FORMAT_VERSION, "user": user.get_username(), "exported_at": timezone.now().isoformat()}
+        archive.writestr(_zip_info(MANIFEST, timezone.now(), zipfile.ZIP_DEFLATED), json.dumps(manifest))
+        yield sink.drain()
+
+        for notes in _note_batches(user.pk):
+            for note in notes:
+                listed = []
+                for audio_file in note.audio_files.all():
+                    try:
+                        source = open(audio_file.audio.path, "rb")
+                    except FileNotFoundError:
+                        continue
+                    name = f"notes/{note.pk}/{audio_file.pk}{os.path.splitext(audio_file.audio.name)[1]}"
+                    info = _zip_info(
+                        name, audio_file.uploaded_at, zipfile.ZIP_STORED, os.fstat(source.fileno()).st_size
+                    )
+                    with source, archive.open(info, "w") as out:
+                        for chunk in iter(lambda: source.read(storage.CHUNK_SIZE), b""):
+                            out.write(chunk)
+                            yield sink.drain()
+                    listed.append({"path": name, **{field: getattr(audio_file, field) for field in AUDIO_FIELDS}})
+
+                record = {
+                    "id": note.pk,
+                    "title": note.title,
+                    "description": note.description,
+                    "created_at": note.created_at.isoformat(),
+                    "updated_at": note.updated_at.isoformat(),
+                    "audio_files": listed,
+                }
+                archive.writestr(
+                    _zip_info(f"notes/{note.pk}/{NOTE_FILE}", note.updated_at, zipfile.ZIP_DEFLATED),
+                    json.dumps(record),
+                )
+            yield sink.drain()
+    yield sink.drain()
+
+
+def _read_note(archive, info):
+    """
+    Parse and validate a note.json member; returns `(fields, audio member names)`.
+    """
+    if info.file_size > MAX_NOTE_BYTES:
+        raise ArchiveError(f"{info.filename} is too large.")
+    try:
+        record = json.loads(archive.read(info))
+        paths = [entry["path"] for entry in record.get("audio_files", [])]
+    except (ValueError, TypeError, KeyError, AttributeError):
+        paths = None
+    if paths is None or not all(isinstance(path, str) for path in paths):
+        raise ArchiveError(f"{info.filename} is not a valid note.")
+    serializer = NoteBulkCreateSerializer(data=record)
+    if not serializer.is_valid():
+        raise ArchiveError(f"{info.filename}: {json.dumps(serializer.errors)}")
+    return serializer.validated_data, paths
+
+
+def _check(archive, user_id):
+    """
+    Validate every note and audio file in the archive and the quota; returns the note members.
+
+    Audio is read through after its header is probed, so that ZipFile checks
+    its CRC.
+    """
+    try:
+        manifest = json.loads(archive.read(MANIFEST))
+    except (KeyError, ValueError):
+        raise ArchiveError("Not a notes export: export.json is missing or invalid.")
+    if not isinstance(manifest, dict) or manifest.get("format") != FORMAT_VERSION:
+        raise ArchiveError("Unsupported export format.")
+
+    members = {info.filename: info for info in archive.infolist()}
+    note_members = [info for info in members.values() if info.filename.endswith(f"/{NOTE_FILE}")]
+    incoming = 0
+    for info in note_members:
+        _, paths = _read_note(archive, info)
+        for path in paths:
+            audio = members.get(path)
+            if audio is None:
+                raise ArchiveError(f"{info.filename} lists {path}, which is not in the archive.")
+            with archive.open(audio) as source:
+                if audio_meta.probe(source, audio.file_size) is None:
+                    raise ArchiveError(f"{path} has an unsupported format.")
+                while source.read(storage.CHUNK_SIZE):
+                    pass
+            incoming += audio.file_size
+
+    over_quota = usage.check_quota(user_id, incoming)
+    if over_quota:
+        raise ArchiveError(over_quota)
+    return note_members
+
+
+def _member_chunks(archive, name):
+    with archive.open(name) as source:
+        yield from iter(lambda: source.read(storage.CHUNK_SIZE), b"")
+
+
+def _import_batch(archive, user, batch):
+    """
+    Insert one batch of `(fields, audio member names)` notes and their audio in a transaction.
+    """
+    with transaction.atomic():
+        notes = Note.objects.bulk_create([Note(user=user, **fields) for fields, _ in batch])
+        audio_files = storage.save_audio_batch(
+            (note, _member_chunks(archive, path), path)
+            for note, (_, paths) in zip(notes, batch)
+            for path in paths
+        )
+    return len(notes), len(audio_files)
+
+
+def import_archive(user, source):
+    """
+    Add the notes and audio in the ZIP file object `source` to `user`'s notes.
+
+    Each batch of BATCH_SIZE notes commits on its own, so a large import does
+    not hold one long transaction. Returns `{"notes": n, "audio_files": n}`.
+    Raises ArchiveError, before anything is written, for an archive that is
+    damaged, is not a valid export, lists missing or unsupported audio, or
+    would exceed the storage quota. A batch that still fails to read, say
+    because the upload changed under the import, raises ArchiveError too, and
+    the batches committed before it stay imported.
+    """
+    try:
+        archive = zipfile.ZipFile(source)
+    except zipfile.BadZipFile:
+        raise ArchiveError("Not a ZIP archive.")
+
+    counts = {"notes": 0, "audio_files": 0}
+    with archive:
+        try:
+            note_members = _check(archive, user.pk)
+        except (zipfile.BadZipFile, zlib.error) as exc:
+            raise ArchiveError(f"Damaged archive: {exc}")
+        try:
+            for first in range(0, len(note_members), BATCH_SIZE):
+                batch = [_read_note(archive, info) for info in note_members[first:first + BATCH_SIZE]]
+                notes, audio_files = _import_batch(archive, user, batch)
+                counts["notes"] += notes
+                counts["audio_files"] += audio_files
+        except (zipfile.BadZipFile, zlib.error) as exc:
+            raise ArchiveError(f"Damaged archive: {exc}")
+        finally:
+            if counts["notes"]:
+                # bulk_create sends no signals, so invalidate explicitly.
+                response_cache.bump_version(user.pk)
+                routers.pin_primary(user.pk)
+    return counts
@@ -0,0 +1,341 @@
+"""
+ASGI fast path for audio chunk uploads and streaming downloads.
+
+Under ASGI every DRF view still runs synchronously in a worker thread, so a
+phone on a slow link holds that thread for the whole transfer.
+AudioTransferMiddleware answers `PUT /api/uploads/<id>/` and
+`GET /api/audio/<id>/stream/` itself: the request body is read from `receive()`
+as it arrives, file I/O is handed to the default executor one chunk at a time
+and only the short authentication and database steps run through
+sync_to_async. No thread or database connection is held while waiting on the
+client. Every other request, and every request under WSGI, goes through the
+regular views.
+
+Requests are matched by resolving their path against the URLconf, so the
+fast path follows the routes of the views it stands in for. The Host header
+is validated against ALLOWED_HOSTS as Django's handler would.
+
+Multipart note uploads are left to the sync view: Django's ASGI handler
+already reads the whole body on the event loop, spooling it to a temporary
+file, before a worker thread parses it.
+"""
+import asyncio
+import io
+import logging
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import signals
+from django.core.exceptions import DisallowedHost, ValidationError
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404
+from django.db import connections, transaction
+from django.urls import Resolver404, resolve
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.renderers import JSONRenderer
+from rest_framework_simplejwt.exceptions import InvalidToken
+
+from . import metrics, streaming, uploads
+from .authentication import CachedJWTAuthentication
+from .middleware import QueryCounter
+from .models import AudioFile, AudioUpload
+from .serializers import AudioUploadSerializer
+
+# URL names of the views served here, with the methods taken over for each
+UPLOAD_VIEW = "uploads-detail"
+STREAM_VIEW = "audio-stream"
+TRANSFER_METHODS = {UPLOAD_VIEW: ("PUT",), STREAM_VIEW: ("GET", "HEAD")}
+
+security_logger = logging.getLogger("django.security.DisallowedHost")
+
+_queries = ContextVar("notes_transfer_queries", default=None)
+
+
+class TransferError(Exception):
+    """
+    An error answered with a JSON `{"detail": ...}` body, or with `detail`
+    itself when it is already a dict, as DRF renders token errors.
+    """
+    def __init__(self, status, detail):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+
+
+def database_step(func):
+    """
+    Run `func` through sync_to_async, counting its queries into the
+    QueryCounter of the transfer being served.
+    """
+    def counted(*args, **kwargs):
+        queries = _queries.get()
+        with ExitStack() as stack:
+            if queries is not None:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(queries))
+            return func(*args, **kwargs)
+    return sync_to_async(counted)
+
+
+def match_transfer(scope):
+    """
+    Return the URL match of a request this module serves, or None.
+    """
+    if scope["type"] != "http":
+        return None
+    path = scope["path"].removeprefix(scope.get("root_path", ""))
+    try:
+        match = resolve(path)
+    except Resolver404:
+        return None
+    if scope["method"] not in TRANSFER_METHODS.get(match.view_name, ()):
+        return None
+    return match
+
+
+def authenticate(meta):
+    """
+    Resolve the JWT in the Authorization header to a user, as the views would.
+    """
+    authentication = CachedJWTAuthentication()
+    header = meta.get("HTTP_AUTHORIZATION", "").encode("latin1")
+    raw_token = authentication.get_raw_token(header) if header else None
+    if raw_token is None:
+        raise TransferError(401, "Authentication credentials were not provided.")
+    try:
+        return authentication.get_user(authentication.get_validated_token(raw_token))
+    except (InvalidToken, AuthenticationFailed) as exc:
+        raise TransferError(401, exc.detail)
+
+
+@database_step
+def open_upload(meta, pk):
+    """
+    Load the caller's upload session and check the Content-Range of the chunk.
+    """
+    user = authenticate(meta)
+    try:
+        upload = AudioUpload.objects.get(pk=pk, user=user)
+    except (AudioUpload.DoesNotExist, ValidationError):
+        raise TransferError(404, "No AudioUpload matches the given query.")
+    try:
+        start, end = uploads.parse_content_range(meta.get("HTTP_CONTENT_RANGE"), upload.size)
+    except ValueError as exc:
+        raise TransferError(400, str(exc))
+    return upload, start, end
+
+
+@database_step
+def record_chunk(upload, start, written):
+    """
+    Merge a written byte range into the session and return its serialized state.
+    """
+    with transaction.atomic():
+        upload = AudioUpload.objects.select_for_update().get(pk=upload.pk)
+        if written:
+            upload.received_ranges = uploads.merge_range(upload.received_ranges, start, start + written)
+            upload.save(update_fields=["received_ranges", "updated_at"])
+    return AudioUploadSerializer(upload).data
+
+
+@database_step
+def open_stream(meta, pk):
+    """
+    Load the caller's audio file and plan the response to the stream request.
+    """
+    user = authenticate(meta)
+    try:
+        audio_file = AudioFile.objects.get(pk=pk, note__user=user)
+        return streaming.plan_transfer(meta, audio_file)
+    except (AudioFile.DoesNotExist, ValueError, Http404):
+        raise TransferError(404, "No AudioFile matches the given query.")
+
+
+async def write_body(receive, path, start, length):
+    """
+    Copy up to `length` bytes of the request body into `path` at `start`.
+
+    Body messages are buffered to CHUNK_SIZE so each executor hop writes a
+    useful amount. Returns the number of bytes written, which is short if the
+    client disconnected.
+    """
+    part = await asyncio.to_thread(open, path, "r+b")
+    buffer = bytearray()
+    written = 0
+
+    async def flush():
+        nonlocal written
+        data = bytes(buffer[:length - written])
+        buffer.clear()
+        await asyncio.to_thread(part.write, data)
+        written += len(data)
+
+    try:
+        await asyncio.to_thread(part.seek, start)
+        more_body = True
+        while more_body and written + len(buffer) < length:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                break
+            buffer += message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if len(buffer) >= uploads.CHUNK_SIZE:
+                await flush()
+        if buffer:
+            await flush()
+    finally:
+        await asyncio.to_thread(part.close)
+    return written
+
+
+async def send_file_range(send, path, start, length):
+    """
+    Send `length` bytes of `path` from `start` as response body messages.
+    """
+    source = await asyncio.to_thread(open, path, "rb")
+    try:
+        await asyncio.to_thread(source.seek, start)
+        while length > 0:
+            data = await asyncio.to_thread(source.read, min(streaming.CHUNK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            await send({"type": "http.response.body", "body": data, "more_body": length > 0})
+        if length > 0:
+            await send({"type": "http.response.body", "body": b""})
+    finally:
+        await asyncio.to_thread(source.close)
+
+
+def cors_headers(meta):
+    """
+    Return the CORS response headers django-cors-headers would add for this
+    request, since these responses bypass the Django middleware.
+    """
+    origin = meta.get("HTTP_ORIGIN")
+    allow_all = getattr(settings, "CORS_ALLOW_ALL_ORIGINS", False)
+    if not origin or not (allow_all or origin in getattr(settings, "CORS_ALLOWED_ORIGINS", [])):
+        return {}
+    credentials = getattr(settings, "CORS_ALLOW_CREDENTIALS", False)
+    headers = {"Access-Control-Allow-Origin": "*" if allow_all and not credentials else origin, "Vary": "Origin"}
+    if credentials:
+        headers["Access-Control-Allow-Credentials"] = "true"
+    return headers
+
+
+async def start_response(send, status, headers):
+    """
+    Send the status line and headers of a response.
+    """
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(name.lower().encode("latin1"), str(value).encode("latin1")) for name, value in headers.items()],
+    })
+
+
+async def send_response(send, status, headers, body=b""):
+    """
+    Send a complete response with a small body.
+    """
+    await start_response(send, status, headers)
+    await send({"type": "http.response.body", "body": body})
+
+
+async def send_json(send, status, data):
+    """
+    Send `data` rendered the way the API renders it.
+    """
+    headers = {"Content-Type": "application/json"}
+    if status == 401:
+        headers["WWW-Authenticate"] = 'Bearer realm="api"'
+    await send_response(send, status, headers, JSONRenderer().render(data))
+
+
+class AudioTransferMiddleware:
+    """
+    Serve audio chunk uploads and downloads without holding a thread per client.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        match = match_transfer(scope)
+        if match is None:
+            return await self.app(scope, receive, send)
+        handler = self.upload_chunk if match.view_name == UPLOAD_VIEW else self.stream_audio
+        return await self.handle(handler, scope, receive, send, match)
+
+    async def handle(self, handler, scope, receive, send, match):
+        """
+        Run a handler between the request signals Django's own handler sends,
+        which close stale database connections, and record it in `metrics`
+        under its view name as RequestMetricsMiddleware would.
+
+        The database steps all run on asgiref's single sync thread, so hundreds
+        of slow transfers share one connection instead of holding one each.
+        The body is left unread for the handler to consume from `receive`.
+        """
+        request = ASGIRequest(scope, io.BytesIO())
+        queries = QueryCounter()
+        queries_token = _queries.set(queries)
+        media_token = metrics.start_media_counter()
+        started = time.perf_counter()
+        extra_headers = [
+            (name.lower().encode("latin1"), value.encode("latin1"))
+            for name, value in cors_headers(request.META).items()
+        ]
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start" and extra_headers:
+                message = {**message, "headers": [*message["headers"], *extra_headers]}
+            await send(message)
+
+        await sync_to_async(signals.request_started.send)(sender=self.__class__, scope=scope)
+        try:
+            try:
+                request.get_host()
+            except DisallowedHost as exc:
+                security_logger.error(str(exc))
+                raise TransferError(400, "Invalid Host header.")
+            await handler(request, receive, send_with_headers, match.kwargs["pk"])
+        except TransferError as exc:
+            data = exc.detail if isinstance(exc.detail, dict) else {"detail": exc.detail}
+            await send_json(send_with_headers, exc.status, data)
+        finally:
+            await sync_to_async(signals.request_finished.send)(sender=self.__class__)
+            elapsed = time.perf_counter() - started
+            media_written = metrics.stop_media_counter(media_token)
+            _queries.reset(queries_token)
+            metrics.observe_request(
+                view=match.view_name,
+                method=request.method,
+                duration=elapsed,
+                queries=queries.count,
+                sql_seconds=queries.seconds,
+                upload_bytes=int(request.META.get("CONTENT_LENGTH") or 0),
+                media_written=media_written,
+            )
+
+    async def upload_chunk(self, request, receive, send, pk):
+        """
+        Stream one chunk of a resumable upload to disk as it arrives.
+        """
+        upload, start, end = await open_upload(request.META, pk)
+        written = await write_body(receive, upload.temp_path, start, end - start)
+        metrics.record_media_write(written)
+        await send_json(send, 200, await record_chunk(upload, start, written))
+
+    async def stream_audio(self, request, receive, send, pk):
+        """
+        Stream an audio file, honouring the same conditional and range headers as the view.
+        """
+        transfer = await open_stream(request.META, pk)
+        if request.method == "HEAD" or not transfer.length:
+            return await send_response(send, transfer.status, transfer.headers)
+
+        await start_response(send, transfer.status, transfer.headers)
+        await send_file_range(send, transfer.path, transfer.start, transfer.length)
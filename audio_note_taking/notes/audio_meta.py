@@ -0,0 +1,335 @@
+"""
+Identify audio files by their magic bytes and read basic stream properties.
+
+Only a few KB at the start of the file are read: the RIFF chunk headers of a
+WAV file, or the first frames of an MP3 or ADTS AAC stream (after skipping any
+ID3v2 tag). Durations for MP3 without a Xing/VBRI header and for AAC are
+estimated from the file size and the bitrate of the first frames.
+
+WebM and Ogg, the containers browsers record to with MediaRecorder, are
+recognised by their magic bytes. For Ogg the channels and sample rate come from
+the Opus or Vorbis identification header; their durations are left unknown.
+"""
+import os
+import struct
+from dataclasses import dataclass
+
+HEAD_SIZE = 8 * 1024
+# Bytes `sniff` needs to recognise a format
+SNIFF_SIZE = 12
+# Safety limit on RIFF chunks walked while looking for `fmt ` and `data`
+MAX_WAV_CHUNKS = 32
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+MPEG_VERSION_1, MPEG_VERSION_2, MPEG_VERSION_25 = 3, 2, 0
+
+MPEG_BITRATES = {
+    (MPEG_VERSION_1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (MPEG_VERSION_1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (MPEG_VERSION_1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (MPEG_VERSION_2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (MPEG_VERSION_2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (MPEG_VERSION_2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+MPEG_SAMPLE_RATES = {
+    MPEG_VERSION_1: [44100, 48000, 32000],
+    MPEG_VERSION_2: [22050, 24000, 16000],
+    MPEG_VERSION_25: [11025, 12000, 8000],
+}
+EBML_MAGIC = b"\x1a\x45\xdf\xa3"
+OGG_MAGIC = b"OggS"
+# Opus always decodes at 48 kHz, whatever input rate its header records
+OPUS_SAMPLE_RATE = 48000
+
+ADTS_SAMPLE_RATES = [96000, 88200, 64000, 48000, 44100, 32000, 24000, 22050, 16000, 12000, 11025, 8000, 7350]
+
+
+@dataclass(frozen=True)
+class AudioInfo:
+    """
+    Stream properties of an audio file. Unknown values are None.
+    """
+    format: str
+    duration_ms: int = None
+    sample_rate: int = None
+    channels: int = None
+    bitrate: int = None
+
+    def as_fields(self):
+        """
+        Return the values stored on AudioFile.
+        """
+        return {
+            "duration_ms": self.duration_ms,
+            "sample_rate": self.sample_rate,
+            "channels": self.channels,
+            "bitrate": self.bitrate,
+        }
+
+
+def sniff(head):
+    """
+    Tell whether `head`, the first SNIFF_SIZE bytes of a file, can start WAV,
+    MP3, ADTS AAC, WebM or Ogg audio.
+
+    A cheap check on magic bytes alone, for rejecting uploads before they are
+    received in full; `probe` still decides once the file is complete.
+    """
+    return (
+        (head[:4] == b"RIFF" and head[8:12] == b"WAVE")
+        or head[:3] == b"ID3"
+        or head[:4] in (EBML_MAGIC, OGG_MAGIC)
+        or (len(head) >= 2 and head[0] == 0xFF and (head[1] & 0xE0) == 0xE0)
+    )
+
+
+def probe(source, size):
+    """
+    Identify and describe the audio in a seekable binary file of `size` bytes.
+
+    Returns an AudioInfo, or None if the content is not WAV, MP3, ADTS AAC,
+    WebM or Ogg.
+    The file position is restored afterwards.
+    """
+    position = source.tell()
+    try:
+        source.seek(0)
+        head = source.read(HEAD_SIZE)
+        if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+            return _probe_wav(source, size)
+        if head[:4] == EBML_MAGIC:
+            return AudioInfo("webm")
+        if head[:4] == OGG_MAGIC:
+            return _probe_ogg(head)
+
+        offset = _id3_size(head)
+        if offset:
+            source.seek(offset)
+            head = source.read(HEAD_SIZE)
+        return _probe_adts(head, size - offset) or _probe_mpeg(head, size - offset)
+    except (struct.error, ValueError):
+        return None
+    finally:
+        source.seek(position)
+
+
+def probe_path(path):
+    """
+    Probe the audio file at `path`.
+    """
+    with open(path, "rb") as source:
+        return probe(source, os.path.getsize(path))
+
+
+def _id3_size(head):
+    """
+    Return the length of a leading ID3v2 tag, or 0 if there is none.
+    """
+    if len(head) < 10 or head[:3] != b"ID3":
+        return 0
+    size = 0
+    for byte in head[6:10]:
+        size = (size << 7) | (byte & 0x7F)
+    footer = 10 if head[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+@dataclass(frozen=True)
+class WavLayout:
+    """
+    Where the PCM data of a WAV file lives and how it is encoded.
+
+    `data_offset` and `data_size` are None if no `data` chunk was found.
+    """
+    audio_format: int
+    channels: int
+    sample_rate: int
+    byte_rate: int
+    block_align: int
+    bits_per_sample: int
+    data_offset: int = None
+    data_size: int = None
+
+
+def read_wav_layout(source, size):
+    """
+    Walk RIFF chunks for the `fmt ` and `data` headers, seeking past chunk bodies.
+
+    Returns a WavLayout, or None if the file is not a WAV with a `fmt ` chunk.
+    """
+    source.seek(0)
+    head = source.read(12)
+    if head[:4] != b"RIFF" or head[8:12] != b"WAVE":
+        return None
+
+    fmt = None
+    offset = 12
+    for _ in range(MAX_WAV_CHUNKS):
+        source.seek(offset)
+        header = source.read(8)
+        if len(header) < 8:
+            break
+        chunk_id, chunk_size = struct.unpack("<4sI", header)
+        if chunk_id == b"fmt ":
+            body = source.read(min(chunk_size, 40))
+            fmt = list(struct.unpack("<HHIIHH", body[:16]))
+            if fmt[0] == WAVE_FORMAT_EXTENSIBLE and len(body) >= 26:
+                # The real format code leads the sub-format GUID.
+                fmt[0] = struct.unpack("<H", body[24:26])[0]
+        elif chunk_id == b"data":
+            if fmt is None:
+                break
+            # Streamed WAVs often leave the data size unset (0 or 0xFFFFFFFF).
+            available = size - offset - 8
+            data_size = min(chunk_size, available) if chunk_size else available
+            return WavLayout(*fmt, data_offset=offset + 8, data_size=data_size)
+        offset += 8 + chunk_size + (chunk_size & 1)
+
+    return WavLayout(*fmt) if fmt else None
+
+
+def _probe_wav(source, size):
+    layout = read_wav_layout(source, size)
+    if layout is None:
+        return None
+    duration_ms = None
+    if layout.data_size is not None and layout.byte_rate:
+        duration_ms = layout.data_size * 1000 // layout.byte_rate
+    return AudioInfo("wav", duration_ms, layout.sample_rate, layout.channels, layout.byte_rate * 8)
+
+
+def _probe_ogg(head):
+    """
+    Read the Opus or Vorbis identification header from the first Ogg page.
+
+    Other codecs are still accepted as Ogg, with unknown properties.
+    """
+    if len(head) < 27:
+        return None
+    segments = head[26]
+    packet = head[27 + segments:]
+    if packet[:8] == b"OpusHead":
+        return AudioInfo("ogg", sample_rate=OPUS_SAMPLE_RATE, channels=packet[9])
+    if packet[:7] == b"\x01vorbis":
+        channels, sample_rate, _, bitrate = struct.unpack("<BIii", packet[11:24])
+        return AudioInfo("ogg", sample_rate=sample_rate, channels=channels, bitrate=bitrate if bitrate > 0 else None)
+    return AudioInfo("ogg")
+
+
+def _mpeg_frame(head, offset):
+    """
+    Decode the MPEG audio frame header at `offset`, or return None.
+    """
+    if offset + 4 > len(head):
+        return None
+    b0, b1, b2, b3 = head[offset:offset + 4]
+    if b0 != 0xFF or (b1 & 0xE0) != 0xE0:
+        return None
+
+    version = (b1 >> 3) & 0x03
+    layer = 4 - ((b1 >> 1) & 0x03)
+    bitrate_index = b2 >> 4
+    sample_rate_index = (b2 >> 2) & 0x03
+    if version == 1 or layer == 4 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    table_version = MPEG_VERSION_1 if version == MPEG_VERSION_1 else MPEG_VERSION_2
+    bitrate = MPEG_BITRATES[(table_version, layer)][bitrate_index] * 1000
+    sample_rate = MPEG_SAMPLE_RATES[version][sample_rate_index]
+    padding = (b2 >> 1) & 0x01
+    channels = 1 if b3 >> 6 == 3 else 2
+
+    if layer == 1:
+        samples = 384
+        length = (12 * bitrate // sample_rate + padding) * 4
+    else:
+        samples = 1152 if layer == 2 or version == MPEG_VERSION_1 else 576
+        length = samples // 8 * bitrate // sample_rate + padding
+
+    return {
+        "version": version,
+        "layer": layer,
+        "bitrate": bitrate,
+        "sample_rate": sample_rate,
+        "channels": channels,
+        "samples": samples,
+        "length": length,
+    }
+
+
+def _vbr_frame_count(head, offset, frame):
+    """
+    Return the frame count from a Xing/Info or VBRI header in the first frame.
+    """
+    if frame["version"] == MPEG_VERSION_1:
+        side_info = 17 if frame["channels"] == 1 else 32
+    else:
+        side_info = 9 if frame["channels"] == 1 else 17
+
+    xing = offset + 4 + side_info
+    if head[xing:xing + 4] in (b"Xing", b"Info"):
+        flags = struct.unpack(">I", head[xing + 4:xing + 8])[0]
+        if flags & 0x01:
+            return struct.unpack(">I", head[xing + 8:xing + 12])[0]
+
+    vbri = offset + 36
+    if head[vbri:vbri + 4] == b"VBRI":
+        return struct.unpack(">I", head[vbri + 14:vbri + 18])[0]
+    return None
+
+
+def _probe_mpeg(head, size):
+    """
+    Find the first MPEG audio frame that is followed by another valid frame.
+    """
+    for offset in range(len(head) - 3):
+        frame = _mpeg_frame(head, offset)
+        if frame is None:
+            continue
+        following = offset + frame["length"]
+        if following + 4 <= len(head) and _mpeg_frame(head, following) is None:
+            continue
+
+        frames = _vbr_frame_count(head, offset, frame)
+        audio_bytes = size - offset
+        if frames:
+            duration_ms = frames * frame["samples"] * 1000 // frame["sample_rate"]
+            bitrate = audio_bytes * 8000 // duration_ms if duration_ms else frame["bitrate"]
+        else:
+            duration_ms = audio_bytes * 8000 // frame["bitrate"]
+            bitrate = frame["bitrate"]
+        return AudioInfo("mp3", duration_ms, frame["sample_rate"], frame["channels"], bitrate)
+    return None
+
+
+def _probe_adts(head, size):
+    """
+    Read ADTS frame headers at the start of the stream and estimate the duration.
+    """
+    if len(head) < 7 or head[0] != 0xFF or (head[1] & 0xF6) != 0xF0:
+        return None
+
+    sample_rate_index = (head[2] >> 2) & 0x0F
+    if sample_rate_index >= len(ADTS_SAMPLE_RATES):
+        return None
+    sample_rate = ADTS_SAMPLE_RATES[sample_rate_index]
+    channels = ((head[2] & 0x01) << 2) | (head[3] >> 6)
+
+    offset = 0
+    lengths = []
+    while offset + 7 <= len(head) and head[offset] == 0xFF and (head[offset + 1] & 0xF6) == 0xF0:
+        length = ((head[offset + 3] & 0x03) << 11) | (head[offset + 4] << 3) | (head[offset + 5] >> 5)
+        if length < 7:
+            break
+        lengths.append(length)
+        offset += length
+    if not lengths:
+        return None
+
+    average = sum(lengths) / len(lengths)
+    duration_ms = int(size / average * 1024 * 1000 / sample_rate)
+    bitrate = int(average * 8 * sample_rate / 1024)
+    return AudioInfo("aac", duration_ms, sample_rate, channels or None, bitrate)
@@ -0,0 +1,64 @@
+"""
+JWT authentication that resolves the user from a short-lived cache.
+
+The stock JWTAuthentication loads the user row on every request. Here the
+fields request handling needs are cached per user id for
+AUTH_USER_CACHE_TIMEOUT seconds and dropped whenever the user is saved or
+deleted (see signals.py), so deactivation takes effect on the next request
+while warm requests spend no queries on authentication. The password hash and
+other credentials never reach the cache; the user is rebuilt from the cached
+fields with the rest deferred.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
+
+# User fields kept in the cache; anything else is loaded on first access
+CACHED_USER_FIELDS = ("id", "username", "is_active", "is_staff", "is_superuser")
+
+
+def user_cache_key(user_id):
+    return f"notes:auth-user:{user_id}"
+
+
+def invalidate_user(user_id):
+    """
+    Drop the cached user now and again once the current transaction commits,
+    so a request racing the write cannot cache the old row for long.
+    """
+    key = user_cache_key(user_id)
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication with the user lookup served from the cache when possible.
+    """
+    def get_user(self, validated_token):
+        # Revocation on password change compares a token claim with the
+        # current password hash, which has to be read fresh.
+        if getattr(api_settings, "CHECK_REVOKE_TOKEN", False):
+            return super().get_user(validated_token)
+
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if user_id is None:
+            return super().get_user(validated_token)
+
+        key = user_cache_key(user_id)
+        values = cache.get(key)
+        if values is None:
+            # Raises for unknown or inactive users, so only usable users are cached.
+            user = super().get_user(validated_token)
+            cache.set(
+                key,
+                {field: getattr(user, field) for field in CACHED_USER_FIELDS},
+                settings.AUTH_USER_CACHE_TIMEOUT,
+            )
+            return user
+
+        # from_db takes the values in model field order.
+        fields = [field.attname for field in self.user_model._meta.concrete_fields if field.attname in values]
+        return self.user_model.from_db(None, fields, [values[field] for field in fields])
@@ -0,0 +1,97 @@
+"""
+Post-upload compaction of WAV audio.
+
+Lecture recordings arrive as 44.1/48 kHz stereo WAV, most of which is wasted
+on speech. The `compact_blob` processing stage rewrites a WAV blob as mono
+16-bit PCM at AUDIO_COMPACT_SAMPLE_RATE (see `dsp.compact_wav`) and moves every
+AudioFile on the blob over to the copy with `storage.replace_blob`. The NumPy
+work runs in a shared pool of AUDIO_COMPACT_PROCESSES worker processes, so
+several worker threads, or `manage.py compactaudio`, keep every core busy.
+Files that are not PCM WAV, are already compact, or would not get smaller
+are left alone.
+"""
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+
+from . import dsp, storage
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Return the process pool, starting it on first use.
+
+    Workers are spawned rather than forked so they never inherit the
+    parent's database connections or threads.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.AUDIO_COMPACT_PROCESSES or None,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
+
+
+def submit(blob):
+    """
+    Start compacting `blob` in the pool; returns `(future, temp_path)`.
+    """
+    temp_dir = os.path.join(settings.MEDIA_ROOT, storage.TEMP_DIR)
+    os.makedirs(temp_dir, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=temp_dir, suffix=".part")
+    os.close(fd)
+    future = get_pool().submit(dsp.compact_wav, blob.file.path, temp_path, settings.AUDIO_COMPACT_SAMPLE_RATE)
+    return future, temp_path
+
+
+def finish(blob, future, temp_path):
+    """
+    Wait for a compaction started by `submit()` and swap the copy in.
+
+    Returns the bytes saved, 0 when the blob was left as it is.
+    """
+    try:
+        result = future.result()
+        size = os.path.getsize(temp_path)
+        if result is None or size >= blob.size:
+            return 0
+        if storage.replace_blob(blob.sha256, temp_path, ".wav") is None:
+            return 0
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    sample_rate, _ = result
+    saved = blob.size - size
+    logger.info(
+        "Compacted blob %s to %d Hz mono: %d -> %d bytes, %d saved",
+        blob.sha256, sample_rate, blob.size, size, saved,
+    )
+    return saved
+
+
+def compact_blob(blob):
+    """
+    Processing stage: replace a WAV blob with its compacted copy.
+    """
+    finish(blob, *submit(blob))
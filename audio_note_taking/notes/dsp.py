@@ -0,0 +1,245 @@
+"""
+Vectorised PCM processing with NumPy.
+
+Nothing here touches Django, so these functions can run in worker processes
+started with the "spawn" method, which import only this module and its
+dependencies. WAV data is memory-mapped and processed in fixed-size blocks,
+so memory use does not grow with the length of the recording.
+"""
+import os
+import wave
+
+import numpy as np
+
+from . import audio_meta
+
+# Output frames produced per block when resampling
+RESAMPLE_BLOCK = 1 << 18
+# Passband edge as a fraction of the output Nyquist frequency
+LOWPASS_CUTOFF = 0.85
+# Low-pass taps per unit of decimation ratio
+LOWPASS_TAPS = 64
+# Voice activity detection: analysis frame length and frames per block
+VAD_FRAME_MS = 20
+VAD_BLOCK_FRAMES = 4096
+# Frames this far below the energy threshold still count as speech when
+# their zero-crossing rate marks them as unvoiced consonants (s, f, sh)
+VAD_ZCR_MARGIN_DB = 6
+VAD_ZCR_THRESHOLD = 0.25
+# Shortest speech kept and padding left around each segment. Trimmed audio
+# keeps at most twice the padding of silence, which stays below
+# AUDIO_VAD_MIN_SILENCE_MS, so trimming it again removes nothing
+VAD_MIN_SPEECH_MS = 100
+VAD_PAD_MS = 200
+
+
+def pcm_reader(path, layout):
+    """
+    Return `(samples, decode, center, scale)` for a PCM WAV, or None if unsupported.
+
+    `samples` is a memory map of shape (frames, channels); `decode` turns a slice
+    of it into numbers, which map onto [-1, 1] as `(value - center) / scale`.
+    """
+    bits = layout.bits_per_sample
+    frames = layout.data_size // layout.block_align if layout.block_align else 0
+    shape = (frames, layout.channels)
+
+    if layout.audio_format == audio_meta.WAVE_FORMAT_PCM and bits in (8, 16, 32):
+        dtype = {8: "u1", 16: "<i2", 32: "<i4"}[bits]
+        center = 128 if bits == 8 else 0
+        decode = np.asarray
+    elif layout.audio_format == audio_meta.WAVE_FORMAT_PCM and bits == 24:
+        dtype = "u1"
+        shape = (frames, layout.channels, 3)
+        center = 0
+
+        def decode(block):
+            value = block.astype(np.int32)
+            value = value[..., 0] | (value[..., 1] << 8) | (value[..., 2] << 16)
+            return (value << 8) >> 8
+    elif layout.audio_format == audio_meta.WAVE_FORMAT_IEEE_FLOAT and bits in (32, 64):
+        dtype = "<f4" if bits == 32 else "<f8"
+        center = 0
+        decode = np.asarray
+    else:
+        return None
+
+    if frames == 0:
+        return np.zeros((0, layout.channels)), np.asarray, 0, 1
+    samples = np.memmap(path, dtype=dtype, mode="r", offset=layout.data_offset, shape=shape)
+    scale = 1.0 if layout.audio_format == audio_meta.WAVE_FORMAT_IEEE_FLOAT else 2 ** (bits - 1)
+    return samples, decode, center, scale
+
+
+def read_layout(path):
+    """
+    Return the WavLayout of the file at `path`, or None if it is not a WAV with data.
+    """
+    with open(path, "rb") as source:
+        layout = audio_meta.read_wav_layout(source, os.path.getsize(path))
+    if layout is None or layout.data_offset is None:
+        return None
+    return layout
+
+
+def lowpass_kernel(ratio):
+    """
+    Return a Blackman-windowed sinc low-pass for decimating by `ratio` (< 1).
+    """
+    taps = int(LOWPASS_TAPS / ratio) | 1
+    cutoff = 0.5 * ratio * LOWPASS_CUTOFF
+    n = np.arange(taps) - taps // 2
+    kernel = 2 * cutoff * np.sinc(2 * cutoff * n) * np.blackman(taps)
+    return kernel / kernel.sum()
+
+
+def fft_filter(signal, kernel):
+    """
+    Convolve `signal` with `kernel` and keep only the fully overlapped part.
+    """
+    size = len(signal) + len(kernel) - 1
+    nfft = 1 << (size - 1).bit_length()
+    filtered = np.fft.irfft(np.fft.rfft(signal, nfft) * np.fft.rfft(kernel, nfft), nfft)
+    return filtered[len(kernel) - 1:len(signal)]
+
+
+def mono_blocks(path, layout):
+    """
+    Return `(frames, read)` where `read(start, stop)` gives frames of the file
+    downmixed to mono float64 in [-1, 1]; out-of-range frames read as silence.
+    """
+    samples, decode, center, scale = pcm_reader(path, layout)
+    frames = len(samples)
+
+    def read(start, stop):
+        block = np.zeros(stop - start)
+        lo, hi = max(start, 0), min(stop, frames)
+        if lo < hi:
+            values = decode(samples[lo:hi]).reshape(hi - lo, layout.channels)
+            block[lo - start:hi - start] = (values.astype(np.float64) - center).mean(axis=1) / scale
+        return block
+
+    return frames, read
+
+
+def compact_wav(source_path, dest_path, sample_rate):
+    """
+    Write a mono 16-bit PCM copy of a WAV file at no more than `sample_rate` Hz.
+
+    Channels are averaged; when the source rate is higher it is low-pass
+    filtered and resampled block by block. Returns `(sample_rate, frames)` of
+    the copy, or None without writing anything when the source is not PCM WAV
+    or is already mono 16-bit at or below the rate.
+    """
+    layout = read_layout(source_path)
+    if layout is None or pcm_reader(source_path, layout) is None:
+        return None
+    already_compact = (
+        layout.channels == 1
+        and layout.audio_format == audio_meta.WAVE_FORMAT_PCM
+        and layout.bits_per_sample == 16
+        and layout.sample_rate <= sample_rate
+    )
+    if already_compact or not layout.sample_rate:
+        return None
+
+    frames, read = mono_blocks(source_path, layout)
+    rate = min(layout.sample_rate, sample_rate)
+    step = layout.sample_rate / rate
+    out_frames = int(frames / step)
+    kernel = lowpass_kernel(1 / step) if step > 1 else np.ones(1)
+    half = len(kernel) // 2
+
+    with wave.open(dest_path, "wb") as out:
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(rate)
+        for first in range(0, out_frames, RESAMPLE_BLOCK):
+            positions = np.arange(first, min(first + RESAMPLE_BLOCK, out_frames)) * step
+            start = int(positions[0])
+            stop = int(positions[-1]) + 2
+            filtered = fft_filter(read(start - half, stop + half), kernel)
+            values = np.interp(positions - start, np.arange(len(filtered)), filtered)
+            out.writeframes(np.clip(np.round(values * 32768), -32768, 32767).astype("<i2").tobytes())
+    return rate, out_frames
+
+
+def speech_segments(path, threshold_db, min_silence_ms):
+    """
+    Find the speech in a PCM WAV file with an energy and zero-crossing detector.
+
+    The downmixed signal is cut into VAD_FRAME_MS frames, a block of frames at
+    a time. A frame is speech when its energy is above `threshold_db` (dBFS),
+    or a little below it with a high zero-crossing rate. Speech runs closer
+    than `min_silence_ms` are joined, runs shorter than VAD_MIN_SPEECH_MS are
+    dropped and the rest are padded by VAD_PAD_MS. Returns `(sample_rate,
+    frames, segments)` with segments as `[start, end)` frame pairs, or None
+    when the file is not PCM WAV.
+    """
+    layout = read_layout(path)
+    if layout is None or pcm_reader(path, layout) is None or not layout.sample_rate:
+        return None
+
+    frames, read = mono_blocks(path, layout)
+    hop = max(layout.sample_rate * VAD_FRAME_MS // 1000, 1)
+    loud = 10 ** (threshold_db / 10)
+    quiet = 10 ** ((threshold_db - VAD_ZCR_MARGIN_DB) / 10)
+    max_gap = -(-min_silence_ms // VAD_FRAME_MS)
+
+    runs = []
+    for first in range(0, frames, hop * VAD_BLOCK_FRAMES):
+        block = read(first, min(first + hop * VAD_BLOCK_FRAMES, frames))
+        count = -(-len(block) // hop)
+        block = np.pad(block, (0, count * hop - len(block))).reshape(count, hop)
+        energy = np.einsum("ij,ij->i", block, block) / hop
+        signs = np.signbit(block)
+        zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / hop
+        speech = (energy > loud) | ((energy > quiet) & (zcr > VAD_ZCR_THRESHOLD))
+
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], speech.astype(np.int8), [0]))))
+        for start, end in (edges.reshape(-1, 2) + first // hop).tolist():
+            if runs and start - runs[-1][1] < max_gap:
+                runs[-1][1] = end
+            else:
+                runs.append([start, end])
+
+    min_speech = -(-VAD_MIN_SPEECH_MS // VAD_FRAME_MS)
+    pad = VAD_PAD_MS // VAD_FRAME_MS
+    segments = []
+    for start, end in runs:
+        if end - start < min_speech:
+            continue
+        start, end = max(start - pad, 0) * hop, min((end + pad) * hop, frames)
+        if segments and start <= segments[-1][1]:
+            segments[-1] = (segments[-1][0], end)
+        else:
+            segments.append((start, end))
+    return layout.sample_rate, frames, segments
+
+
+def trim_wav(source_path, dest_path, segments):
+    """
+    Write a copy of an integer PCM WAV file holding only the `[start, end)` frame ranges in `segments`.
+
+    Sample data is copied unchanged, a block at a time. Returns the number of
+    frames written, or None without writing anything for other formats.
+    """
+    layout = read_layout(source_path)
+    if layout is None or layout.audio_format != audio_meta.WAVE_FORMAT_PCM:
+        return None
+    reader = pcm_reader(source_path, layout)
+    if reader is None:
+        return None
+    samples = reader[0]
+
+    written = 0
+    with wave.open(dest_path, "wb") as out:
+        out.setnchannels(layout.channels)
+        out.setsampwidth(layout.bits_per_sample // 8)
+        out.setframerate(layout.sample_rate)
+        for start, end in segments:
+            for first in range(start, end, RESAMPLE_BLOCK):
+                block = samples[first:min(first + RESAMPLE_BLOCK, end)]
+                out.writeframes(block.tobytes())
+                written += len(block)
+    return written
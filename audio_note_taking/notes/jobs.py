@@ -0,0 +1,138 @@
+"""
+A small database-backed job queue.
+
+Jobs are rows in the `Job` table. `enqueue` inserts them in the caller's
+transaction, so a job becomes visible to workers exactly when the work that
+produced it commits, and disappears with it on rollback. Workers claim jobs
+with `SELECT ... FOR UPDATE SKIP LOCKED`, so any number of them can poll the
+table without blocking each other.
+"""
+import logging
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+
+
+def task(name):
+    """
+    Register a function as the handler for jobs named `name`.
+    """
+    def decorator(func):
+        _registry[name] = func
+        return func
+    return decorator
+
+
+def enqueue(task_name, run_at=None, **payload):
+    """
+    Queue a job for `task_name`; keyword arguments must be JSON serializable.
+    """
+    return Job.objects.create(
+        task=task_name,
+        payload=payload,
+        max_attempts=settings.JOB_MAX_ATTEMPTS,
+        run_at=run_at or timezone.now(),
+    )
+
+
+def enqueue_many(task_name, payloads):
+    """
+    Queue one job for `task_name` per payload dict with a single insert.
+    """
+    now = timezone.now()
+    return Job.objects.bulk_create(
+        [
+            Job(task=task_name, payload=payload, max_attempts=settings.JOB_MAX_ATTEMPTS, run_at=now)
+            for payload in payloads
+        ]
+    )
+
+
+def backoff(attempts):
+    """
+    Return the delay before retrying a job that has failed `attempts` times.
+    """
+    delay = settings.JOB_RETRY_BACKOFF * 2 ** (attempts - 1)
+    return timedelta(seconds=min(delay, settings.JOB_RETRY_BACKOFF_MAX))
+
+
+def claim():
+    """
+    Claim the next due job for this worker, or return None if there is none.
+
+    Jobs left RUNNING by a worker that died are reclaimed after JOB_LOCK_TIMEOUT.
+    """
+    while True:
+        now = timezone.now()
+        stale = now - timedelta(seconds=settings.JOB_LOCK_TIMEOUT)
+        with transaction.atomic():
+            job = (
+                Job.objects.select_for_update(skip_locked=True)
+                .filter(Q(status=Job.QUEUED, run_at__lte=now) | Q(status=Job.RUNNING, locked_at__lt=stale))
+                .order_by("run_at", "id")
+                .first()
+            )
+            if job is None:
+                return None
+
+            # The conditional update keeps claims exclusive on backends without row locks.
+            claimed = Job.objects.filter(pk=job.pk, status=job.status, attempts=job.attempts).update(
+                status=Job.RUNNING, locked_at=now, attempts=F("attempts") + 1
+            )
+        if claimed:
+            job.status = Job.RUNNING
+            job.locked_at = now
+            job.attempts += 1
+            return job
+
+
+def run_job(job):
+    """
+    Run a claimed job, then delete it or schedule a retry. Returns True on success.
+    """
+    try:
+        handler = _registry.get(job.task)
+        if handler is None:
+            raise LookupError(f"No handler registered for task {job.task!r}.")
+        handler(**job.payload)
+    except Exception:
+        error = traceback.format_exc()
+        jobs = Job.objects.filter(pk=job.pk)
+        if job.attempts < job.max_attempts:
+            logger.warning("Job %s (%s) failed, retrying: %s", job.pk, job.task, error)
+            jobs.update(
+                status=Job.QUEUED,
+                run_at=timezone.now() + backoff(job.attempts),
+                locked_at=None,
+                last_error=error,
+            )
+        else:
+            logger.error("Job %s (%s) failed permanently: %s", job.pk, job.task, error)
+            jobs.update(status=Job.FAILED, locked_at=None, last_error=error)
+        return False
+
+    Job.objects.filter(pk=job.pk).delete()
+    return True
+
+
+def run_pending():
+    """
+    Run due jobs in the current thread until none are left. Returns how many ran.
+    """
+    count = 0
+    while True:
+        job = claim()
+        if job is None:
+            return count
+        run_job(job)
+        count += 1
@@ -0,0 +1,274 @@
+import io
+import json
+import math
+import platform
+import random
+import statistics
+import struct
+import time
+import wave
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from notes import response_cache, storage
+from notes.models import AudioFile, Job, Note, Tombstone
+
+SCENARIOS = ["list", "list_cached", "retrieve", "create_with_upload", "update", "destroy"]
+PERCENTILES = [50, 90, 95, 99]
+WORDS = (
+    "meeting lecture interview idea reminder budget design review podcast draft memo "
+    "follow-up customer launch roadmap research summary question answer travel recipe"
+).split()
+
+
+def percentile(values, pct):
+    """
+    Return the `pct` percentile of `values` by linear interpolation.
+    """
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * pct / 100
+    lower = math.floor(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def make_wav(rng, duration_ms=500, sample_rate=8000):
+    """
+    Return a short mono 16-bit WAV of random noise.
+    """
+    frames = sample_rate * duration_ms // 1000
+    samples = struct.pack(f"<{frames}h", *(rng.randint(-2000, 2000) for _ in range(frames)))
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as out:
+        out.setnchannels(1)
+        out.setsampwidth(2)
+        out.setframerate(sample_rate)
+        out.writeframes(samples)
+    return buffer.getvalue()
+
+
+def summarize(timings, queries):
+    """
+    Reduce per-request timings (seconds) and query counts to the reported metrics.
+    """
+    summary = {"requests": len(timings)}
+    for pct in PERCENTILES:
+        summary[f"p{pct}_ms"] = round(percentile(timings, pct) * 1000, 3)
+    summary["mean_ms"] = round(statistics.fmean(timings) * 1000, 3)
+    summary["throughput_rps"] = round(len(timings) / sum(timings), 1) if sum(timings) else None
+    summary["queries"] = int(statistics.median(queries))
+    return summary
+
+
+def compare(results, baseline, tolerance):
+    """
+    Return human-readable regressions of `results` against `baseline`.
+
+    Latency regresses when p50 or p95 grows by more than `tolerance` (a
+    fraction); queries regress on any increase.
+    """
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        for metric in ("p50_ms", "p95_ms"):
+            if previous[metric] and current[metric] > previous[metric] * (1 + tolerance):
+                regressions.append(
+                    f"{name}: {metric} {previous[metric]:.2f} -> {current[metric]:.2f} "
+                    f"(+{(current[metric] / previous[metric] - 1) * 100:.0f}%)"
+                )
+        if current["queries"] > previous["queries"]:
+            regressions.append(f"{name}: queries {previous['queries']} -> {current['queries']}")
+    return regressions
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed synthetic users, notes and audio files, measure latency, throughput and "
+        "query counts of the notes API, write them as JSON and compare against a baseline. "
+        "Writes to the configured database; the seeded data is removed afterwards. "
+        "Requests go to the test host 'testserver', which is added to ALLOWED_HOSTS for the run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=3, help="Users to seed (default: 3).")
+        parser.add_argument("--notes", type=int, default=200, help="Notes per user (default: 200).")
+        parser.add_argument("--audio", type=int, default=2, help="Audio files per note (default: 2).")
+        parser.add_argument(
+            "--iterations", type=int, default=50, help="Timed requests per scenario (default: 50)."
+        )
+        parser.add_argument("--warmup", type=int, default=5, help="Untimed requests per scenario (default: 5).")
+        parser.add_argument("--seed", type=int, default=0, help="Random seed for the synthetic data (default: 0).")
+        parser.add_argument(
+            "--output", default="benchmark.json", help="Where to write the results (default: benchmark.json)."
+        )
+        parser.add_argument("--baseline", help="Results file to compare against.")
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.25,
+            help="Allowed p50/p95 slowdown against the baseline as a fraction (default: 0.25).",
+        )
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        self.client = APIClient()
+        self.rng = rng
+
+        self.stdout.write(
+            f"Seeding {options['users']} users x {options['notes']} notes x {options['audio']} audio files."
+        )
+        users = self.seed(rng, options)
+        try:
+            user = users[0]
+            token = str(RefreshToken.for_user(user).access_token)
+            self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+            results = {}
+            # The in-process client sends Host: testserver, which Django
+            # rejects with a 400 unless it is an allowed host.
+            with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]):
+                for name in SCENARIOS:
+                    timings, queries = self.run_scenario(name, user, options)
+                    results[name] = summarize(timings, queries)
+        finally:
+            self.cleanup(users)
+
+        report = {
+            "meta": {
+                "created_at": timezone.now().isoformat(),
+                "users": options["users"],
+                "notes_per_user": options["notes"],
+                "audio_per_note": options["audio"],
+                "iterations": options["iterations"],
+                "seed": options["seed"],
+                "database": connection.vendor,
+                "django": django.get_version(),
+                "python": platform.python_version(),
+            },
+            "results": results,
+        }
+        with open(options["output"], "w") as out:
+            json.dump(report, out, indent=2)
+            out.write("\n")
+
+        self.stdout.write(f"{'scenario':<20}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}{'queries':>9}")
+        for name, summary in results.items():
+            self.stdout.write(
+                f"{name:<20}{summary['p50_ms']:>10.2f}{summary['p95_ms']:>10.2f}"
+                f"{summary['p99_ms']:>10.2f}{summary['throughput_rps'] or 0:>10.1f}{summary['queries']:>9}"
+            )
+        self.stdout.write(f"Results written to {options['output']}.")
+
+        if options["baseline"]:
+            with open(options["baseline"]) as source:
+                baseline = json.load(source)["results"]
+            regressions = compare(results, baseline, options["tolerance"])
+            if regressions:
+                raise CommandError("Regressions against the baseline:\n" + "\n".join(regressions))
+            self.stdout.write(self.style.SUCCESS("No regressions against the baseline."))
+
+    def seed(self, rng, options):
+        """
+        Create the synthetic users, notes and audio files.
+
+        Notes are bulk-inserted; audio goes through the regular storage path
+        so blobs, metadata and jobs look like production data.
+        """
+        run = time.time_ns()
+        clips = [make_wav(rng) for _ in range(8)]
+        users = []
+        for i in range(options["users"]):
+            user = User.objects.create_user(username=f"benchmark-{run}-{i}")
+            notes = Note.objects.bulk_create(
+                [
+                    Note(user=user, title=f"Note {j}", description=" ".join(rng.choices(WORDS, k=30)))
+                    for j in range(options["notes"])
+                ]
+            )
+            for note in notes:
+                for k in range(options["audio"]):
+                    upload = SimpleUploadedFile(f"clip{k}.wav", rng.choice(clips), content_type="audio/wav")
+                    storage.save_audio_file(note, upload)
+            users.append(user)
+        return users
+
+    def cleanup(self, users):
+        """
+        Delete the seeded users and everything the run left behind.
+
+        Only the benchmark's own blobs are purged and only their jobs dropped,
+        so work queued by the application is left to the workers. The users'
+        tombstones go too.
+        """
+        hashes = list(
+            AudioFile.objects.filter(note__user__in=users, blob__isnull=False)
+            .values_list("blob_id", flat=True)
+            .distinct()
+        )
+        user_ids = [user.id for user in users]
+        for user in users:
+            user.delete()
+        for sha256 in hashes:
+            storage.purge_blob(sha256)
+        Job.objects.filter(task__in=["process_blob", "purge_blob"], payload__sha256__in=hashes).delete()
+        Tombstone.objects.filter(user_id__in=user_ids).delete()
+
+    def run_scenario(self, name, user, options):
+        """
+        Time `warmup + iterations` requests of one scenario and return the
+        timed durations and query counts.
+        """
+        note_ids = list(Note.objects.filter(user=user).values_list("id", flat=True))
+        timings, queries = [], []
+        for i in range(options["warmup"] + options["iterations"]):
+            method, path, data, fmt, expected = self.prepare(name, user, note_ids)
+            kwargs = {"data": data, "format": fmt} if data is not None else {}
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = getattr(self.client, method)(path, **kwargs)
+                elapsed = time.perf_counter() - started
+            if response.status_code != expected:
+                raise CommandError(f"{name}: expected {expected}, got {response.status_code} from {path}.")
+            if i >= options["warmup"]:
+                timings.append(elapsed)
+                queries.append(len(captured))
+        return timings, queries
+
+    def prepare(self, name, user, note_ids):
+        """
+        Return `(method, path, data, format, expected status)` for the next request.
+        """
+        if name == "list":
+            # Invalidate the response cache so the list is rendered every time.
+            response_cache.bump_version(user.id)
+            return "get", "/api/notes/", None, None, 200
+        if name == "list_cached":
+            return "get", "/api/notes/", None, None, 200
+        if name == "retrieve":
+            response_cache.bump_version(user.id)
+            return "get", f"/api/notes/{self.rng.choice(note_ids)}/", None, None, 200
+        if name == "create_with_upload":
+            data = {
+                "title": "Benchmark upload",
+                "description": "Created by the benchmark",
+                "uploaded_audios": [SimpleUploadedFile("new.wav", make_wav(self.rng), content_type="audio/wav")],
+            }
+            return "post", "/api/notes/", data, "multipart", 201
+        if name == "update":
+            data = {"title": f"Renamed {self.rng.randrange(10 ** 6)}"}
+            return "patch", f"/api/notes/{self.rng.choice(note_ids)}/", data, "json", 200
+        if name == "destroy":
+            note = Note.objects.create(user=user, title="Doomed", description="Deleted by the benchmark")
+            return "delete", f"/api/notes/{note.id}/", None, None, 204
+        raise CommandError(f"Unknown scenario {name}.")
@@ -0,0 +1,200 @@
+import asyncio
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from django.contrib.auth.models import User
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from notes import uploads
+from notes.asgi import AudioTransferMiddleware
+from notes.models import AudioUpload, Note
+
+
+class SlowStream:
+    """
+    A `wsgi.input` that hands out the body one piece at a time with a delay,
+    like a client on a slow uplink.
+    """
+    def __init__(self, data, piece_size, delay):
+        self.data = data
+        self.piece_size = piece_size
+        self.delay = delay
+        self.position = 0
+
+    def read(self, size=-1):
+        if self.position >= len(self.data):
+            return b""
+        if self.position % self.piece_size == 0:
+            time.sleep(self.delay)
+        piece_end = (self.position // self.piece_size + 1) * self.piece_size
+        end = piece_end if size is None or size < 0 else min(piece_end, self.position + size)
+        data = self.data[self.position:end]
+        self.position += len(data)
+        return data
+
+    def readline(self, size=-1):
+        # Only multipart parsing reads lines; the upload body is read in blocks.
+        return self.read(size)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare chunk uploads from many slow clients through the WSGI views and "
+        "the ASGI fast path. Creates and removes a throwaway user in the configured database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clients", type=int, default=200, help="Concurrent uploads (default: 200).")
+        parser.add_argument("--size", type=int, default=256 * 1024, help="Bytes per upload (default: 256 KB).")
+        parser.add_argument(
+            "--pieces", type=int, default=16, help="Pieces each body arrives in (default: 16)."
+        )
+        parser.add_argument(
+            "--delay", type=float, default=0.05, help="Seconds between pieces (default: 0.05)."
+        )
+        parser.add_argument(
+            "--threads",
+            type=int,
+            default=8,
+            help="WSGI worker threads, as in gunicorn --threads (default: 8).",
+        )
+
+    def handle(self, *args, **options):
+        user = User.objects.create_user(username=f"benchtransfers-{time.time_ns()}")
+        note = Note.objects.create(user=user, title="Benchmark", description="benchtransfers")
+        token = str(RefreshToken.for_user(user).access_token)
+        body = bytes(options["size"])
+        piece_size = -(-options["size"] // options["pieces"])
+
+        try:
+            for label, run in (("wsgi", self.run_wsgi), ("asgi", self.run_asgi)):
+                sessions = self.create_sessions(user, note, options["clients"], options["size"])
+                peak = ThreadPeak()
+                started = time.perf_counter()
+                statuses = run(sessions, token, body, piece_size, options)
+                elapsed = time.perf_counter() - started
+                peak.stop()
+
+                ok = statuses.count(200)
+                errors = dict(Counter(code for code in statuses if code != 200))
+                self.stdout.write(
+                    f"{label}: {ok}/{len(statuses)} ok in {elapsed:.2f}s, "
+                    f"{len(statuses) / elapsed:.1f} uploads/s, "
+                    f"{len(body) * ok / elapsed / 1024 / 1024:.1f} MB/s, peak threads {peak.value}"
+                    + (f", errors {errors}" if errors else "")
+                )
+                for upload in sessions:
+                    upload.delete()
+        finally:
+            user.delete()
+
+    def create_sessions(self, user, note, count, size):
+        sessions = AudioUpload.objects.bulk_create(
+            [
+                AudioUpload(user=user, note=note, filename=f"bench-{i}.wav", content_type="audio/wav", size=size)
+                for i in range(count)
+            ]
+        )
+        for upload in sessions:
+            uploads.allocate(upload)
+        return sessions
+
+    def run_wsgi(self, sessions, token, body, piece_size, options):
+        """
+        Send every upload through the WSGI handler from a fixed pool of worker threads.
+        """
+        application = get_wsgi_application()
+        host = next((h.lstrip(".") for h in settings.ALLOWED_HOSTS if h and h != "*"), "localhost")
+
+        def upload(session):
+            environ = {
+                "REQUEST_METHOD": "PUT",
+                "PATH_INFO": f"/api/uploads/{session.pk}/",
+                "QUERY_STRING": "",
+                "SERVER_NAME": host,
+                "SERVER_PORT": "80",
+                "HTTP_HOST": host,
+                "CONTENT_TYPE": "application/octet-stream",
+                "CONTENT_LENGTH": str(len(body)),
+                "HTTP_AUTHORIZATION": f"Bearer {token}",
+                "HTTP_CONTENT_RANGE": f"bytes 0-{len(body) - 1}/{len(body)}",
+                "wsgi.input": SlowStream(body, piece_size, options["delay"]),
+                "wsgi.url_scheme": "http",
+                "wsgi.errors": self.stderr,
+            }
+            result = {}
+
+            def start_response(status, headers, exc_info=None):
+                result["status"] = int(status.split()[0])
+
+            response = application(environ, start_response)
+            for _ in response:
+                pass
+            response.close()
+            return result["status"]
+
+        with ThreadPoolExecutor(max_workers=options["threads"]) as pool:
+            return list(pool.map(upload, sessions))
+
+    def run_asgi(self, sessions, token, body, piece_size, options):
+        """
+        Send every upload through the ASGI application on one event loop.
+        """
+        application = AudioTransferMiddleware(get_asgi_application())
+
+        async def upload(session):
+            pieces = [body[i:i + piece_size] for i in range(0, len(body), piece_size)]
+            scope = {
+                "type": "http",
+                "method": "PUT",
+                "path": f"/api/uploads/{session.pk}/",
+                "query_string": b"",
+                "headers": [
+                    (b"authorization", f"Bearer {token}".encode()),
+                    (b"content-range", f"bytes 0-{len(body) - 1}/{len(body)}".encode()),
+                ],
+            }
+            result = {}
+
+            async def receive():
+                if not pieces:
+                    return {"type": "http.disconnect"}
+                await asyncio.sleep(options["delay"])
+                return {"type": "http.request", "body": pieces.pop(0), "more_body": bool(pieces)}
+
+            async def send(message):
+                if message["type"] == "http.response.start":
+                    result["status"] = message["status"]
+
+            await application(scope, receive, send)
+            return result["status"]
+
+        async def main():
+            return await asyncio.gather(*(upload(session) for session in sessions))
+
+        return list(asyncio.run(main()))
+
+
+class ThreadPeak:
+    """
+    Sample the number of live threads in the background and keep the maximum.
+    """
+    def __init__(self, interval=0.01):
+        self.value = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, args=(interval,), daemon=True)
+        self._thread.start()
+
+    def _sample(self, interval):
+        while not self._stop.wait(interval):
+            self.value = max(self.value, threading.active_count())
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
@@ -0,0 +1,73 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from notes import compaction
+from notes.models import AudioBlob
+
+
+class Command(BaseCommand):
+    help = (
+        "Compact existing WAV blobs to mono 16-bit PCM at AUDIO_COMPACT_SAMPLE_RATE "
+        "using the compaction process pool, and report the bytes saved. At most two "
+        "blobs per process are in flight at a time."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, help="Compact at most this many blobs.")
+
+    def handle(self, *args, **options):
+        # Blobs written by this run are already compact, so leave them out.
+        blobs = AudioBlob.objects.filter(
+            ref_count__gt=0, file__iendswith=".wav", created_at__lte=timezone.now()
+        ).order_by("created_at")
+        if options["limit"]:
+            blobs = blobs[:options["limit"]]
+
+        processes = settings.AUDIO_COMPACT_PROCESSES or os.cpu_count()
+        self.stdout.write(
+            f"Compacting to {settings.AUDIO_COMPACT_SAMPLE_RATE} Hz mono with {processes} processes."
+        )
+        compacted = saved = total = 0
+        remaining = blobs.iterator()
+        pending = {}
+        try:
+            while True:
+                # Keep the pool busy without queueing work items and temp
+                # files for every blob up front.
+                for blob in remaining:
+                    future, temp_path = compaction.submit(blob)
+                    pending[future] = (blob, temp_path)
+                    if len(pending) >= 2 * processes:
+                        break
+                if not pending:
+                    break
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    blob, temp_path = pending.pop(future)
+                    total += 1
+                    try:
+                        blob_saved = compaction.finish(blob, future, temp_path)
+                    except Exception as exc:
+                        self.stderr.write(f"{blob.sha256}: {exc}")
+                        continue
+                    if blob_saved:
+                        compacted += 1
+                        saved += blob_saved
+                        self.stdout.write(f"{blob.sha256}: saved {blob_saved} bytes")
+        finally:
+            # Work left after an error is dropped once the pool has stopped writing.
+            for future in pending:
+                future.cancel()
+            compaction.shutdown_pool()
+            for _, temp_path in pending.values():
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Compacted {compacted} of {total} WAV blobs, saved {saved} bytes.")
+        )
@@ -0,0 +1,258 @@
+import json
+import os
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from notes import jobs, storage, sync
+from notes.models import AudioBlob, AudioFile, AudioUpload
+
+# Directories under MEDIA_ROOT that hold audio, scanned in this order
+SCANNED_DIRS = ["audio_notes", "audio_uploads"]
+UPLOADS_DIR = "audio_uploads"
+
+
+class Command(BaseCommand):
+    help = (
+        "Find media files with no database row and audio rows whose file is gone, "
+        "and prune expired changes feed tombstones. "
+        "Files are streamed with os.scandir and checked against the database in batches; "
+        "progress is checkpointed so an interrupted run resumes where it stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Report what would be removed and change nothing.")
+        parser.add_argument(
+            "--grace",
+            type=int,
+            default=24 * 3600,
+            help="Leave files and rows younger than this many seconds alone, "
+            "so in-flight uploads are not collected (default: 86400).",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=1000, help="Files or rows checked per query (default: 1000)."
+        )
+        parser.add_argument(
+            "--checkpoint", help="Progress file (default: .gc_media.json in MEDIA_ROOT)."
+        )
+        parser.add_argument("--restart", action="store_true", help="Ignore an existing checkpoint.")
+
+    def handle(self, *args, **options):
+        self.dry_run = options["dry_run"]
+        self.batch_size = options["batch_size"]
+        self.cutoff = time.time() - options["grace"]
+        self.verbosity = options["verbosity"]
+        self.checkpoint_path = options["checkpoint"] or os.path.join(settings.MEDIA_ROOT, ".gc_media.json")
+
+        self.state = self.load_checkpoint(options["restart"])
+        self.stats = Counter(self.state["stats"])
+        if self.state["done_dirs"] or self.state["blobs_after"] or self.state["files_after"]:
+            self.stdout.write(f"Resuming from {self.checkpoint_path}.")
+
+        self.scan_files()
+        self.check_blobs()
+        self.check_legacy_files()
+        tombstones = sync.prune_tombstones(dry_run=self.dry_run)
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+        verb = "Would remove" if self.dry_run else "Removed"
+        self.stdout.write(
+            f"Scanned {self.stats['files_scanned']} files ({self.stats['files_in_grace']} within the grace period) "
+            f"and {self.stats['rows_checked']} rows."
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{verb} {self.stats['orphaned_files']} orphaned files "
+                f"({self.stats['orphaned_bytes']} bytes), {self.stats['dangling_files']} audio files "
+                f"with missing data and {self.stats['stale_blobs']} unreferenced blobs; "
+                f"{'would fix' if self.dry_run else 'fixed'} {self.stats['ref_counts_fixed']} reference counts."
+            )
+        )
+        self.stdout.write(f"{verb} {tombstones} expired changes feed tombstones.")
+
+    def load_checkpoint(self, restart):
+        state = {"dry_run": self.dry_run, "done_dirs": [], "blobs_after": "", "files_after": 0, "stats": {}}
+        if restart or not os.path.exists(self.checkpoint_path):
+            return state
+        with open(self.checkpoint_path) as source:
+            saved = json.load(source)
+        # A dry run's progress says nothing about what a real run has removed.
+        return saved if saved.get("dry_run") == self.dry_run else state
+
+    def save_checkpoint(self):
+        self.state["stats"] = dict(self.stats)
+        temp_path = f"{self.checkpoint_path}.tmp"
+        with open(temp_path, "w") as out:
+            json.dump(self.state, out)
+        os.replace(temp_path, self.checkpoint_path)
+
+    def report(self, message):
+        if self.verbosity >= 2:
+            self.stdout.write(f"{'Would remove' if self.dry_run else 'Removing'} {message}")
+
+    def scan_files(self):
+        """
+        Walk the media directories depth first, checking files a batch at a time.
+
+        Only the current directory's subdirectory names are held in memory.
+        A directory is recorded in the checkpoint once its files are done.
+        """
+        done = set(self.state["done_dirs"])
+        stack = list(reversed(SCANNED_DIRS))
+        while stack:
+            relative = stack.pop()
+            subdirs, batch = [], []
+            try:
+                entries = os.scandir(os.path.join(settings.MEDIA_ROOT, relative))
+            except FileNotFoundError:
+                continue
+            with entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.name)
+                        continue
+                    if relative in done or not entry.is_file(follow_symlinks=False):
+                        continue
+                    self.stats["files_scanned"] += 1
+                    info = entry.stat(follow_symlinks=False)
+                    if info.st_mtime > self.cutoff:
+                        self.stats["files_in_grace"] += 1
+                        continue
+                    batch.append((entry.name, info.st_size))
+                    if len(batch) >= self.batch_size:
+                        self.collect_files(relative, batch)
+                        batch = []
+            if batch:
+                self.collect_files(relative, batch)
+            if relative not in done:
+                done.add(relative)
+                self.state["done_dirs"].append(relative)
+                self.save_checkpoint()
+            stack.extend(f"{relative}/{name}" for name in sorted(subdirs, reverse=True))
+
+    def collect_files(self, relative, batch):
+        """
+        Remove the files in `batch` (`(name, size)` pairs in `relative`) that nothing references.
+        """
+        names = [name for name, _ in batch]
+        known = self.referenced(relative, names)
+        for name, size in batch:
+            if name in known:
+                continue
+            self.stats["orphaned_files"] += 1
+            self.stats["orphaned_bytes"] += size
+            self.report(f"orphaned file {relative}/{name}")
+            if not self.dry_run:
+                try:
+                    os.remove(os.path.join(settings.MEDIA_ROOT, relative, name))
+                except FileNotFoundError:
+                    pass
+
+    def referenced(self, relative, names):
+        """
+        Return the subset of `names` in directory `relative` that the database still refers to.
+        """
+        if relative.startswith(f"{storage.BLOB_DIR}/"):
+            files = set(
+                AudioBlob.objects.filter(pk__in=[name[:64] for name in names]).values_list("file", flat=True)
+            )
+            return {name for name in names if f"{relative}/{name}" in files}
+        if relative.startswith(f"{storage.DERIVED_DIR}/"):
+            blobs = set(AudioBlob.objects.filter(pk__in=[name[:64] for name in names]).values_list("pk", flat=True))
+            return {name for name in names if name[:64] in blobs}
+        if f"{relative}/".startswith(f"{storage.TEMP_DIR}/"):
+            # Temporary files only live for the request or job writing them.
+            return set()
+        if f"{relative}/".startswith(f"{UPLOADS_DIR}/"):
+            ids = {}
+            for name in names:
+                try:
+                    ids[uuid.UUID(os.path.splitext(name)[0])] = name
+                except ValueError:
+                    pass
+            sessions = AudioUpload.objects.filter(pk__in=list(ids)).values_list("pk", flat=True)
+            return {ids[pk] for pk in sessions}
+
+        paths = [f"{relative}/{name}" for name in names]
+        files = set(AudioFile.objects.filter(audio__in=paths).values_list("audio", flat=True))
+        files.update(AudioBlob.objects.filter(file__in=paths).values_list("file", flat=True))
+        return {name for name in names if f"{relative}/{name}" in files}
+
+    def check_blobs(self):
+        """
+        Check blobs in primary key order: fix reference counts that disagree
+        with the AudioFile rows, drop files whose blob data is gone and purge
+        unreferenced blobs whose `purge_blob` job never ran.
+        """
+        file_storage = AudioBlob._meta.get_field("file").storage
+        while True:
+            blobs = list(
+                AudioBlob.objects.filter(pk__gt=self.state["blobs_after"])
+                .annotate(refs=Count("audio_files"))
+                .order_by("pk")[:self.batch_size]
+            )
+            if not blobs:
+                break
+            for blob in blobs:
+                self.stats["rows_checked"] += 1
+                if blob.created_at.timestamp() > self.cutoff:
+                    continue
+                if blob.ref_count != blob.refs:
+                    self.stats["ref_counts_fixed"] += 1
+                    if self.verbosity >= 2:
+                        self.stdout.write(f"Blob {blob.sha256} has {blob.refs} files but ref_count {blob.ref_count}")
+                    if not self.dry_run:
+                        self.fix_ref_count(blob.sha256)
+                if blob.refs and not file_storage.exists(blob.file.name):
+                    self.stats["dangling_files"] += blob.refs
+                    self.report(f"{blob.refs} audio files on missing blob {blob.file.name}")
+                    if not self.dry_run:
+                        AudioFile.objects.filter(blob=blob).delete()
+                elif not blob.refs and not blob.ref_count:
+                    self.stats["stale_blobs"] += 1
+                    self.report(f"unreferenced blob {blob.file.name}")
+                    if not self.dry_run:
+                        storage.purge_blob(blob.sha256)
+            self.state["blobs_after"] = blobs[-1].pk
+            self.save_checkpoint()
+
+    def fix_ref_count(self, sha256):
+        with transaction.atomic():
+            blob = AudioBlob.objects.select_for_update().filter(pk=sha256).first()
+            if blob is None:
+                return
+            refs = AudioFile.objects.filter(blob=blob).count()
+            AudioBlob.objects.filter(pk=sha256).update(ref_count=refs)
+            if refs == 0 and blob.ref_count:
+                jobs.enqueue("purge_blob", sha256=sha256)
+
+    def check_legacy_files(self):
+        """
+        Remove AudioFile rows without a blob whose file no longer exists.
+        """
+        file_storage = AudioFile._meta.get_field("audio").storage
+        while True:
+            rows = list(
+                AudioFile.objects.filter(blob__isnull=True, pk__gt=self.state["files_after"])
+                .order_by("pk")
+                .values_list("pk", "audio", "uploaded_at")[:self.batch_size]
+            )
+            if not rows:
+                break
+            missing = []
+            for pk, name, uploaded_at in rows:
+                self.stats["rows_checked"] += 1
+                if uploaded_at.timestamp() <= self.cutoff and not (name and file_storage.exists(name)):
+                    missing.append(pk)
+                    self.report(f"audio file {pk} with missing file {name or '(none)'}")
+            self.stats["dangling_files"] += len(missing)
+            if missing and not self.dry_run:
+                AudioFile.objects.filter(pk__in=missing).delete()
+            self.state["files_after"] = rows[-1][0]
+            self.save_checkpoint()
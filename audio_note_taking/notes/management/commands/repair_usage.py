@@ -0,0 +1,42 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from notes import usage
+from notes.models import Note
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the audio counters on notes and the per-user storage usage from "
+        "the AudioFile rows, and fix any that have drifted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Report drifted counters without fixing them.")
+        parser.add_argument(
+            "--batch-size", type=int, default=500, help="Notes or users recomputed per transaction (default: 500)."
+        )
+
+    def handle(self, *args, **options):
+        notes = self.repair(Note.objects.all(), usage.repair_notes, options)
+        users = self.repair(User.objects.all(), usage.repair_users, options)
+        verb = "Found" if options["dry_run"] else "Fixed"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {notes} notes and {users} users with drifted counters."))
+
+    def repair(self, queryset, repair_batch, options):
+        """
+        Run `repair_batch` over the primary keys of `queryset` in key order; returns how many drifted.
+        """
+        drifted, after = 0, None
+        while True:
+            batch = queryset.order_by("pk")
+            if after is not None:
+                batch = batch.filter(pk__gt=after)
+            ids = list(batch.values_list("pk", flat=True)[:options["batch_size"]])
+            if not ids:
+                return drifted
+            for pk in repair_batch(ids, dry_run=options["dry_run"]):
+                drifted += 1
+                if options["verbosity"] >= 2:
+                    self.stdout.write(f"{queryset.model.__name__} {pk} has drifted counters")
+            after = ids[-1]
@@ -0,0 +1,80 @@
+import logging
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, close_old_connections, connection
+
+from notes import jobs
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Run background job workers that claim jobs from the database."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency", type=int, default=1, help="Number of worker threads (default: 1)."
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=1.0,
+            help="Seconds to wait before polling again when the queue is empty (default: 1).",
+        )
+        parser.add_argument(
+            "--burst", action="store_true", help="Exit once there are no due jobs left."
+        )
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: stop.set())
+
+        concurrency = max(options["concurrency"], 1)
+        args = (stop, options["poll_interval"], options["burst"])
+        self.stdout.write(f"Starting {concurrency} worker(s).")
+
+        if concurrency == 1:
+            self.work(*args)
+        else:
+            threads = [
+                threading.Thread(target=self.work_in_thread, args=args, name=f"worker-{i}", daemon=True)
+                for i in range(concurrency)
+            ]
+            for thread in threads:
+                thread.start()
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(timeout=0.5)
+        self.stdout.write("Workers stopped.")
+
+    def work(self, stop, poll_interval, burst):
+        """
+        Claim and run jobs until asked to stop.
+        """
+        while not stop.is_set():
+            close_old_connections()
+            try:
+                job = jobs.claim()
+            except DatabaseError:
+                # Lost connections or lock timeouts should not kill the worker.
+                logger.exception("Could not claim a job, retrying.")
+                stop.wait(poll_interval)
+                continue
+            if job is not None:
+                jobs.run_job(job)
+            elif burst:
+                break
+            else:
+                stop.wait(poll_interval)
+
+    def work_in_thread(self, *args):
+        """
+        Run `work` in a worker thread, closing the thread's own DB connection at the end.
+        """
+        try:
+            self.work(*args)
+        finally:
+            connection.close()
@@ -0,0 +1,131 @@
+"""
+In-process request metrics rendered in the Prometheus text format.
+
+RequestMetricsMiddleware observes every request into the histograms below,
+labelled by view and method, and AudioTransferMiddleware does the same for the
+transfers it serves on the ASGI fast path. Code that writes to media storage reports the
+bytes with `record_media_write()`, which adds them to the current request, if
+any. Histograms live in process memory, so with several worker processes
+each exposes its own series; scrape every process or run one per container.
+"""
+import threading
+from contextvars import ContextVar
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+BYTE_BUCKETS = (0, 1024, 10 * 1024, 100 * 1024, 1024 ** 2, 10 * 1024 ** 2, 100 * 1024 ** 2, 1024 ** 3)
+
+_media_written = ContextVar("notes_media_written", default=None)
+
+
+class Histogram:
+    """
+    A Prometheus histogram with one series per label combination.
+    """
+    def __init__(self, name, documentation, buckets, labelnames):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["buckets"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        """
+        Return the exposition lines for this histogram.
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((key, dict(value, buckets=list(value["buckets"]))) for key, value in self._series.items())
+        for key, value in series:
+            labels = ",".join(f'{name}="{_escape(label)}"' for name, label in zip(self.labelnames, key))
+            for bound, count in zip(self.buckets, value["buckets"]):
+                lines.append(f'{self.name}_bucket{{{labels},le="{float(bound)!r}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {value["count"]}')
+            lines.append(f"{self.name}_sum{{{labels}}} {value['sum']!r}")
+            lines.append(f"{self.name}_count{{{labels}}} {value['count']}")
+        return lines
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+LABELS = ("view", "method")
+
+REQUEST_DURATION = Histogram(
+    "notes_request_duration_seconds", "Wall time spent handling a request.", DURATION_BUCKETS, LABELS
+)
+SQL_QUERIES = Histogram("notes_request_sql_queries", "SQL queries run by a request.", QUERY_BUCKETS, LABELS)
+SQL_DURATION = Histogram(
+    "notes_request_sql_seconds", "Time a request spent waiting on SQL queries.", DURATION_BUCKETS, LABELS
+)
+UPLOAD_BYTES = Histogram("notes_request_upload_bytes", "Request body size.", BYTE_BUCKETS, LABELS)
+MEDIA_WRITTEN_BYTES = Histogram(
+    "notes_request_media_written_bytes", "Bytes a request wrote to media storage.", BYTE_BUCKETS, LABELS
+)
+
+REGISTRY = [REQUEST_DURATION, SQL_QUERIES, SQL_DURATION, UPLOAD_BYTES, MEDIA_WRITTEN_BYTES]
+
+
+def render():
+    """
+    Return every metric in the Prometheus text exposition format.
+    """
+    lines = []
+    for histogram in REGISTRY:
+        lines.extend(histogram.render())
+    return "\n".join(lines) + "\n"
+
+
+def observe_request(view, method, duration, queries=0, sql_seconds=0.0, upload_bytes=0, media_written=0):
+    """
+    Record one finished request into every histogram.
+    """
+    labels = {"view": view, "method": method}
+    REQUEST_DURATION.observe(duration, **labels)
+    SQL_QUERIES.observe(queries, **labels)
+    SQL_DURATION.observe(sql_seconds, **labels)
+    UPLOAD_BYTES.observe(upload_bytes, **labels)
+    MEDIA_WRITTEN_BYTES.observe(media_written, **labels)
+
+
+def start_media_counter():
+    """
+    Start counting media writes for the current request; returns a reset token.
+    """
+    return _media_written.set([0])
+
+
+def stop_media_counter(token):
+    """
+    Stop counting and return the bytes written since `start_media_counter()`.
+    """
+    counter = _media_written.get()
+    _media_written.reset(token)
+    return counter[0]
+
+
+def record_media_write(size):
+    """
+    Add `size` bytes to the current request's media write counter, if any.
+    """
+    counter = _media_written.get()
+    if counter is not None:
+        counter[0] += size
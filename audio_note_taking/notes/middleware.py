@@ -0,0 +1,103 @@
+"""
+Middleware that feeds the request metrics and samples slow-request profiles.
+"""
+import cProfile
+import logging
+import os
+import random
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class QueryCounter:
+    """
+    Database execute wrapper that counts queries and the time spent in them.
+    """
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.count += 1
+
+
+class RequestMetricsMiddleware:
+    """
+    Record wall time, SQL queries and time, upload size and media bytes written
+    for every request, labelled by view, into the histograms in `metrics`.
+
+    With PROFILE_SAMPLE_RATE above 0, that fraction of requests runs under
+    cProfile and the profile is written to PROFILE_DIR when the request took
+    longer than PROFILE_SLOW_REQUEST_MS. Unsampled requests pay no profiling cost.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = QueryCounter()
+        media_token = metrics.start_media_counter()
+        profiler = cProfile.Profile() if self.should_profile() else None
+
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(queries))
+                if profiler is not None:
+                    profiler.enable()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    if profiler is not None:
+                        profiler.disable()
+        finally:
+            elapsed = time.perf_counter() - started
+            media_written = metrics.stop_media_counter(media_token)
+
+        labels = {"view": self.view_label(request), "method": request.method}
+        metrics.observe_request(
+            duration=elapsed,
+            queries=queries.count,
+            sql_seconds=queries.seconds,
+            upload_bytes=int(request.META.get("CONTENT_LENGTH") or 0),
+            media_written=media_written,
+            **labels,
+        )
+
+        if profiler is not None and elapsed * 1000 >= settings.PROFILE_SLOW_REQUEST_MS:
+            self.dump_profile(profiler, labels, elapsed)
+        return response
+
+    def should_profile(self):
+        rate = settings.PROFILE_SAMPLE_RATE
+        return rate > 0 and random.random() < rate
+
+    def view_label(self, request):
+        """
+        Use the URL name so label values stay bounded; unmatched paths share one label.
+        """
+        match = getattr(request, "resolver_match", None)
+        if match is None:
+            return "unresolved"
+        return match.view_name or match.route or "unnamed"
+
+    def dump_profile(self, profiler, labels, elapsed):
+        os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+        stamp = timezone.now().strftime("%Y%m%dT%H%M%S%f")
+        name = f"{labels['view'].replace(':', '_')}-{labels['method']}-{stamp}-{int(elapsed * 1000)}ms.prof"
+        path = os.path.join(settings.PROFILE_DIR, name)
+        profiler.dump_stats(path)
+        logger.info("Slow request profile written to %s", path)
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:33
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("notes", "0003_remove_note_audio_alter_note_user_audiofile"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="note",
+            index=models.Index(
+                fields=["user", "created_at", "id"], name="note_user_created_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("notes", "0005_audioupload"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AudioBlob",
+            fields=[
+                (
+                    "sha256",
+                    models.CharField(max_length=64, primary_key=True, serialize=False),
+                ),
+                ("file", models.FileField(upload_to="audio_notes/blobs/")),
+                ("size", models.BigIntegerField()),
+                ("ref_count", models.PositiveIntegerField(default=0)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="audiofile",
+            name="blob",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="audio_files",
+                to="notes.audioblob",
+            ),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("notes", "0007_job"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="audiofile",
+            name="bitrate",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="audiofile",
+            name="channels",
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="audiofile",
+            name="duration_ms",
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="audiofile",
+            name="sample_rate",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,71 @@
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+# The tsvector column is kept current by a trigger, so bulk_create/bulk_update
+# and raw updates are indexed too. Other databases only get the plain column.
+CREATE_TRIGGER = """
+CREATE FUNCTION notes_note_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('english', coalesce(NEW.title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(NEW.description, '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER notes_note_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF title, description ON notes_note
+    FOR EACH ROW EXECUTE FUNCTION notes_note_search_vector_update();
+
+UPDATE notes_note SET search_vector =
+    setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce(description, '')), 'B');
+
+CREATE INDEX note_search_vector_idx ON notes_note USING gin (search_vector);
+"""
+
+DROP_TRIGGER = """
+DROP INDEX IF EXISTS note_search_vector_idx;
+DROP TRIGGER IF EXISTS notes_note_search_vector_trigger ON notes_note;
+DROP FUNCTION IF EXISTS notes_note_search_vector_update();
+"""
+
+
+def create_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(CREATE_TRIGGER)
+
+
+def drop_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(DROP_TRIGGER)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("notes", "0008_audiofile_stream_info"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="note",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True
+            ),
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(
+                    model_name="note",
+                    index=django.contrib.postgres.indexes.GinIndex(
+                        fields=["search_vector"], name="note_search_vector_idx"
+                    ),
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(create_trigger, drop_trigger),
+            ],
+        ),
+    ]
@@ -0,0 +1,92 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:21
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def _total(queryset, group, expression):
+    """
+    Return a subquery of `expression` over `queryset` grouped by `group`, 0 when empty.
+    """
+    rows = queryset.order_by().values(group).annotate(total=expression).values("total")
+    return Coalesce(Subquery(rows[:1]), 0)
+
+
+def fill_counters(apps, schema_editor):
+    AudioBlob = apps.get_model("notes", "AudioBlob")
+    AudioFile = apps.get_model("notes", "AudioFile")
+    Note = apps.get_model("notes", "Note")
+    StorageUsage = apps.get_model("notes", "StorageUsage")
+    User = apps.get_model("auth", "User")
+
+    AudioFile.objects.filter(blob__isnull=False).update(
+        size=Subquery(AudioBlob.objects.filter(pk=OuterRef("blob_id")).values("size")[:1])
+    )
+    files = AudioFile.objects.filter(note_id=OuterRef("pk"))
+    Note.objects.update(
+        audio_count=_total(files, "note_id", Count("id")),
+        audio_bytes=_total(files, "note_id", Sum("size")),
+        audio_duration_ms=_total(files, "note_id", Sum("duration_ms")),
+    )
+    StorageUsage.objects.bulk_create(
+        [StorageUsage(user_id=pk) for pk in User.objects.values_list("pk", flat=True).iterator()],
+        batch_size=1000,
+    )
+    notes = Note.objects.filter(user_id=OuterRef("user_id"))
+    StorageUsage.objects.update(
+        audio_count=_total(notes, "user_id", Sum("audio_count")),
+        audio_bytes=_total(notes, "user_id", Sum("audio_bytes")),
+        audio_duration_ms=_total(notes, "user_id", Sum("audio_duration_ms")),
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("auth", "0012_alter_user_first_name_max_length"),
+        ("notes", "0009_note_search_vector"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StorageUsage",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="storage_usage",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("audio_count", models.PositiveIntegerField(default=0)),
+                ("audio_bytes", models.PositiveBigIntegerField(default=0)),
+                ("audio_duration_ms", models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="audiofile",
+            name="size",
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="note",
+            name="audio_bytes",
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="note",
+            name="audio_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="note",
+            name="audio_duration_ms",
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -1,37 +1,204 @@
 from django.db import models
+from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.utils import timezone
 from django.contrib.auth.models import User
 from django.core.files.uploadedfile import SimpleUploadedFile
 import os
+import uuid
 
 class Note(models.Model):
     """
     Model representing a note with title, description, and associated user.
+
+    The audio totals are kept up to date by `usage.record_audio` as audio
+    files are added and removed, which also moves `updated_at` so the changes
+    feed picks the note up; `manage.py repair_usage` recomputes them.
     """
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="notes")
     title = models.CharField(max_length=100)
     description = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    audio_count = models.PositiveIntegerField(default=0, editable=False)
+    audio_bytes = models.PositiveBigIntegerField(default=0, editable=False)
+    audio_duration_ms = models.PositiveBigIntegerField(default=0, editable=False)
+    # Maintained by a database trigger on PostgreSQL (see migration 0009).
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "created_at", "id"], name="note_user_created_idx"),
+            models.Index(fields=["user", "updated_at", "id"], name="note_user_updated_idx"),
+            GinIndex(fields=["search_vector"], name="note_search_vector_idx"),
+        ]
 
     def __str__(self):
         return self.title
 
 
+class AudioBlob(models.Model):
+    """
+    Content-addressed audio data shared by every AudioFile with identical bytes.
+
+    `ref_count` is the number of AudioFile rows pointing at the blob; the file
+    on disk is removed when the last of them is deleted.
+    """
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    file = models.FileField(upload_to="audio_notes/blobs/")
+    size = models.BigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Blob {self.sha256} ({self.ref_count} refs)"
+
+
 class AudioFile(models.Model):
     """
     Model representing individual audio files linked to a note.
+
+    `audio` points at the shared blob file. Rows created before content
+    addressing have no blob and own their file outright. The size is recorded
+    at upload and stream properties are read from the file header; both are
+    None when unknown.
     """
     note = models.ForeignKey(Note, related_name="audio_files", on_delete=models.CASCADE)
     audio = models.FileField(upload_to="audio_notes/")
+    blob = models.ForeignKey(
+        AudioBlob, related_name="audio_files", on_delete=models.PROTECT, null=True, blank=True
+    )
+    size = models.PositiveBigIntegerField(null=True, blank=True)
+    duration_ms = models.PositiveBigIntegerField(null=True, blank=True)
+    sample_rate = models.PositiveIntegerField(null=True, blank=True)
+    channels = models.PositiveSmallIntegerField(null=True, blank=True)
+    bitrate = models.PositiveIntegerField(null=True, blank=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
         return f"Audio for Note: {self.note.title} - {self.audio.name}"
-    
+
+
+class StorageUsage(models.Model):
+    """
+    Running audio totals for a user, the sum of the counters on their notes.
+
+    Read by primary key to enforce AUDIO_QUOTA_BYTES without aggregating.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name="storage_usage")
+    audio_count = models.PositiveIntegerField(default=0)
+    audio_bytes = models.PositiveBigIntegerField(default=0)
+    audio_duration_ms = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"Usage for {self.user}: {self.audio_bytes} bytes in {self.audio_count} files"
+
+
+class Tombstone(models.Model):
+    """
+    Record of a deleted note or audio file, served by the changes feed.
+
+    `user_id` is a plain column rather than a foreign key so that tombstones
+    written while a user is being deleted do not hold the deletion up; all
+    tombstones are pruned after SYNC_TOMBSTONE_RETENTION_DAYS.
+    """
+    NOTE = 1
+    AUDIO_FILE = 2
+    KIND_CHOICES = [(NOTE, "note"), (AUDIO_FILE, "audio file")]
+
+    user_id = models.IntegerField()
+    kind = models.PositiveSmallIntegerField(choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user_id", "deleted_at", "id"], name="tombstone_user_deleted_idx"),
+            models.Index(fields=["deleted_at"], name="tombstone_deleted_idx"),
+        ]
+
+    def __str__(self):
+        return f"Deleted {self.get_kind_display()} {self.object_id}"
+
+
+class AudioUpload(models.Model):
+    """
+    Resumable upload session for a single audio file.
+
+    Chunks are written straight into a temporary file under MEDIA_ROOT and the
+    byte ranges received so far are tracked in `received_ranges` as sorted,
+    non-overlapping `[start, end)` pairs.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="audio_uploads")
+    note = models.ForeignKey(Note, on_delete=models.CASCADE, related_name="audio_uploads")
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100)
+    size = models.BigIntegerField()
+    received_ranges = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Upload {self.id} of {self.filename}"
+
+    @property
+    def temp_path(self):
+        return os.path.join(settings.MEDIA_ROOT, "audio_uploads", f"{self.id}.part")
+
+    @property
+    def offset(self):
+        """
+        Number of contiguous bytes received from the start of the file.
+        """
+        if self.received_ranges and self.received_ranges[0][0] == 0:
+            return self.received_ranges[0][1]
+        return 0
+
+    @property
+    def is_complete(self):
+        return self.offset == self.size
+
     def delete(self, *args, **kwargs):
         """
-        Override delete to ensure the file is removed from the filesystem.
+        Override delete to discard the partially assembled file.
         """
-        if self.audio and os.path.isfile(self.audio.path):
-            os.remove(self.audio.path)
+        if os.path.isfile(self.temp_path):
+            os.remove(self.temp_path)
         super().delete(*args, **kwargs)
+
+
+class Job(models.Model):
+    """
+    Unit of background work, claimed and run by `manage.py runworker`.
+
+    Successful jobs are deleted; jobs that exhaust their attempts are kept as
+    FAILED with the last traceback for inspection.
+    """
+    QUEUED = "queued"
+    RUNNING = "running"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (FAILED, "Failed"),
+    ]
+
+    task = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "run_at"], name="job_status_run_at_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.task} ({self.status})"
@@ -0,0 +1,27 @@
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class NoteCursorPagination(CursorPagination):
+    """
+    Keyset pagination for notes, newest first.
+
+    Pages are addressed by an opaque cursor over `(created_at, id)` rather than
+    an offset, so fetching a deep page costs the same as fetching the first one.
+    The ordering matches the composite `(user, created_at, id)` index on `Note`.
+    """
+    ordering = ("-created_at", "-id")
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+
+
+class NoteSearchPagination(PageNumberPagination):
+    """
+    Page-number pagination for ranked search results.
+
+    Results are ordered by relevance, which has no stable keyset, and match
+    sets are small compared to a user's whole archive.
+    """
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
@@ -0,0 +1,116 @@
+"""
+Per-user response cache for the notes API.
+
+Each user has a version counter in the cache that is bumped whenever one of
+their notes or audio files is written. Rendered responses are stored under a
+key containing that version, so a bump makes every cached page for the user
+unreachable at once without having to find and delete them. The version also
+forms the ETag, which lets unchanged polls be answered with a 304 before any
+serialization or note query.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+
+
+def _version_key(user_id):
+    return f"notes:version:{user_id}"
+
+
+def _modified_key(user_id):
+    return f"notes:modified:{user_id}"
+
+
+def _initial_version():
+    # Starting from the clock means a counter evicted from the cache never
+    # comes back at a value that older cached responses were stored under.
+    return time.time_ns()
+
+
+def get_state(user_id):
+    """
+    Return `(version, last_modified)` for a user, initialising them if needed.
+    """
+    values = cache.get_many([_version_key(user_id), _modified_key(user_id)])
+    version = values.get(_version_key(user_id))
+    last_modified = values.get(_modified_key(user_id))
+    if version is None:
+        cache.add(_version_key(user_id), _initial_version(), None)
+        version = cache.get(_version_key(user_id))
+    if last_modified is None:
+        last_modified = int(time.time())
+        cache.add(_modified_key(user_id), last_modified, None)
+    return version, last_modified
+
+
+def _bump(user_id):
+    try:
+        cache.incr(_version_key(user_id))
+    except ValueError:
+        cache.set(_version_key(user_id), _initial_version(), None)
+    # Last-Modified has one-second resolution, so always move it forward by at
+    # least a second to keep If-Modified-Since from hiding a quick second write.
+    previous = cache.get(_modified_key(user_id)) or 0
+    cache.set(_modified_key(user_id), max(int(time.time()), previous + 1), None)
+
+
+def bump_version(user_id):
+    """
+    Invalidate a user's cached responses now and again once the transaction commits.
+
+    The second bump covers a response cached by a concurrent request that read
+    the data before this transaction committed.
+    """
+    _bump(user_id)
+    transaction.on_commit(lambda: _bump(user_id))
+
+
+def _response_key(request, version):
+    path = hashlib.sha256(request.get_full_path().encode()).hexdigest()
+    return f"notes:response:{request.user.id}:{version}:{request.accepted_media_type}:{path}"
+
+
+def _finish(response, etag, last_modified):
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    response["Cache-Control"] = "private, no-cache"
+    patch_vary_headers(response, ["Authorization"])
+    return response
+
+
+def cached_response(view, request, render, *args, **kwargs):
+    """
+    Serve a view's GET from the cache, with conditional request handling.
+
+    `render` is the uncached view method; its successful responses are
+    rendered and stored for the current version.
+    """
+    version, last_modified = get_state(request.user.id)
+    etag = f'"{request.user.id}-{version}"'
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return _finish(not_modified, etag, last_modified)
+
+    key = _response_key(request, version)
+    cached = cache.get(key)
+    if cached is not None:
+        content, content_type = cached
+        return _finish(HttpResponse(content, content_type=content_type), etag, last_modified)
+
+    response = render(request, *args, **kwargs)
+    if response.status_code != 200:
+        return response
+
+    response.accepted_renderer = request.accepted_renderer
+    response.accepted_media_type = request.accepted_media_type
+    response.renderer_context = view.get_renderer_context()
+    response.render()
+    cache.set(key, (response.content, response["Content-Type"]), settings.NOTES_CACHE_TIMEOUT)
+    return _finish(response, etag, last_modified)
@@ -0,0 +1,80 @@
+"""
+Database routing that sends note list and detail reads to read replicas.
+
+Reads only go to a replica inside `replica_reads()`, which NoteViewSet uses
+around list and retrieve; everything else, and every write, uses `default`.
+After a user writes a note or audio file their reads are pinned to the primary
+for DATABASE_REPLICA_STICKY_SECONDS, so they always see their own edits even
+while the replicas lag behind.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+_replica = ContextVar("notes_replica", default=None)
+
+
+def _pin_key(user_id):
+    return f"notes:db-pin:{user_id}"
+
+
+def pin_primary(user_id):
+    """
+    Keep a user's reads on the primary for the sticky window.
+
+    The window is restarted when the transaction commits, so it always covers
+    the replication lag after the write becomes visible.
+    """
+    def pin():
+        cache.set(_pin_key(user_id), True, settings.DATABASE_REPLICA_STICKY_SECONDS)
+
+    pin()
+    transaction.on_commit(pin)
+
+
+def is_pinned(user_id):
+    return cache.get(_pin_key(user_id)) is not None
+
+
+@contextmanager
+def replica_reads(user_id):
+    """
+    Route the reads made in the block to a replica, unless there is none or
+    the user wrote recently.
+    """
+    replicas = settings.DATABASE_READ_REPLICAS
+    if not replicas or is_pinned(user_id):
+        yield
+        return
+
+    token = _replica.set(random.choice(replicas))
+    try:
+        yield
+    finally:
+        _replica.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Send reads made inside `replica_reads()` to a replica and all writes to the primary.
+    """
+    def db_for_read(self, model, **hints):
+        return _replica.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary.
+        aliases = {DEFAULT_DB_ALIAS, *settings.DATABASE_READ_REPLICAS}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas receive the schema through replication.
+        return db not in settings.DATABASE_READ_REPLICAS
@@ -0,0 +1,38 @@
+"""
+Full-text search over note titles and descriptions.
+
+On PostgreSQL this matches against the trigger-maintained `search_vector`
+column through its GIN index and ranks with `ts_rank`, weighting titles above
+descriptions. Other databases, such as SQLite in tests, fall back to a
+case-insensitive substring match on every search term.
+"""
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connections
+from django.db.models import Case, F, IntegerField, Q, Value, When
+
+# Must match the text search configuration used by the trigger in migration 0009.
+SEARCH_CONFIG = "english"
+
+
+def search_notes(queryset, query):
+    """
+    Filter `queryset` to notes matching `query`, best matches first.
+    """
+    if connections[queryset.db].vendor == "postgresql":
+        search_query = SearchQuery(query, search_type="websearch", config=SEARCH_CONFIG)
+        return (
+            queryset.filter(search_vector=search_query)
+            .annotate(rank=SearchRank(F("search_vector"), search_query))
+            .order_by("-rank", "-created_at", "-id")
+        )
+
+    rank = Value(0, output_field=IntegerField())
+    for term in query.split():
+        queryset = queryset.filter(Q(title__icontains=term) | Q(description__icontains=term))
+        rank = rank + Case(
+            When(title__icontains=term, then=Value(2)),
+            When(description__icontains=term, then=Value(1)),
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+    return queryset.annotate(rank=rank).order_by("-rank", "-created_at", "-id")
@@ -1,8 +1,51 @@
-from rest_framework import serializers
+from collections import Counter
+
+from rest_framework import permissions, serializers
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
-from .models import Note, AudioFile
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import Note, AudioFile, AudioUpload, Tombstone
+from . import audio_meta, jobs, response_cache, routers, signals, storage, sync, usage
+
+ALLOWED_AUDIO_CONTENT_TYPES = ["audio/mpeg", "audio/wav", "audio/aac", "audio/webm", "audio/ogg"]
+# Keys of the compact note list representation (`?compact=1`)
+COMPACT_NOTE_FIELDS = ["id", "title", "created_at", "updated_at", "audio_count"]
+
+_datetime_field = serializers.DateTimeField()
+
+def requested_fields(request, available):
+    """
+    Return the names in `available` selected by `?fields=a,b` and `?omit=a,b`,
+    in their original order; all of them when neither parameter is given.
+    """
+    fields = [name for name in request.query_params.get("fields", "").split(",") if name]
+    omit = [name for name in request.query_params.get("omit", "").split(",") if name]
+    unknown = sorted(set(fields + omit) - set(available))
+    if unknown:
+        raise serializers.ValidationError({"fields": [f"Unknown fields: {', '.join(unknown)}."]})
+    return [name for name in available if (not fields or name in fields) and name not in omit]
+
+def compact_notes(rows):
+    """
+    Render `.values()` rows of COMPACT_NOTE_FIELDS without going through a serializer.
+
+    Timestamps are formatted by a shared DateTimeField so they match the full representation.
+    """
+    to_representation = _datetime_field.to_representation
+    return [
+        {
+            "id": row["id"],
+            "title": row["title"],
+            "created_at": to_representation(row["created_at"]),
+            "updated_at": to_representation(row["updated_at"]),
+            "audio_count": row["audio_count"],
+        }
+        for row in rows
+    ]
 
 class UserSerializer(serializers.ModelSerializer):
     """
@@ -49,9 +92,70 @@ class AudioFileSerializer(serializers.ModelSerializer):
     """Serializer for audio files."""
     class Meta:
         model = AudioFile
-        fields = ["id", "audio", "uploaded_at"]
+        fields = ["id", "audio", "duration_ms", "sample_rate", "channels", "bitrate", "uploaded_at"]
+        read_only_fields = ["duration_ms", "sample_rate", "channels", "bitrate"]
 
-class NoteSerializer(serializers.ModelSerializer):
+class AudioUploadSerializer(serializers.ModelSerializer):
+    """
+    Serializer for resumable chunked upload sessions.
+    """
+    offset = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = AudioUpload
+        fields = [
+            "id",
+            "note",
+            "filename",
+            "content_type",
+            "size",
+            "offset",
+            "received_ranges",
+            "created_at",
+            "updated_at",
+        ]
+        read_only_fields = ["received_ranges", "created_at", "updated_at"]
+
+    def validate_note(self, note):
+        """
+        Only allow uploads into notes owned by the requesting user.
+        """
+        if note.user_id != self.context["request"].user.id:
+            raise ValidationError("Note not found.")
+        return note
+
+    def validate_content_type(self, content_type):
+        if content_type not in ALLOWED_AUDIO_CONTENT_TYPES:
+            raise ValidationError("Unsupported audio format.")
+        return content_type
+
+    def validate_size(self, size):
+        if size <= 0:
+            raise ValidationError("Size must be positive.")
+        if size > settings.AUDIO_UPLOAD_MAX_SIZE:
+            raise ValidationError(f"Upload exceeds the size limit of {settings.AUDIO_UPLOAD_MAX_SIZE} bytes.")
+        over_quota = usage.check_quota(self.context["request"].user.id, size)
+        if over_quota:
+            raise ValidationError(over_quota)
+        return size
+
+class SparseFieldsMixin:
+    """
+    Limit a serializer's output on reads to the fields picked with `?fields=`
+    and `?omit=`. Writes always see every field.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get("request")
+        if request is None or request.method not in permissions.SAFE_METHODS:
+            return
+        readable = [name for name, field in self.fields.items() if not field.write_only]
+        keep = set(requested_fields(request, readable))
+        for name in list(self.fields):
+            if name not in keep:
+                self.fields.pop(name)
+
+class NoteSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
     Serializer for notes with nested audio files and file uploads.
     """
@@ -62,6 +166,12 @@ class NoteSerializer(serializers.ModelSerializer):
         required=False,
         help_text="Upload multiple audio files.",
     )
+    removed_audio_ids = serializers.ListField(
+        child=serializers.IntegerField(),
+        write_only=True,
+        required=False,
+        help_text="IDs of attached audio files to remove on update.",
+    )
 
     class Meta:
         model = Note
@@ -70,58 +180,269 @@ class NoteSerializer(serializers.ModelSerializer):
             "title",
             "description",
             "audio_files",
+            "audio_count",
+            "audio_bytes",
+            "audio_duration_ms",
             "uploaded_audios",
+            "removed_audio_ids",
             "user",
             "created_at",
             "updated_at",
         ]
         read_only_fields = ["user", "created_at", "updated_at"]
 
+    def to_internal_value(self, data):
+        """
+        Report an upload that `uploads.AudioUploadHandler` stopped part way,
+        before the fields it cut off are reported as missing.
+        """
+        error = getattr(self.context.get("request"), "audio_upload_error", None)
+        if error:
+            raise serializers.ValidationError({"uploaded_audios": [error]})
+        return super().to_internal_value(data)
+
     def validate_uploaded_audios(self, files):
         """
         Validate uploaded audio files.
+
+        The format is identified from the file's own header rather than the
+        client-supplied content type.
         """
-        allowed_content_types = ["audio/mpeg", "audio/wav", "audio/aac"]
-        max_size = 10 * 1024 * 1024  # 10 MB
+        if len(files) > settings.NOTE_AUDIO_MAX_FILES:
+            raise ValidationError(f"At most {settings.NOTE_AUDIO_MAX_FILES} audio files may be uploaded at once.")
 
         for file in files:
-            if file.size > max_size:
-                raise ValidationError(f"File {file.name} exceeds the size limit of 10 MB.")
+            if file.size > settings.NOTE_AUDIO_MAX_SIZE:
+                raise ValidationError(
+                    f"File {file.name} exceeds the size limit of {settings.NOTE_AUDIO_MAX_SIZE} bytes."
+                )
 
-            if file.content_type not in allowed_content_types:
+            if audio_meta.probe(file, file.size) is None:
                 raise ValidationError(f"File {file.name} has an unsupported format.")
-        
         return files
 
+    def validate_removed_audio_ids(self, ids):
+        """
+        Validate that every audio file to remove is attached to the note being updated.
+        """
+        if self.instance is None:
+            if ids:
+                raise ValidationError("Audio files can only be removed from an existing note.")
+            return ids
+
+        attached = set(self.instance.audio_files.values_list("id", flat=True))
+        unknown = sorted(set(ids) - attached)
+        if unknown:
+            raise ValidationError(f"Audio files {unknown} are not attached to this note.")
+        return ids
+
+    def validate(self, attrs):
+        """
+        Check uploaded audio against the storage quota, net of the files the
+        same request removes.
+        """
+        files = attrs.get("uploaded_audios")
+        if not files:
+            return attrs
+
+        incoming = sum(file.size for file in files)
+        removed_audio_ids = attrs.get("removed_audio_ids")
+        if removed_audio_ids:
+            incoming -= self.instance.audio_files.filter(id__in=removed_audio_ids).aggregate(
+                size=Coalesce(Sum("size"), 0)
+            )["size"]
+
+        over_quota = usage.check_quota(self.context["request"].user.id, incoming)
+        if over_quota:
+            raise serializers.ValidationError({"uploaded_audios": [over_quota]})
+        return attrs
+
     def _save_audio_files(self, note, uploaded_audios):
         """
-        Save audio files linked to a note.
+        Save audio files linked to a note, deduplicated by content.
         """
         for audio in uploaded_audios:
-            AudioFile.objects.create(note=note, audio=audio)
+            storage.save_audio_file(note, audio)
 
     def create(self, validated_data):
         """
         Handle note creation with optional audio uploads.
         """
         uploaded_audios = validated_data.pop("uploaded_audios", [])
+        validated_data.pop("removed_audio_ids", None)
 
         note = Note.objects.create(**validated_data)
 
         self._save_audio_files(note, uploaded_audios)
+        if uploaded_audios:
+            note.refresh_from_db(fields=[*usage.COUNTERS, "updated_at"])
 
         return note
 
     def update(self, instance, validated_data):
         """
-        Handle note updates with optional new audio uploads.
+        Handle note updates as an incremental change to the attached audio.
+
+        Existing audio files are kept unless listed in `removed_audio_ids`, and
+        only files in `uploaded_audios` are written, so a text-only edit does
+        no file I/O.
         """
         uploaded_audios = validated_data.pop("uploaded_audios", [])
+        removed_audio_ids = validated_data.pop("removed_audio_ids", [])
 
         instance.title = validated_data.get("title", instance.title)
         instance.description = validated_data.get("description", instance.description)
         instance.save()
 
+        for audio_file in instance.audio_files.filter(id__in=removed_audio_ids):
+            audio_file.delete()
+
         self._save_audio_files(instance, uploaded_audios)
+        if uploaded_audios or removed_audio_ids:
+            instance.refresh_from_db(fields=[*usage.COUNTERS, "updated_at"])
+
+        return instance
+
+
+class NoteBulkCreateSerializer(serializers.ModelSerializer):
+    """
+    A single item of a bulk create. Audio is attached through the regular endpoints.
+
+    NoteSerializer is not reused for bulk items: it carries file fields and the
+    nested audio files, and its validation probes uploads and checks the quota
+    per item. Bulk items are plain text, and updates need a writable `id` and
+    optional fields, hence this create/update pair.
+    """
+    class Meta:
+        model = Note
+        fields = ["id", "title", "description"]
+
+class NoteBulkUpdateSerializer(NoteBulkCreateSerializer):
+    """
+    A single item of a bulk update: the note id plus the fields to change.
+    """
+    id = serializers.IntegerField()
+
+    class Meta(NoteBulkCreateSerializer.Meta):
+        extra_kwargs = {
+            "title": {"required": False},
+            "description": {"required": False},
+        }
+
+class NoteBulkSerializer(serializers.Serializer):
+    """
+    Serializer for a batch of note creates, updates and deletes.
+
+    Creates and updates are validated item by item, so errors come back in the
+    same positions as the input. Saving applies the whole batch with
+    bulk_create, bulk_update and one delete; the caller wraps it in a transaction.
+    """
+    BATCH_SIZE = 500
+
+    def get_fields(self):
+        # Declared here because class attributes named `create` and `update`
+        # would clash with the serializer methods.
+        return {
+            "create": NoteBulkCreateSerializer(many=True, required=False),
+            "update": NoteBulkUpdateSerializer(many=True, required=False),
+            "delete": serializers.ListField(child=serializers.IntegerField(), required=False),
+        }
+
+    def validate(self, attrs):
+        """
+        Validate the batch size and reject notes updated twice.
+        """
+        total = sum(len(attrs.get(key, [])) for key in ("create", "update", "delete"))
+        if total > settings.NOTES_BULK_MAX_ITEMS:
+            raise ValidationError(f"A batch may contain at most {settings.NOTES_BULK_MAX_ITEMS} operations.")
+
+        update_ids = [item["id"] for item in attrs.get("update", [])]
+        if len(update_ids) != len(set(update_ids)):
+            raise ValidationError("Each note may only be updated once per batch.")
+        return attrs
+
+    def create(self, validated_data):
+        """
+        Apply the batch for `user` and return per-item results.
+        """
+        user = validated_data["user"]
+        results = {"create": [], "update": [], "delete": []}
+
+        created = Note.objects.bulk_create(
+            [
+                Note(user=user, title=item["title"], description=item["description"])
+                for item in validated_data.get("create", [])
+            ],
+            batch_size=self.BATCH_SIZE,
+        )
+        results["create"] = [{"id": note.id, "status": 201} for note in created]
+
+        updates = validated_data.get("update", [])
+        if updates:
+            notes = Note.objects.filter(user=user).defer("search_vector").in_bulk([item["id"] for item in updates])
+            missing = [item["id"] for item in updates if item["id"] not in notes]
+            if missing:
+                raise serializers.ValidationError({"update": f"Notes {missing} not found."})
+
+            # bulk_update skips auto_now, so the timestamp is set by hand.
+            now = timezone.now()
+            for item in updates:
+                note = notes[item["id"]]
+                note.title = item.get("title", note.title)
+                note.description = item.get("description", note.description)
+                note.updated_at = now
+            Note.objects.bulk_update(
+                notes.values(), ["title", "description", "updated_at"], batch_size=self.BATCH_SIZE
+            )
+            results["update"] = [{"id": item["id"], "status": 200} for item in updates]
+
+        delete_ids = validated_data.get("delete", [])
+        if delete_ids:
+            existing = set(Note.objects.filter(user=user, id__in=delete_ids).values_list("id", flat=True))
+            self._delete_notes(user.id, existing)
+            results["delete"] = [
+                {"id": note_id, "status": 204 if note_id in existing else 404} for note_id in delete_ids
+            ]
+
+        # bulk_create and bulk_update send no signals, so invalidate explicitly.
+        response_cache.bump_version(user.id)
+        routers.pin_primary(user.id)
+        return results
+
+    def _delete_notes(self, user_id, note_ids):
+        """
+        Delete notes and their audio files with the signal receivers muted.
+
+        Does what the receivers would do row by row in a fixed number of
+        queries: blob references are released per distinct count, usage moves
+        once for the user and the tombstones are inserted together.
+        """
+        audio_files = list(
+            AudioFile.objects.filter(note_id__in=note_ids).only(
+                "id", "note_id", "blob_id", "audio", "size", "duration_ms"
+            )
+        )
+        with signals.muted(), sync.batched_tombstones():
+            refs = Counter(audio_file.blob_id for audio_file in audio_files if audio_file.blob_id)
+            if refs:
+                storage.release_blobs(refs)
+            legacy = [
+                {"name": audio_file.audio.name}
+                for audio_file in audio_files
+                if not audio_file.blob_id and audio_file.audio
+            ]
+            if legacy:
+                jobs.enqueue_many("delete_file", legacy)
+            if audio_files:
+                usage.adjust_user(
+                    user_id,
+                    count=-len(audio_files),
+                    size=-sum(audio_file.size or 0 for audio_file in audio_files),
+                    duration_ms=-sum(audio_file.duration_ms or 0 for audio_file in audio_files),
+                )
 
-        return instance
\ No newline at end of file
+            for audio_file in audio_files:
+                sync.record_deletion(user_id, Tombstone.AUDIO_FILE, audio_file.pk)
+            for note_id in note_ids:
+                sync.record_deletion(user_id, Tombstone.NOTE, note_id)
+            Note.objects.filter(user_id=user_id, id__in=note_ids).delete()
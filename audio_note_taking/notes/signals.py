@@ -0,0 +1,122 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework_simplejwt.settings import api_settings
+
+from . import jobs, response_cache, routers, sync, usage
+from .authentication import invalidate_user
+from .models import AudioFile, Note, Tombstone
+from .storage import release_blob
+
+_muted = ContextVar("notes_signals_muted", default=False)
+
+
+@contextmanager
+def muted():
+    """
+    Skip the note and audio file receivers below inside the block.
+
+    For bulk paths that do the same bookkeeping themselves, in batches rather
+    than once per row.
+    """
+    token = _muted.set(True)
+    try:
+        yield
+    finally:
+        _muted.reset(token)
+
+
+def _unless_muted(func):
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _muted.get():
+            func(*args, **kwargs)
+    return wrapper
+
+
+@receiver(post_delete, sender=AudioFile)
+@_unless_muted
+def release_audio_storage(sender, instance, **kwargs):
+    """
+    Release the audio behind a deleted AudioFile.
+
+    Runs for direct deletes and for cascades from Note or User alike. Files are
+    removed by a worker once the deleting transaction has committed.
+    """
+    if instance.blob_id:
+        release_blob(instance.blob_id)
+    elif instance.audio:
+        jobs.enqueue("delete_file", name=instance.audio.name)
+
+
+def _audio_owner_id(audio_file):
+    # Remembered on the instance, since several receivers need it.
+    if not hasattr(audio_file, "_owner_id"):
+        if AudioFile.note.is_cached(audio_file):
+            audio_file._owner_id = audio_file.note.user_id
+        else:
+            audio_file._owner_id = (
+                Note.objects.filter(pk=audio_file.note_id).values_list("user_id", flat=True).first()
+            )
+    return audio_file._owner_id
+
+
+@receiver(post_save, sender=AudioFile)
+@_unless_muted
+def count_added_audio(sender, instance, created, **kwargs):
+    user_id = _audio_owner_id(instance)
+    if created and user_id is not None:
+        usage.record_audio(instance, user_id, 1)
+
+
+@receiver(post_delete, sender=AudioFile)
+@_unless_muted
+def count_removed_audio(sender, instance, **kwargs):
+    user_id = _audio_owner_id(instance)
+    if user_id is not None:
+        usage.record_audio(instance, user_id, -1)
+        sync.record_deletion(user_id, Tombstone.AUDIO_FILE, instance.pk)
+
+
+@receiver(post_delete, sender=Note)
+@_unless_muted
+def record_note_deletion(sender, instance, **kwargs):
+    sync.record_deletion(instance.user_id, Tombstone.NOTE, instance.pk)
+
+
+@receiver(post_save, sender=Note)
+@receiver(post_delete, sender=Note)
+@_unless_muted
+def invalidate_note_cache(sender, instance, **kwargs):
+    response_cache.bump_version(instance.user_id)
+    routers.pin_primary(instance.user_id)
+
+
+@receiver(post_save, sender=AudioFile)
+@receiver(post_delete, sender=AudioFile)
+@_unless_muted
+def invalidate_audio_cache(sender, instance, **kwargs):
+    user_id = _audio_owner_id(instance)
+    if user_id is not None:
+        response_cache.bump_version(user_id)
+        routers.pin_primary(user_id)
+
+
+@receiver(post_save, sender=get_user_model())
+@receiver(post_delete, sender=get_user_model())
+def invalidate_auth_cache(sender, instance, **kwargs):
+    invalidate_user(getattr(instance, api_settings.USER_ID_FIELD))
+
+
+if apps.is_installed("rest_framework_simplejwt.token_blacklist"):
+    from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+    @receiver(post_save, sender=BlacklistedToken)
+    def invalidate_auth_cache_on_blacklist(sender, instance, **kwargs):
+        if instance.token.user_id is not None:
+            invalidate_user(instance.token.user_id)
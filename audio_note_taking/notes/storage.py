@@ -0,0 +1,324 @@
+"""
+Content-addressed, reference-counted storage for audio files.
+
+Uploads are hashed with SHA-256 while they are streamed to a temporary file,
+then either renamed into place as a new AudioBlob or discarded in favour of an
+existing blob with the same digest.
+"""
+import hashlib
+import os
+import tempfile
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Sum
+
+from . import audio_meta, jobs, metrics, response_cache, routers, usage
+from .models import AudioBlob, AudioFile
+
+BLOB_DIR = "audio_notes/blobs"
+# Files derived from a blob, such as waveform peaks, named `<sha256><suffix>`
+DERIVED_DIR = "audio_notes/derived"
+TEMP_DIR = "audio_notes/tmp"
+CHUNK_SIZE = 64 * 1024
+
+
+def blob_name(sha256, extension=""):
+    """
+    Return the storage name for a blob, fanned out by the first two hex digits.
+    """
+    return f"{BLOB_DIR}/{sha256[:2]}/{sha256}{extension}"
+
+
+def sidecar_name(sha256, suffix):
+    """
+    Return the storage name for a file derived from a blob.
+    """
+    return f"{DERIVED_DIR}/{sha256[:2]}/{sha256}{suffix}"
+
+
+def _write_temp(chunks):
+    """
+    Write `chunks` to a new temporary file, hashing them on the way through.
+
+    Returns `(path, sha256, size)`.
+    """
+    temp_dir = os.path.join(settings.MEDIA_ROOT, TEMP_DIR)
+    os.makedirs(temp_dir, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=temp_dir, suffix=".part")
+
+    digest = hashlib.sha256()
+    size = 0
+    with os.fdopen(fd, "wb") as out:
+        for chunk in chunks:
+            digest.update(chunk)
+            out.write(chunk)
+            size += len(chunk)
+    metrics.record_media_write(size)
+    return path, digest.hexdigest(), size
+
+
+def _hash_path(path):
+    """
+    Hash a file already on disk without loading it into memory.
+
+    Returns `(sha256, size)`.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as source:
+        for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def _attach(note, path, sha256, size, filename):
+    """
+    Create an AudioFile for `note` backed by the blob for `sha256`.
+
+    `path` is consumed: it is renamed into place for a new blob, or removed when
+    a blob with the same content already exists.
+    """
+    storage = AudioFile._meta.get_field("audio").storage
+    extension = os.path.splitext(filename)[1].lower()
+    info = audio_meta.probe_path(path)
+    fields = info.as_fields() if info else {}
+
+    try:
+        with transaction.atomic():
+            blob, created = AudioBlob.objects.select_for_update().get_or_create(
+                sha256=sha256,
+                defaults={"file": blob_name(sha256, extension), "size": size, "ref_count": 1},
+            )
+            if created:
+                destination = storage.path(blob.file.name)
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                os.replace(path, destination)
+                if settings.AUDIO_PROCESSING_STAGES:
+                    jobs.enqueue("process_blob", sha256=sha256)
+            else:
+                AudioBlob.objects.filter(pk=sha256).update(ref_count=F("ref_count") + 1)
+
+            return AudioFile.objects.create(note=note, audio=blob.file.name, blob=blob, size=size, **fields)
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def save_audio_file(note, uploaded_file):
+    """
+    Store an uploaded file and attach it to `note`, sharing any identical blob.
+
+    A file that `uploads.AudioUploadHandler` already wrote under MEDIA_ROOT
+    and hashed is renamed into place rather than copied.
+    """
+    sha256 = getattr(uploaded_file, "sha256", None)
+    if sha256 is not None:
+        return _attach(note, uploaded_file.temporary_file_path(), sha256, uploaded_file.size, uploaded_file.name)
+    path, sha256, size = _write_temp(uploaded_file.chunks(CHUNK_SIZE))
+    return _attach(note, path, sha256, size, uploaded_file.name)
+
+
+def save_audio_file_from_path(note, path, filename):
+    """
+    Attach a file that is already on disk to `note`, moving it into blob storage.
+    """
+    sha256, size = _hash_path(path)
+    return _attach(note, path, sha256, size, filename)
+
+
+def save_audio_batch(entries):
+    """
+    Store many files and attach them to their notes with bulk inserts.
+
+    `entries` are `(note, chunks, filename)`. Each file is streamed to a
+    temporary file and hashed as in `save_audio_file`; one transaction then
+    inserts the missing blobs, adds the new references, inserts the AudioFile
+    rows and updates the audio totals once per note. bulk_create sends no
+    signals, so the caller invalidates cached responses. Returns the AudioFiles.
+    """
+    storage = AudioFile._meta.get_field("audio").storage
+    staged = []
+    try:
+        for note, chunks, filename in entries:
+            path, sha256, size = _write_temp(chunks)
+            staged.append((note, path, sha256, size, os.path.splitext(filename)[1].lower()))
+        if not staged:
+            return []
+
+        with transaction.atomic():
+            refs = Counter(sha256 for _, _, sha256, _, _ in staged)
+            existing = set(AudioBlob.objects.filter(pk__in=refs).values_list("pk", flat=True))
+            AudioBlob.objects.bulk_create(
+                [
+                    AudioBlob(sha256=sha256, file=blob_name(sha256, extension), size=size, ref_count=0)
+                    for _, _, sha256, size, extension in staged
+                    if sha256 not in existing
+                ],
+                ignore_conflicts=True,
+            )
+            blobs = AudioBlob.objects.select_for_update().in_bulk(list(refs))
+            by_count = defaultdict(list)
+            for sha256, count in refs.items():
+                by_count[count].append(sha256)
+            for count, hashes in by_count.items():
+                AudioBlob.objects.filter(pk__in=hashes).update(ref_count=F("ref_count") + count)
+
+            audio_files = []
+            for note, path, sha256, size, _ in staged:
+                blob = blobs[sha256]
+                destination = storage.path(blob.file.name)
+                if not os.path.exists(destination):
+                    os.makedirs(os.path.dirname(destination), exist_ok=True)
+                    os.replace(path, destination)
+                info = audio_meta.probe_path(destination)
+                fields = info.as_fields() if info else {}
+                audio_files.append(AudioFile(note=note, audio=blob.file.name, blob=blob, size=size, **fields))
+            AudioFile.objects.bulk_create(audio_files)
+
+            totals = defaultdict(lambda: [0, 0, 0])
+            for audio_file in audio_files:
+                total = totals[audio_file.note]
+                total[0] += 1
+                total[1] += audio_file.size
+                total[2] += audio_file.duration_ms or 0
+            for note, (count, size, duration_ms) in totals.items():
+                usage.adjust(note.pk, note.user_id, count=count, size=size, duration_ms=duration_ms)
+
+            if settings.AUDIO_PROCESSING_STAGES:
+                for sha256 in refs.keys() - existing:
+                    jobs.enqueue("process_blob", sha256=sha256)
+            return audio_files
+    finally:
+        for _, path, _, _, _ in staged:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def release_blob(sha256):
+    """
+    Drop one reference to a blob.
+
+    When the last reference goes the row is kept with a zero count and a
+    `purge_blob` job removes it later, so the request does no file I/O.
+    """
+    with transaction.atomic():
+        blob = AudioBlob.objects.select_for_update().filter(pk=sha256).first()
+        if blob is None or blob.ref_count == 0:
+            return
+        AudioBlob.objects.filter(pk=sha256).update(ref_count=F("ref_count") - 1)
+        if blob.ref_count == 1:
+            jobs.enqueue("purge_blob", sha256=sha256)
+
+
+def release_blobs(refs):
+    """
+    Drop references to several blobs; `refs` maps each sha256 to how many go.
+
+    The batch form of `release_blob`: counts are lowered with one UPDATE per
+    distinct count, and the blobs left unreferenced get their `purge_blob`
+    jobs in a single insert.
+    """
+    with transaction.atomic():
+        blobs = AudioBlob.objects.select_for_update().in_bulk(list(refs))
+        by_count = defaultdict(list)
+        purged = []
+        for sha256, count in refs.items():
+            blob = blobs.get(sha256)
+            if blob is None or blob.ref_count == 0:
+                continue
+            count = min(count, blob.ref_count)
+            by_count[count].append(sha256)
+            if count == blob.ref_count:
+                purged.append(sha256)
+        for count, hashes in by_count.items():
+            AudioBlob.objects.filter(pk__in=hashes).update(ref_count=F("ref_count") - count)
+        if purged:
+            jobs.enqueue_many("purge_blob", [{"sha256": sha256} for sha256 in purged])
+
+
+def purge_blob(sha256):
+    """
+    Remove a blob and its file if nothing references it any more.
+
+    Derived sidecar files go with it. The row is locked while the files are
+    removed, so an upload of the same content either revives the blob first
+    or waits and writes a fresh copy.
+    """
+    storage = AudioBlob._meta.get_field("file").storage
+    with transaction.atomic():
+        blob = AudioBlob.objects.select_for_update().filter(pk=sha256).first()
+        if blob is None or blob.ref_count > 0:
+            return
+        if storage.exists(blob.file.name):
+            storage.delete(blob.file.name)
+
+        derived_dir = f"{DERIVED_DIR}/{sha256[:2]}"
+        if storage.exists(derived_dir):
+            for name in storage.listdir(derived_dir)[1]:
+                if name.startswith(sha256):
+                    storage.delete(f"{derived_dir}/{name}")
+        blob.delete()
+
+
+def replace_blob(sha256, path, extension):
+    """
+    Move every AudioFile on blob `sha256` to the content of the file at `path`.
+
+    `path` is consumed like an upload: it becomes a new blob, or is discarded
+    for an existing one with the same content. The files are repointed and the
+    old blob released in one transaction, so readers see either the old file
+    or the new one; the old file is left for the `purge_blob` job. Audio
+    totals of the affected notes and users follow the new size, and their
+    owners' cached responses are invalidated. Returns the new blob, or None
+    when the old one has no references left.
+    """
+    new_sha256, size = _hash_path(path)
+    storage = AudioFile._meta.get_field("audio").storage
+    info = audio_meta.probe_path(path)
+    fields = info.as_fields() if info else {}
+
+    try:
+        with transaction.atomic():
+            old = AudioBlob.objects.select_for_update().filter(pk=sha256).first()
+            if old is None or old.ref_count == 0 or new_sha256 == sha256:
+                return None
+            blob, created = AudioBlob.objects.select_for_update().get_or_create(
+                sha256=new_sha256,
+                defaults={"file": blob_name(new_sha256, extension), "size": size, "ref_count": old.ref_count},
+            )
+            if created:
+                destination = storage.path(blob.file.name)
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                os.replace(path, destination)
+                if settings.AUDIO_PROCESSING_STAGES:
+                    jobs.enqueue("process_blob", sha256=new_sha256)
+            else:
+                AudioBlob.objects.filter(pk=new_sha256).update(ref_count=F("ref_count") + old.ref_count)
+
+            affected = (
+                AudioFile.objects.filter(blob=old)
+                .values("note_id", "note__user_id")
+                .annotate(files=Count("id"), duration=Sum("duration_ms"))
+            )
+            for row in affected:
+                usage.adjust(
+                    row["note_id"],
+                    row["note__user_id"],
+                    size=(size - old.size) * row["files"],
+                    duration_ms=(fields.get("duration_ms") or 0) * row["files"] - (row["duration"] or 0),
+                )
+            AudioFile.objects.filter(blob=old).update(blob=blob, audio=blob.file.name, size=size, **fields)
+            AudioBlob.objects.filter(pk=sha256).update(ref_count=0)
+            jobs.enqueue("purge_blob", sha256=sha256)
+
+            # update() sends no signals, so invalidate explicitly.
+            for user_id in {row["note__user_id"] for row in affected}:
+                response_cache.bump_version(user_id)
+                routers.pin_primary(user_id)
+            return blob
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,195 @@
+"""
+Conditional and ranged responses for serving audio files.
+
+Supports single-range `Range` requests (206), `If-None-Match` (304) and
+`If-Range`. When AUDIO_SENDFILE_HEADER is configured, the byte transfer is
+handed to the front proxy instead, which then applies ranges itself.
+"""
+import json
+import mimetypes
+import os
+import re
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer
+
+CHUNK_SIZE = 64 * 1024
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class PassthroughRenderer(BaseRenderer):
+    """
+    Accept any media type so audio players sending `Accept: audio/*` are not
+    refused by content negotiation. Error payloads are rendered as JSON.
+    """
+    media_type = "*/*"
+    format = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None or isinstance(data, bytes):
+            return data
+        return json.dumps(data).encode()
+
+
+def parse_range(header, size):
+    """
+    Parse a Range header into an inclusive `(start, end)` pair.
+
+    Returns None when the whole file should be served: no header, another unit,
+    or a multi-range request, which the RFC allows us to ignore. Raises
+    ValueError when the range cannot be satisfied.
+    """
+    match = RANGE_RE.match((header or "").strip())
+    if not match or match.groups() == ("", ""):
+        return None
+
+    first, last = match.groups()
+    if not first:
+        suffix = int(last)
+        if suffix == 0 or size == 0:
+            raise ValueError("Unsatisfiable range.")
+        return max(size - suffix, 0), size - 1
+
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError("Unsatisfiable range.")
+    return start, end
+
+
+def etag_for(audio_file, stat):
+    """
+    Return a strong ETag for an audio file.
+
+    Content-addressed files use their SHA-256; older files fall back to size and mtime.
+    """
+    if audio_file.blob_id:
+        return f'"{audio_file.blob_id}"'
+    return f'"{stat.st_size:x}-{int(stat.st_mtime):x}"'
+
+
+def etag_matches(header, etag, weak=True):
+    """
+    Check an If-None-Match / If-Range header value against an ETag.
+
+    If-None-Match uses the weak comparison, which ignores a `W/` prefix, while
+    If-Range needs the strong comparison, so there a weak validator never matches.
+    """
+    if not header:
+        return False
+    candidates = [tag.strip() for tag in header.split(",")]
+    if weak:
+        return "*" in candidates or any(tag.removeprefix("W/") == etag for tag in candidates)
+    return etag in candidates
+
+
+def iter_file_range(path, start, length):
+    """
+    Yield `length` bytes of a file starting at `start`, CHUNK_SIZE at a time.
+    """
+    with open(path, "rb") as source:
+        source.seek(start)
+        while length > 0:
+            data = source.read(min(CHUNK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+def sendfile_location(name, path):
+    """
+    Return the value of the offload header for a file.
+
+    X-Accel-Redirect takes an internal URI under AUDIO_SENDFILE_PREFIX, while
+    X-Sendfile style headers take the absolute filesystem path.
+    """
+    if settings.AUDIO_SENDFILE_HEADER.lower() == "x-accel-redirect":
+        return f"{settings.AUDIO_SENDFILE_PREFIX.rstrip('/')}/{name}"
+    return path
+
+
+@dataclass
+class AudioTransfer:
+    """
+    How to answer a stream request: status, headers and the byte range to send.
+
+    `length` is 0 when there is no body, e.g. for 304, 416 or an offloaded transfer.
+    """
+    status: int
+    headers: dict
+    path: str
+    start: int = 0
+    length: int = 0
+
+
+def plan_transfer(meta, audio_file):
+    """
+    Decide how to serve an audio file from the request headers in `meta`.
+
+    Only stat()s the file, so the sync view and the ASGI fast path share the
+    conditional and range handling and differ only in how they move the bytes.
+    """
+    path = audio_file.audio.path
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        raise Http404("Audio file is missing.")
+
+    etag = etag_for(audio_file, stat)
+    if etag_matches(meta.get("HTTP_IF_NONE_MATCH"), etag):
+        return AudioTransfer(304, {"ETag": etag}, path)
+
+    headers = {"Content-Type": mimetypes.guess_type(path)[0] or "application/octet-stream"}
+    transfer = AudioTransfer(200, headers, path)
+
+    if settings.AUDIO_SENDFILE_HEADER:
+        headers[settings.AUDIO_SENDFILE_HEADER] = sendfile_location(audio_file.audio.name, path)
+    else:
+        range_header = meta.get("HTTP_RANGE")
+        if_range = meta.get("HTTP_IF_RANGE")
+        if if_range and not etag_matches(if_range, etag, weak=False):
+            range_header = None
+
+        try:
+            byte_range = parse_range(range_header, stat.st_size)
+        except ValueError:
+            return AudioTransfer(416, {"Content-Range": f"bytes */{stat.st_size}"}, path)
+
+        if byte_range is None:
+            transfer.length = stat.st_size
+        else:
+            start, end = byte_range
+            transfer.status, transfer.start, transfer.length = 206, start, end - start + 1
+            headers["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+        headers["Content-Length"] = str(transfer.length)
+
+    headers["Accept-Ranges"] = "bytes"
+    headers["ETag"] = etag
+    headers["Cache-Control"] = "private"
+    return transfer
+
+
+def serve_audio(request, audio_file):
+    """
+    Build the response for streaming an audio file the caller is allowed to read.
+    """
+    transfer = plan_transfer(request.META, audio_file)
+    if transfer.status == 304:
+        response = HttpResponseNotModified()
+    elif transfer.status == 206:
+        response = StreamingHttpResponse(
+            iter_file_range(transfer.path, transfer.start, transfer.length), status=206
+        )
+    elif transfer.length:
+        # FileResponse lets WSGI servers use wsgi.file_wrapper / sendfile().
+        response = FileResponse(open(transfer.path, "rb"))
+    else:
+        response = HttpResponse(status=transfer.status)
+
+    for header, value in transfer.headers.items():
+        response[header] = value
+    return response
@@ -0,0 +1,160 @@
+"""
+Delta sync for offline clients.
+
+Changes are read as one stream ordered by `(timestamp, kind, id)`: notes by
+`updated_at` (which adding or removing audio also moves) and tombstones by
+`deleted_at`. Both sides are range scans on a `(user, timestamp, id)` index,
+combined in a single UNION query, so a sync with nothing new costs one
+query. The cursor is an opaque encoding of the last key returned.
+
+Timestamps are taken when a row is written, not when its transaction
+commits, so a slow transaction can commit a change that sorts before keys
+already handed out. The cursor is therefore never moved past
+SYNC_COMMIT_LAG_SECONDS ago: changes inside that window are sent again on
+the next sync, and clients apply them idempotently by id.
+"""
+import base64
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import F, IntegerField, Q, Value
+from django.utils import timezone
+
+from .models import Note, Tombstone
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+NOTE_KIND = 0
+START = (EPOCH, -1, 0)
+
+_pending_tombstones = ContextVar("notes_pending_tombstones", default=None)
+
+
+class CursorError(ValueError):
+    """
+    A cursor that was not issued by this feed.
+    """
+
+
+class CursorExpired(CursorError):
+    """
+    A cursor older than the tombstone retention; the client must resync from scratch.
+    """
+
+
+def encode_cursor(key):
+    ts, kind, row = key
+    raw = f"{(ts - EPOCH) // timedelta(microseconds=1)}.{kind}.{row}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    Return the `(timestamp, kind, id)` key in `cursor`, the start of time when empty.
+
+    Raises CursorError for garbage and CursorExpired when tombstones since
+    then may already have been pruned.
+    """
+    if not cursor:
+        return START
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        micros, kind, row = (int(part) for part in raw.split("."))
+        ts = EPOCH + timedelta(microseconds=micros)
+    except (ValueError, OverflowError):
+        raise CursorError("Invalid cursor.")
+    if ts < timezone.now() - timedelta(days=settings.SYNC_TOMBSTONE_RETENTION_DAYS):
+        raise CursorExpired("Cursor has expired; fetch the full list again.")
+    return ts, kind, row
+
+
+def _after(queryset, key):
+    """
+    Filter rows annotated with `ts`, `kind` and `row` to those after `key`.
+
+    The plain `ts >= ...` bound lets the database range-scan the index.
+    """
+    ts, kind, row = key
+    return queryset.filter(ts__gte=ts).filter(
+        Q(ts__gt=ts) | Q(ts=ts, kind__gt=kind) | Q(ts=ts, kind=kind, row__gt=row)
+    )
+
+
+def read_changes(user_id, since, limit):
+    """
+    Return up to `limit` change keys after `since` as `(ts, kind, id, object_id)`,
+    oldest first, and whether more are waiting.
+
+    `kind` is NOTE_KIND for a created or updated note, or the Tombstone kind
+    of a deletion; `object_id` is the id of the note or audio file.
+    """
+    notes = _after(
+        Note.objects.filter(user_id=user_id).annotate(
+            ts=F("updated_at"), kind=Value(NOTE_KIND, IntegerField()), row=F("id"), object=F("id")
+        ),
+        since,
+    ).values_list("ts", "kind", "row", "object")
+    tombstones = _after(
+        Tombstone.objects.filter(user_id=user_id).annotate(
+            ts=F("deleted_at"), row=F("id"), object=F("object_id")
+        ),
+        since,
+    ).values_list("ts", "kind", "row", "object")
+
+    rows = list(notes.union(tombstones, all=True).order_by("ts", "kind", "row")[:limit + 1])
+    return rows[:limit], len(rows) > limit
+
+
+def next_cursor(since, rows, has_more):
+    """
+    Return the key to resume from after `rows`.
+
+    A full page resumes right after its last row. Otherwise the client has
+    caught up, and the key moves to the commit lag horizon: back from a
+    newer last row, forward when nothing changed, so idle cursors do not
+    expire. It never moves backwards.
+    """
+    if has_more:
+        return tuple(rows[-1][:3])
+    horizon = (timezone.now() - timedelta(seconds=settings.SYNC_COMMIT_LAG_SECONDS), -1, 0)
+    return max(since, horizon)
+
+
+def record_deletion(user_id, kind, object_id):
+    """
+    Write a tombstone now, or at the end of the enclosing `batched_tombstones()`.
+    """
+    tombstone = Tombstone(user_id=user_id, kind=kind, object_id=object_id)
+    pending = _pending_tombstones.get()
+    if pending is None:
+        tombstone.save()
+    else:
+        pending.append(tombstone)
+
+
+@contextmanager
+def batched_tombstones():
+    """
+    Collect the tombstones of deletes in the block and insert them together.
+
+    Use inside the deleting transaction, so they commit with the deletes.
+    """
+    token = _pending_tombstones.set([])
+    try:
+        yield
+        Tombstone.objects.bulk_create(_pending_tombstones.get(), batch_size=1000)
+    finally:
+        _pending_tombstones.reset(token)
+
+
+def prune_tombstones(dry_run=False):
+    """
+    Delete tombstones older than SYNC_TOMBSTONE_RETENTION_DAYS; returns how many.
+    """
+    expired = Tombstone.objects.filter(
+        deleted_at__lt=timezone.now() - timedelta(days=settings.SYNC_TOMBSTONE_RETENTION_DAYS)
+    )
+    if dry_run:
+        return expired.count()
+    return expired.delete()[0]
@@ -0,0 +1,36 @@
+"""
+Background job handlers. Imported at startup so they are registered.
+"""
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from . import storage
+from .jobs import task
+from .models import AudioBlob, AudioFile
+
+
+@task("purge_blob")
+def purge_blob(sha256):
+    storage.purge_blob(sha256)
+
+
+@task("delete_file")
+def delete_file(name):
+    file_storage = AudioFile._meta.get_field("audio").storage
+    if file_storage.exists(name):
+        file_storage.delete(name)
+
+
+@task("process_blob")
+def process_blob(sha256):
+    """
+    Run each of AUDIO_PROCESSING_STAGES on a newly stored blob.
+
+    Stops early once the blob has no references, for instance after a stage
+    replaced it with a compacted copy, which gets its own job.
+    """
+    for stage in settings.AUDIO_PROCESSING_STAGES:
+        blob = AudioBlob.objects.filter(pk=sha256, ref_count__gt=0).first()
+        if blob is None:
+            return
+        import_string(stage)(blob)
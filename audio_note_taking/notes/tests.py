@@ -1,15 +1,69 @@
+from datetime import timedelta
+import hashlib
+import io
+import json
+import os
+import pstats
+import tempfile
+import time
+import uuid
+import wave
+import zipfile
+from io import StringIO
+from unittest import mock
+from asgiref.sync import async_to_sync
+import numpy as np
 from rest_framework.test import APITestCase
 from rest_framework import status
 from django.contrib.auth.models import User
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.core.files.uploadedfile import SimpleUploadedFile
-from .models import Note, AudioFile
+from django.core.files.storage import FileSystemStorage
+from django.core import signals
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import close_old_connections, connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from .models import Note, AudioFile, AudioUpload, AudioBlob, Job, StorageUsage, Tombstone
+from . import (
+    archive, audio_meta, authentication, compaction, dsp, jobs, metrics, routers, storage, sync, uploads, vad, waveform,
+)
+from .asgi import AudioTransferMiddleware
+from .management.commands import benchmark
 
-class UserSerializerTest(APITestCase):
+
+def make_wav(duration_ms=100, sample_rate=8000, channels=1, seed=0):
+    """
+    Build a small 16-bit PCM WAV file; `seed` varies the content.
+    """
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        frames = sample_rate * duration_ms // 1000
+        wav.writeframes(bytes((seed + i) % 256 for i in range(frames * channels * 2)))
+    return buffer.getvalue()
+
+
+class NotesTestCase(APITestCase):
+    """
+    Base test case that starts every test with an empty cache.
+
+    Cached users and responses are keyed by id, and SQLite reuses ids between tests.
+    """
+    def setUp(self):
+        cache.clear()
+
+
+class UserSerializerTest(NotesTestCase):
     def setUp(self):
         """
         Set up initial test data.
         """
+        super().setUp()
         self.valid_user_data = {
             "username": "testuser",
             "password": "SecurePassword123",
@@ -96,8 +150,9 @@ class UserSerializerTest(APITestCase):
         self.assertIn("detail", response.data)
         self.assertEqual(str(response.data["detail"]), "No active account found with the given credentials")
 
-class NotesAudioAPITest(APITestCase):
+class NotesAudioAPITest(NotesTestCase):
     def setUp(self):
+        super().setUp()
         self.user1 = User.objects.create_user(username="testuser1", password="password123")
         self.user2 = User.objects.create_user(username="testuser2", password="password456")
 
@@ -114,11 +169,11 @@ class NotesAudioAPITest(APITestCase):
         )
         
 
-    def create_audio_file(self, name="test_audio.wav", content=b"audio data"):
+    def create_audio_file(self, name="test_audio.wav", content=None):
         """
         Helper function to create a mock audio file for testing.
         """
-        return SimpleUploadedFile(name, content, content_type="audio/wav")
+        return SimpleUploadedFile(name, content or make_wav(), content_type="audio/wav")
 
     def test_create_note_with_audio(self):
         """
@@ -145,8 +200,8 @@ class NotesAudioAPITest(APITestCase):
         Test updating a note by removing old audio files and adding new ones.
         """
         
-        AudioFile.objects.create(note=self.note_user1, audio=self.create_audio_file("audio1.wav"))
-        AudioFile.objects.create(note=self.note_user1, audio=self.create_audio_file("audio2.wav"))
+        old_audio1 = AudioFile.objects.create(note=self.note_user1, audio=self.create_audio_file("audio1.wav"))
+        old_audio2 = AudioFile.objects.create(note=self.note_user1, audio=self.create_audio_file("audio2.wav"))
 
         new_audio1 = self.create_audio_file("new_audio1.wav")
         new_audio2 = self.create_audio_file("new_audio2.wav")
@@ -155,7 +210,8 @@ class NotesAudioAPITest(APITestCase):
         data = {
             "title": "Updated Note",
             "description": "Updated description",
-            "uploaded_audios": [new_audio1, new_audio2]
+            "uploaded_audios": [new_audio1, new_audio2],
+            "removed_audio_ids": [old_audio1.id, old_audio2.id],
         }
 
         response = self.client.put(url, data, format="multipart")
@@ -165,6 +221,61 @@ class NotesAudioAPITest(APITestCase):
         self.assertEqual(self.note_user1.title, "Updated Note")
         self.assertEqual(self.note_user1.description, "Updated description")
         self.assertEqual(self.note_user1.audio_files.count(), 2)
+        jobs.run_pending()
+        self.assertFalse(old_audio1.audio.storage.exists(old_audio1.audio.name))
+        self.assertFalse(old_audio2.audio.storage.exists(old_audio2.audio.name))
+
+    def test_update_keeps_existing_audio(self):
+        """
+        Test that new uploads are added alongside the audio already attached.
+        """
+        kept = AudioFile.objects.create(note=self.note_user1, audio=self.create_audio_file("kept.wav"))
+        removed = AudioFile.objects.create(note=self.note_user1, audio=self.create_audio_file("removed.wav"))
+
+        url = f"/api/notes/{self.note_user1.id}/"
+        data = {
+            "uploaded_audios": [self.create_audio_file("added.wav")],
+            "removed_audio_ids": [removed.id],
+        }
+        response = self.client.patch(url, data, format="multipart")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        ids = {audio["id"] for audio in response.data["audio_files"]}
+        self.assertIn(kept.id, ids)
+        self.assertNotIn(removed.id, ids)
+        self.assertEqual(len(ids), 2)
+        self.assertTrue(kept.audio.storage.exists(kept.audio.name))
+
+    def test_title_only_update_does_no_file_io(self):
+        """
+        Test that editing only the text of a note neither writes nor removes files.
+        """
+        AudioFile.objects.create(note=self.note_user1, audio=self.create_audio_file("audio1.wav"))
+        url = f"/api/notes/{self.note_user1.id}/"
+
+        with mock.patch.object(FileSystemStorage, "_save") as save, \
+                mock.patch("notes.storage.save_audio_file") as save_blob, \
+                mock.patch("os.remove") as remove:
+            response = self.client.patch(url, {"title": "Renamed"}, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        save.assert_not_called()
+        save_blob.assert_not_called()
+        remove.assert_not_called()
+        self.assertEqual(self.note_user1.audio_files.count(), 1)
+
+    def test_cannot_remove_audio_from_another_note(self):
+        """
+        Test that removed_audio_ids must reference audio attached to the note.
+        """
+        other_note = Note.objects.create(user=self.user1, title="Other", description="Other note")
+        other_audio = AudioFile.objects.create(note=other_note, audio=self.create_audio_file("other.wav"))
+
+        url = f"/api/notes/{self.note_user1.id}/"
+        response = self.client.patch(url, {"removed_audio_ids": [other_audio.id]}, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertTrue(AudioFile.objects.filter(id=other_audio.id).exists())
 
     def test_delete_note_with_audio(self):
         """
@@ -180,6 +291,10 @@ class NotesAudioAPITest(APITestCase):
         response = self.client.delete(url)
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
 
+        # Files are removed by a background worker, not in the request.
+        self.assertTrue(audio1.audio.storage.exists(audio1.audio.name))
+        jobs.run_pending()
+
         self.assertFalse(audio1.audio.storage.exists(audio1.audio.name))
         self.assertFalse(audio2.audio.storage.exists(audio2.audio.name))
 
@@ -208,3 +323,2244 @@ class NotesAudioAPITest(APITestCase):
         url = '/api/notes/'
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+class NotesQueryCountTest(NotesTestCase):
+    """
+    Guard against N+1 queries on the notes list and detail endpoints.
+    """
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="queryuser", password="password123")
+        token = str(RefreshToken.for_user(self.user).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def create_notes(self, count, audios_per_note=2):
+        """
+        Helper function to create notes, each with a few audio files.
+        """
+        notes = []
+        for i in range(count):
+            note = Note.objects.create(user=self.user, title=f"Note {i}", description="Body")
+            for j in range(audios_per_note):
+                AudioFile.objects.create(
+                    note=note,
+                    audio=SimpleUploadedFile(f"audio{i}_{j}.wav", b"audio data", content_type="audio/wav"),
+                )
+            notes.append(note)
+        return notes
+
+    def test_list_query_count_is_constant(self):
+        """
+        Test that listing notes uses the same number of queries for 1 and 20 notes.
+        """
+        self.create_notes(1)
+        # Cold auth cache: user lookup, notes, prefetched audio files.
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/notes/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # The user now comes from the auth cache.
+        self.create_notes(19)
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/notes/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["results"]), 20)
+        self.assertTrue(all(len(note["audio_files"]) == 2 for note in response.data["results"]))
+
+    def test_retrieve_query_count(self):
+        """
+        Test that retrieving a note with several audio files uses a fixed number of queries.
+        """
+        note = self.create_notes(1, audios_per_note=5)[0]
+        self.client.get('/api/notes/')
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/notes/{note.id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["audio_files"]), 5)
+
+
+class NotesPaginationTest(NotesTestCase):
+    """
+    Tests for cursor pagination on the notes list.
+    """
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="pageuser", password="password123")
+        token = str(RefreshToken.for_user(self.user).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.notes = [
+            Note.objects.create(user=self.user, title=f"Note {i}", description="Body")
+            for i in range(7)
+        ]
+
+    def test_pages_are_newest_first_and_cover_all_notes(self):
+        """
+        Test that following the next cursor walks every note exactly once, newest first.
+        """
+        url = '/api/notes/?page_size=3'
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data["results"]), 3)
+            seen.extend(note["id"] for note in response.data["results"])
+            url = response.data["next"]
+
+        expected = [note.id for note in sorted(self.notes, key=lambda n: (n.created_at, n.id), reverse=True)]
+        self.assertEqual(seen, expected)
+
+    def test_page_size_is_capped(self):
+        """
+        Test that a client cannot request more than the maximum page size.
+        """
+        for i in range(100):
+            Note.objects.create(user=self.user, title=f"Extra {i}", description="Body")
+        response = self.client.get('/api/notes/?page_size=1000')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["results"]), 100)
+        self.assertIsNotNone(response.data["next"])
+
+    def test_deep_page_query_count(self):
+        """
+        Test that a page reached through a cursor costs the same queries as the first page.
+        """
+        response = self.client.get('/api/notes/?page_size=2')
+        next_url = response.data["next"]
+        next_url = self.client.get(next_url).data["next"]
+
+        with self.assertNumQueries(2):
+            response = self.client.get(next_url)
+        self.assertEqual(len(response.data["results"]), 2)
+
+
+class ChunkedUploadAPITest(NotesTestCase):
+    """
+    Tests for the resumable chunked audio upload protocol.
+    """
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="uploader", password="password123")
+        self.other = User.objects.create_user(username="intruder", password="password456")
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+        self.other_token = str(RefreshToken.for_user(self.other).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        self.note = Note.objects.create(user=self.user, title="Lecture", description="Long recording")
+        self.content = make_wav(duration_ms=1000)
+
+    def start_upload(self, **overrides):
+        data = {
+            "note": self.note.id,
+            "filename": "lecture.wav",
+            "content_type": "audio/wav",
+            "size": len(self.content),
+        }
+        data.update(overrides)
+        return self.client.post('/api/uploads/', data, format='json')
+
+    def put_chunk(self, upload_id, start, end):
+        return self.client.put(
+            f'/api/uploads/{upload_id}/',
+            data=self.content[start:end],
+            content_type="application/octet-stream",
+            HTTP_CONTENT_RANGE=f"bytes {start}-{end - 1}/{len(self.content)}",
+        )
+
+    def test_out_of_order_chunks_and_finalize(self):
+        """
+        Test that chunks sent out of order are assembled into a new AudioFile.
+        """
+        response = self.start_upload()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        upload_id = response.data["id"]
+        self.assertEqual(response.data["offset"], 0)
+
+        response = self.put_chunk(upload_id, 4096, len(self.content))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["offset"], 0)
+
+        response = self.client.post(f'/api/uploads/{upload_id}/finalize/')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+        response = self.put_chunk(upload_id, 0, 4096)
+        self.assertEqual(response.data["offset"], len(self.content))
+
+        response = self.client.get(f'/api/uploads/{upload_id}/')
+        self.assertEqual(response.data["received_ranges"], [[0, len(self.content)]])
+
+        response = self.client.post(f'/api/uploads/{upload_id}/finalize/')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        audio_file = self.note.audio_files.get()
+        with audio_file.audio.open("rb") as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertFalse(AudioUpload.objects.filter(pk=upload_id).exists())
+
+    def test_invalid_content_range(self):
+        """
+        Test that a chunk outside the declared size is rejected.
+        """
+        upload_id = self.start_upload().data["id"]
+        response = self.client.put(
+            f'/api/uploads/{upload_id}/',
+            data=b"xx",
+            content_type="application/octet-stream",
+            HTTP_CONTENT_RANGE=f"bytes 0-1/{len(self.content) + 1}",
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_rejects_unsupported_format_and_foreign_note(self):
+        """
+        Test that sessions are only created for allowed formats on the user's own notes.
+        """
+        response = self.start_upload(content_type="video/mp4")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.other_token}')
+        response = self.start_upload()
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_cannot_access_other_users_upload(self):
+        """
+        Test that another user cannot write to or finalize an upload session.
+        """
+        upload_id = self.start_upload().data["id"]
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.other_token}')
+        self.assertEqual(self.put_chunk(upload_id, 0, 10).status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.post(f'/api/uploads/{upload_id}/finalize/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class AudioDeduplicationTest(NotesTestCase):
+    """
+    Tests for content-addressed, reference-counted audio storage.
+    """
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="dedupuser", password="password123")
+        token = str(RefreshToken.for_user(self.user).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def create_note(self, title, content=None):
+        data = {
+            "title": title,
+            "description": "Body",
+            "uploaded_audios": [SimpleUploadedFile(f"{title}.wav", content or make_wav(), content_type="audio/wav")],
+        }
+        response = self.client.post('/api/notes/', data, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return Note.objects.get(id=response.data["id"])
+
+    def test_identical_uploads_share_one_blob(self):
+        """
+        Test that the same content uploaded twice is stored once with two references.
+        """
+        first = self.create_note("first")
+        second = self.create_note("second")
+
+        blob = AudioBlob.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+        self.assertEqual(blob.size, len(make_wav()))
+        self.assertEqual(first.audio_files.get().audio.name, second.audio_files.get().audio.name)
+        self.assertTrue(blob.file.storage.exists(blob.file.name))
+
+        self.client.delete(f'/api/notes/{first.id}/')
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 1)
+        self.assertTrue(blob.file.storage.exists(blob.file.name))
+
+        self.client.delete(f'/api/notes/{second.id}/')
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 0)
+        self.assertTrue(blob.file.storage.exists(blob.file.name))
+
+        jobs.run_pending()
+        self.assertFalse(AudioBlob.objects.exists())
+        self.assertFalse(blob.file.storage.exists(blob.file.name))
+
+    def test_reupload_revives_blob_pending_purge(self):
+        """
+        Test that uploading content whose blob is queued for purging keeps the blob.
+        """
+        first = self.create_note("first")
+        self.client.delete(f'/api/notes/{first.id}/')
+        self.assertEqual(AudioBlob.objects.get().ref_count, 0)
+
+        self.create_note("second")
+        jobs.run_pending()
+
+        blob = AudioBlob.objects.get()
+        self.assertEqual(blob.ref_count, 1)
+        self.assertTrue(blob.file.storage.exists(blob.file.name))
+
+    def test_different_content_gets_separate_blobs(self):
+        """
+        Test that different content is stored in different blobs.
+        """
+        self.create_note("first", content=make_wav(seed=1))
+        self.create_note("second", content=make_wav(seed=2))
+        self.assertEqual(AudioBlob.objects.count(), 2)
+        self.assertTrue(all(blob.ref_count == 1 for blob in AudioBlob.objects.all()))
+
+    def test_user_cascade_releases_blobs(self):
+        """
+        Test that deleting a user releases the blobs behind their audio files.
+        """
+        self.create_note("first")
+        blob = AudioBlob.objects.get()
+        self.user.delete()
+        jobs.run_pending()
+        self.assertFalse(AudioBlob.objects.exists())
+        self.assertFalse(blob.file.storage.exists(blob.file.name))
+
+
+class AudioStreamingTest(NotesTestCase):
+    """
+    Tests for the authenticated audio streaming endpoint.
+    """
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="listener", password="password123")
+        self.other = User.objects.create_user(username="stranger", password="password456")
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+        self.content = bytes(range(100))
+        note = Note.objects.create(user=self.user, title="Podcast", description="Episode")
+        self.audio = storage.save_audio_file(
+            note, SimpleUploadedFile("episode.wav", self.content, content_type="audio/wav")
+        )
+        self.url = f'/api/audio/{self.audio.id}/stream/'
+
+    def test_full_download(self):
+        """
+        Test that a request without Range returns the whole file with an ETag.
+        """
+        response = self.client.get(self.url, HTTP_ACCEPT="audio/*")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.getvalue(), self.content)
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertEqual(response["ETag"], f'"{self.audio.blob_id}"')
+        self.assertIn(response["Content-Type"], ("audio/wav", "audio/x-wav"))
+
+    def test_range_requests(self):
+        """
+        Test bounded, open-ended and suffix byte ranges.
+        """
+        response = self.client.get(self.url, HTTP_RANGE="bytes=10-19")
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(response.getvalue(), self.content[10:20])
+        self.assertEqual(response["Content-Range"], "bytes 10-19/100")
+        self.assertEqual(response["Content-Length"], "10")
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=90-")
+        self.assertEqual(response.getvalue(), self.content[90:])
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=-5")
+        self.assertEqual(response.getvalue(), self.content[-5:])
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=200-300")
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(response["Content-Range"], "bytes */100")
+
+    def test_if_range_mismatch_serves_full_file(self):
+        """
+        Test that a stale If-Range validator turns a range request into a full response.
+        """
+        response = self.client.get(self.url, HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.getvalue(), self.content)
+
+    def test_if_range_weak_etag_serves_full_file(self):
+        """
+        Test that If-Range compares strongly, so a weak form of the current ETag is not a match.
+        """
+        etag = self.client.get(self.url)["ETag"]
+        response = self.client.get(self.url, HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE=f"W/{etag}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.getvalue(), self.content)
+
+    def test_if_none_match(self):
+        """
+        Test that a matching ETag returns 304 without a body.
+        """
+        etag = self.client.get(self.url)["ETag"]
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b"")
+
+    @override_settings(AUDIO_SENDFILE_HEADER="X-Accel-Redirect", AUDIO_SENDFILE_PREFIX="/protected-media/")
+    def test_offloads_to_proxy(self):
+        """
+        Test that the transfer is handed to the proxy when a sendfile header is configured.
+        """
+        response = self.client.get(self.url, HTTP_RANGE="bytes=0-9")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["X-Accel-Redirect"], f"/protected-media/{self.audio.audio.name}")
+        self.assertEqual(response.content, b"")
+
+    def test_other_user_gets_404(self):
+        """
+        Test that another user cannot stream the audio.
+        """
+        other_token = str(RefreshToken.for_user(self.other).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {other_token}')
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class JobQueueTest(NotesTestCase):
+    """
+    Tests for the database-backed background job queue.
+    """
+    def setUp(self):
+        self.calls = []
+        jobs.task("test_record")(lambda **payload: self.calls.append(payload))
+
+    def tearDown(self):
+        jobs._registry.pop("test_record", None)
+        jobs._registry.pop("test_fail", None)
+
+    def test_enqueue_and_run(self):
+        """
+        Test that queued jobs run with their payload and are removed on success.
+        """
+        jobs.enqueue("test_record", value=1)
+        jobs.enqueue("test_record", value=2)
+
+        jobs.run_pending()
+        self.assertEqual(self.calls, [{"value": 1}, {"value": 2}])
+        self.assertFalse(Job.objects.exists())
+
+    def test_future_jobs_wait(self):
+        """
+        Test that jobs scheduled in the future are not claimed early.
+        """
+        jobs.enqueue("test_record", run_at=timezone.now() + timedelta(minutes=5), value=1)
+        self.assertEqual(jobs.run_pending(), 0)
+        self.assertEqual(self.calls, [])
+
+    @override_settings(JOB_MAX_ATTEMPTS=2, JOB_RETRY_BACKOFF=30)
+    def test_retries_with_backoff_then_fails(self):
+        """
+        Test that a failing job is retried after a backoff and then marked failed.
+        """
+        def fail():
+            raise RuntimeError("boom")
+        jobs.task("test_fail")(fail)
+        job = jobs.enqueue("test_fail")
+
+        before = timezone.now()
+        with self.assertLogs("notes.jobs", level="WARNING"):
+            self.assertEqual(jobs.run_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertEqual(job.attempts, 1)
+        self.assertGreaterEqual(job.run_at, before + timedelta(seconds=30))
+        self.assertIn("boom", job.last_error)
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        with self.assertLogs("notes.jobs", level="ERROR"):
+            jobs.run_pending()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.attempts, 2)
+
+    def test_stale_running_job_is_reclaimed(self):
+        """
+        Test that a job abandoned by a dead worker is claimed again.
+        """
+        job = jobs.enqueue("test_record", value=1)
+        Job.objects.filter(pk=job.pk).update(
+            status=Job.RUNNING, locked_at=timezone.now() - timedelta(hours=1), attempts=1
+        )
+        self.assertEqual(jobs.run_pending(), 1)
+        self.assertEqual(self.calls, [{"value": 1}])
+
+    def test_runworker_burst(self):
+        """
+        Test that the runworker command drains the queue in burst mode.
+        """
+        jobs.enqueue("test_record", value=1)
+        call_command("runworker", "--burst", stdout=StringIO())
+        self.assertEqual(self.calls, [{"value": 1}])
+
+
+class AudioMetadataTest(NotesTestCase):
+    """
+    Tests for format sniffing and header parsing of uploaded audio.
+    """
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="metauser", password="password123")
+        token = str(RefreshToken.for_user(self.user).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def upload(self, name, content, content_type="audio/wav"):
+        data = {
+            "title": "Meta",
+            "description": "Body",
+            "uploaded_audios": [SimpleUploadedFile(name, content, content_type=content_type)],
+        }
+        return self.client.post('/api/notes/', data, format='multipart')
+
+    def mp3_frames(self, count, xing_frames=None):
+        """
+        Build MPEG-1 Layer III frames at 128 kbps, 44.1 kHz, joint stereo.
+        """
+        header = bytes([0xFF, 0xFB, 0x90, 0x64])
+        frame = header + bytes(417 - 4)
+        first = frame
+        if xing_frames is not None:
+            body = bytearray(417 - 4)
+            body[32:44] = b"Xing" + (1).to_bytes(4, "big") + xing_frames.to_bytes(4, "big")
+            first = header + bytes(body)
+        return first + frame * (count - 1)
+
+    def adts_frames(self, count, length=200):
+        """
+        Build AAC-LC ADTS frames at 44.1 kHz stereo.
+        """
+        header = bytes([
+            0xFF, 0xF1, 0x50,
+            0x80 | (length >> 11),
+            (length >> 3) & 0xFF,
+            ((length & 0x07) << 5) | 0x1F,
+            0xFC,
+        ])
+        return (header + bytes(length - 7)) * count
+
+    def test_wav_properties_are_stored_and_returned(self):
+        """
+        Test that WAV duration, sample rate, channels and bitrate come back from the API.
+        """
+        response = self.upload("speech.wav", make_wav(duration_ms=1500, sample_rate=16000, channels=2))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        audio = response.data["audio_files"][0]
+        self.assertEqual(audio["duration_ms"], 1500)
+        self.assertEqual(audio["sample_rate"], 16000)
+        self.assertEqual(audio["channels"], 2)
+        self.assertEqual(audio["bitrate"], 16000 * 2 * 16)
+
+    def test_cbr_mp3(self):
+        """
+        Test that a constant bitrate MP3 behind an ID3 tag is recognised and timed.
+        """
+        id3 = b"ID3\x04\x00\x00\x00\x00\x00\x0a" + bytes(10)
+        response = self.upload("song.mp3", id3 + self.mp3_frames(100), content_type="audio/mpeg")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        audio = response.data["audio_files"][0]
+        self.assertAlmostEqual(audio["duration_ms"], 2612, delta=10)
+        self.assertEqual(audio["sample_rate"], 44100)
+        self.assertEqual(audio["channels"], 2)
+        self.assertEqual(audio["bitrate"], 128000)
+
+    def test_vbr_mp3_uses_xing_frame_count(self):
+        """
+        Test that the Xing header frame count determines the MP3 duration.
+        """
+        with io.BytesIO(self.mp3_frames(10, xing_frames=1000)) as source:
+            info = audio_meta.probe(source, 4170)
+        self.assertEqual(info.format, "mp3")
+        self.assertEqual(info.duration_ms, 1000 * 1152 * 1000 // 44100)
+
+    def test_adts_aac(self):
+        """
+        Test that an ADTS AAC stream is recognised and its duration estimated.
+        """
+        response = self.upload("voice.aac", self.adts_frames(50), content_type="audio/aac")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        audio = response.data["audio_files"][0]
+        self.assertEqual(audio["sample_rate"], 44100)
+        self.assertEqual(audio["channels"], 2)
+        self.assertAlmostEqual(audio["duration_ms"], 50 * 1024 * 1000 // 44100, delta=2)
+
+    def test_browser_recordings(self):
+        """
+        Test that WebM and Ogg Opus recordings from MediaRecorder are accepted.
+        """
+        webm = b"\x1a\x45\xdf\xa3\x9f\x42\x86\x81\x01" + b"\x42\x82\x84webm" + bytes(200)
+        response = self.upload("recording.webm", webm, content_type="audio/webm")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        self.assertIsNone(response.data["audio_files"][0]["duration_ms"])
+
+        opus_head = b"OpusHead" + bytes([1, 1]) + (312).to_bytes(2, "little") + (16000).to_bytes(4, "little") + bytes(3)
+        page = b"OggS\x00\x02" + bytes(20) + bytes([1, len(opus_head)]) + opus_head
+        response = self.upload("recording.ogg", page + bytes(200), content_type="audio/ogg")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+
+        audio = response.data["audio_files"][0]
+        self.assertEqual(audio["sample_rate"], 48000)
+        self.assertEqual(audio["channels"], 1)
+
+    def test_content_type_is_not_trusted(self):
+        """
+        Test that non-audio content is rejected even with an audio content type.
+        """
+        response = self.upload("fake.wav", b"<html>not audio</html>")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("uploaded_audios", response.data)
+
+
+class WaveformPeaksTest(NotesTestCase):
+    """
+    Tests for precomputed waveform peaks.
+    """
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="waveuser", password="password123")
+        token = str(RefreshToken.for_user(self.user).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def make_pcm_wav(self, samples, sample_rate=8000, sampwidth=2):
+        """
+        Build a WAV from an int array of shape (frames, channels).
+        """
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wav:
+            wav.setnchannels(samples.shape[1])
+            wav.setsampwidth(sampwidth)
+            wav.setframerate(sample_rate)
+            if sampwidth == 3:
+                raw = samples.astype("<i4").view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+            else:
+                raw = samples.astype("<i2").tobytes()
+            wav.writeframes(raw)
+        return buffer.getvalue()
+
+    def test_levels_and_values(self):
+        """
+        Test that peaks capture min/max per window at each zoom level.
+        """
+        frames = waveform.BASE_SAMPLES_PER_PEAK * 10 + 7
+        left = np.zeros(frames, dtype=np.int64)
+        left[::2] = 16384
+        right = np.zeros(frames, dtype=np.int64)
+        right[1::2] = -32768
+        path = self.write_temp(self.make_pcm_wav(np.stack([left, right], axis=1)))
+
+        sample_rate, levels = waveform.compute_peaks(path)
+        self.assertEqual(sample_rate, 8000)
+        self.assertEqual(
+            [(spp, len(peaks)) for spp, peaks in levels],
+            [(256, 11), (1024, 3), (4096, 1), (16384, 1)],
+        )
+        self.assertEqual(levels[0][1][0].tolist(), [-127, 64])
+        self.assertEqual(levels[3][1][0].tolist(), [-127, 64])
+
+    def test_24_bit_samples(self):
+        """
+        Test that packed 24-bit samples are decoded with their sign.
+        """
+        samples = np.array([[-(2 ** 23)], [2 ** 22], [0]] * 100)
+        path = self.write_temp(self.make_pcm_wav(samples, sampwidth=3))
+        _, levels = waveform.compute_peaks(path)
+        self.assertEqual(levels[0][1][0].tolist(), [-127, 64])
+
+    def test_peaks_endpoint(self):
+        """
+        Test that peaks are generated by the worker and served per resolution.
+        """
+        samples = (np.sin(np.linspace(0, 200 * np.pi, 8000 * 5)) * 16384).astype(np.int64)[:, None]
+        data = {
+            "title": "Waves",
+            "description": "Body",
+            "uploaded_audios": [SimpleUploadedFile("tone.wav", self.make_pcm_wav(samples), content_type="audio/wav")],
+        }
+        response = self.client.post('/api/notes/', data, format='multipart')
+        audio_id = response.data["audio_files"][0]["id"]
+        url = f'/api/audio/{audio_id}/peaks/'
+
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+        jobs.run_pending()
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["samples_per_peak"], 16384)
+
+        response = self.client.get(url, {"peaks": 100})
+        self.assertEqual(response.data["samples_per_peak"], 256)
+        self.assertEqual(response.data["length"], 157)
+        self.assertEqual(len(response.data["data"]), 2 * 157)
+        self.assertAlmostEqual(max(response.data["data"]), 64, delta=1)
+        self.assertAlmostEqual(min(response.data["data"]), -64, delta=1)
+
+        with mock.patch("notes.waveform.compute_peaks") as compute:
+            self.client.get(url, {"peaks": 10})
+        compute.assert_not_called()
+
+        blob_id = AudioFile.objects.get(id=audio_id).blob_id
+        self.assertTrue(os.path.exists(waveform.peaks_path(blob_id)))
+        self.client.delete(f'/api/notes/{Note.objects.get().id}/')
+        jobs.run_pending()
+        self.assertFalse(os.path.exists(waveform.peaks_path(blob_id)))
+
+    def write_temp(self, content):
+        handle = tempfile.NamedTemporaryFile(suffix=".wav", delete=False)
+        with handle:
+            handle.write(content)
+        self.addCleanup(os.remove, handle.name)
+        return handle.name
+
+
+class NoteSearchTest(NotesTestCase):
+    """
+    Tests for full-text search on the notes list.
+    """
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="searcher", password="password123")
+        other = User.objects.create_user(username="otheruser", password="password456")
+        token = str(RefreshToken.for_user(self.user).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+        self.title_match = Note.objects.create(user=self.user, title="Biology lecture", description="Cells")
+        self.body_match = Note.objects.create(user=self.user, title="Monday", description="Biology homework")
+        Note.objects.create(user=self.user, title="Groceries", description="Milk and eggs")
+        Note.objects.create(user=other, title="Biology notes", description="Not mine")
+
+    def test_search_ranks_title_matches_first(self):
+        """
+        Test that matching notes are returned, title matches ranked above description matches.
+        """
+        response = self.client.get('/api/notes/', {"q": "biology"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["count"], 2)
+        ids = [note["id"] for note in response.data["results"]]
+        self.assertEqual(ids, [self.title_match.id, self.body_match.id])
+
+    def test_search_requires_all_terms(self):
+        """
+        Test that every search term has to match.
+        """
+        response = self.client.get('/api/notes/', {"q": "biology homework"})
+        self.assertEqual([note["id"] for note in response.data["results"]], [self.body_match.id])
+
+    def test_search_is_paginated(self):
+        """
+        Test that search results are paginated by page number.
+        """
+        response = self.client.get('/api/notes/', {"q": "biology", "page_size": 1})
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertIsNotNone(response.data["next"])
+
+    def test_search_query_is_ignored_on_detail(self):
+        """
+        Test that ?q= does not filter the detail endpoint.
+        """
+        response = self.client.get(f'/api/notes/{self.body_match.id}/', {"q": "groceries"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class NoteResponseCacheTest(NotesTestCase):
+    """
+    Tests for the per-user notes response cache and conditional GET.
+    """
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="poller", password="password123")
+        self.other = User.objects.create_user(username="bystander", password="password456")
+        token = str(RefreshToken.for_user(self.user).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.note = Note.objects.create(user=self.user, title="Cached", description="Body")
+
+    def test_unchanged_poll_gets_304_without_note_queries(self):
+        """
+        Test that a poll with the current ETag is answered with 304 without any queries.
+        """
+        response = self.client.get('/api/notes/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response["ETag"]
+        self.assertIn("Last-Modified", response)
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/notes/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/notes/', HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_repeat_get_is_served_from_cache(self):
+        """
+        Test that a repeated list and detail GET runs no queries.
+        """
+        first = self.client.get('/api/notes/')
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/notes/')
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(second.json(), first.json())
+
+        self.client.get(f'/api/notes/{self.note.id}/')
+        with self.assertNumQueries(0):
+            response = self.client.get(f'/api/notes/{self.note.id}/')
+        self.assertEqual(response.json()["title"], "Cached")
+
+    def test_writes_invalidate(self):
+        """
+        Test that note and audio writes change the ETag and the cached content.
+        """
+        etag = self.client.get('/api/notes/')["ETag"]
+
+        self.client.patch(f'/api/notes/{self.note.id}/', {"title": "Changed"}, format="json")
+        response = self.client.get('/api/notes/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["results"][0]["title"], "Changed")
+
+        etag = response["ETag"]
+        storage.save_audio_file(self.note, SimpleUploadedFile("a.wav", make_wav(), content_type="audio/wav"))
+        response = self.client.get('/api/notes/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()["results"][0]["audio_files"]), 1)
+
+    def test_other_users_writes_do_not_invalidate(self):
+        """
+        Test that the cache is per user.
+        """
+        etag = self.client.get('/api/notes/')["ETag"]
+        Note.objects.create(user=self.other, title="Elsewhere", description="Body")
+        response = self.client.get('/api/notes/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+
+class NoteBulkAPITest(NotesTestCase):
+    """
+    Tests for creating, updating and deleting notes in one bulk request.
+    """
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="bulkuser", password="StrongPassword123!")
+        self.other = User.objects.create_user(username="bulkother", password="StrongPassword123!")
+        token = RefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_large_batch_uses_constant_queries(self):
+        """
+        Test that a 1000-item batch is applied with a handful of queries.
+        """
+        existing = Note.objects.bulk_create(
+            [Note(user=self.user, title=f"Old {i}", description="Body") for i in range(400)]
+        )
+        payload = {
+            "create": [{"title": f"New {i}", "description": "Body"} for i in range(400)],
+            "update": [{"id": note.id, "title": f"Updated {note.id}"} for note in existing[:100]],
+            "delete": [note.id for note in existing[100:300]],
+        }
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/notes/bulk/', payload, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertLess(len(queries), 20)
+
+        results = response.json()
+        self.assertEqual(len(results["create"]), 400)
+        self.assertTrue(all(item["status"] == 201 for item in results["create"]))
+        self.assertEqual(Note.objects.filter(user=self.user).count(), 600)
+        self.assertEqual(Note.objects.get(id=existing[0].id).title, f"Updated {existing[0].id}")
+        self.assertEqual(Note.objects.get(id=existing[0].id).description, "Body")
+        self.assertFalse(Note.objects.filter(id=existing[100].id).exists())
+
+    def test_deleting_notes_with_audio_uses_constant_queries(self):
+        """
+        Test that deleting notes with audio releases blobs, usage and tombstones in batches.
+        """
+        with tempfile.TemporaryDirectory() as tmp, override_settings(MEDIA_ROOT=tmp, AUDIO_PROCESSING_STAGES=[]):
+            notes = Note.objects.bulk_create(
+                [Note(user=self.user, title=f"Old {i}", description="Body") for i in range(101)]
+            )
+            # 50 blobs shared by two deleted notes each; the kept note holds a third reference to one.
+            storage.save_audio_batch(
+                [(note, [make_wav(duration_ms=20, seed=i % 50)], f"{i}.wav") for i, note in enumerate(notes)]
+            )
+            kept = notes.pop()
+
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post('/api/notes/bulk/', {"delete": [note.id for note in notes]}, format="json")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLess(len(queries), 20)
+
+        self.assertEqual(list(Note.objects.filter(user=self.user)), [kept])
+        self.assertEqual(StorageUsage.objects.get(user=self.user).audio_count, 1)
+        self.assertEqual(AudioBlob.objects.get(pk=kept.audio_files.get().blob_id).ref_count, 1)
+        self.assertEqual(AudioBlob.objects.filter(ref_count=0).count(), 49)
+        self.assertEqual(Job.objects.filter(task="purge_blob").count(), 49)
+        self.assertEqual(Tombstone.objects.filter(user_id=self.user.id, kind=Tombstone.NOTE).count(), 100)
+        self.assertEqual(Tombstone.objects.filter(user_id=self.user.id, kind=Tombstone.AUDIO_FILE).count(), 100)
+
+    def test_invalid_item_rolls_back_batch(self):
+        """
+        Test that an invalid item or unknown update id leaves the database unchanged.
+        """
+        note = Note.objects.create(user=self.user, title="Keep", description="Body")
+        response = self.client.post(
+            '/api/notes/bulk/',
+            {"create": [{"title": "Ok", "description": "Body"}, {"title": ""}], "delete": [note.id]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("title", response.json()["create"]["1"])
+
+        other_note = Note.objects.create(user=self.other, title="Theirs", description="Body")
+        response = self.client.post(
+            '/api/notes/bulk/',
+            {
+                "create": [{"title": "Ok", "description": "Body"}],
+                "update": [{"id": other_note.id, "title": "Mine now"}],
+                "delete": [note.id],
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Note.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(Note.objects.get(id=other_note.id).title, "Theirs")
+
+    def test_other_users_notes_are_not_deleted(self):
+        """
+        Test that deleting another user's note is reported as not found.
+        """
+        other_note = Note.objects.create(user=self.other, title="Theirs", description="Body")
+        response = self.client.post('/api/notes/bulk/', {"delete": [other_note.id]}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["delete"], [{"id": other_note.id, "status": 404}])
+        self.assertTrue(Note.objects.filter(id=other_note.id).exists())
+
+    @override_settings(NOTES_BULK_MAX_ITEMS=2)
+    def test_batch_size_limit(self):
+        """
+        Test that oversized batches are rejected.
+        """
+        response = self.client.post('/api/notes/bulk/', {"delete": [1, 2, 3]}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_invalidates_cache(self):
+        """
+        Test that a bulk write changes the list ETag.
+        """
+        etag = self.client.get('/api/notes/')["ETag"]
+        self.client.post('/api/notes/bulk/', {"create": [{"title": "New", "description": "Body"}]}, format="json")
+        response = self.client.get('/api/notes/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["results"][0]["title"], "New")
+
+
+class AudioTransferASGITest(NotesTestCase):
+    """
+    Tests for the ASGI fast path serving chunk uploads and audio streams.
+    """
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="asyncuser", password="password123")
+        self.other = User.objects.create_user(username="asyncother", password="password456")
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+        self.note = Note.objects.create(user=self.user, title="Field recording", description="Slow uplink")
+        self.passed_through = []
+        self.app = AudioTransferMiddleware(self.inner_app)
+
+    async def inner_app(self, scope, receive, send):
+        self.passed_through.append(scope["path"])
+        await send({"type": "http.response.start", "status": 204, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    def call(self, method, path, body_chunks=(), token=None, headers=(), host=b"testserver"):
+        """
+        Run one request through the middleware and return (status, headers, body).
+        """
+        token = token or self.token
+        scope = {
+            "type": "http",
+            "method": method,
+            "path": path,
+            "query_string": b"",
+            "headers": [(b"host", host), (b"authorization", f"Bearer {token}".encode()), *headers],
+        }
+        messages = [
+            {"type": "http.request", "body": chunk, "more_body": i < len(body_chunks) - 1}
+            for i, chunk in enumerate(body_chunks)
+        ] or [{"type": "http.request", "body": b""}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+        async def send(message):
+            sent.append(message)
+
+        # As the test client does, keep the request signals from closing the
+        # connection that holds the test transaction.
+        signals.request_started.disconnect(close_old_connections)
+        signals.request_finished.disconnect(close_old_connections)
+        try:
+            async_to_sync(self.app)(scope, receive, send)
+        finally:
+            signals.request_started.connect(close_old_connections)
+            signals.request_finished.connect(close_old_connections)
+
+        start = sent[0]
+        response_headers = {name.decode(): value.decode() for name, value in start["headers"]}
+        body = b"".join(message.get("body", b"") for message in sent[1:])
+        return start["status"], response_headers, body
+
+    def test_chunk_upload_streams_body_messages(self):
+        """
+        Test that a chunk split over many body messages lands at its offset.
+        """
+        content = make_wav(duration_ms=1000)
+        upload = AudioUpload.objects.create(
+            user=self.user, note=self.note, filename="field.wav", content_type="audio/wav", size=len(content)
+        )
+        uploads.allocate(upload)
+
+        half = len(content) // 2
+        pieces = [content[half:][i:i + 1000] for i in range(0, len(content) - half, 1000)]
+        range_header = (b"content-range", f"bytes {half}-{len(content) - 1}/{len(content)}".encode())
+        status_code, _, body = self.call("PUT", f"/api/uploads/{upload.id}/", pieces, headers=[range_header])
+        self.assertEqual(status_code, 200)
+        self.assertEqual(json.loads(body)["received_ranges"], [[half, len(content)]])
+
+        range_header = (b"content-range", f"bytes 0-{half - 1}/{len(content)}".encode())
+        status_code, _, body = self.call("PUT", f"/api/uploads/{upload.id}/", [content[:half]], headers=[range_header])
+        self.assertEqual(json.loads(body)["offset"], len(content))
+        with open(upload.temp_path, "rb") as part:
+            self.assertEqual(part.read(), content)
+        upload.delete()
+
+    def test_upload_errors(self):
+        """
+        Test authentication, ownership and Content-Range checks on the fast path.
+        """
+        upload = AudioUpload.objects.create(
+            user=self.user, note=self.note, filename="field.wav", content_type="audio/wav", size=10
+        )
+        uploads.allocate(upload)
+        url = f"/api/uploads/{upload.id}/"
+
+        status_code, headers, _ = self.call("PUT", url, [b"x" * 10], token="garbage")
+        self.assertEqual(status_code, 401)
+        self.assertIn("www-authenticate", headers)
+
+        other_token = str(RefreshToken.for_user(self.other).access_token)
+        range_header = (b"content-range", b"bytes 0-9/10")
+        status_code, _, _ = self.call("PUT", url, [b"x" * 10], token=other_token, headers=[range_header])
+        self.assertEqual(status_code, 404)
+
+        status_code, _, body = self.call("PUT", url, [b"x" * 10], headers=[(b"content-range", b"bytes 0-9/11")])
+        self.assertEqual(status_code, 400)
+        self.assertIn("detail", json.loads(body))
+        upload.delete()
+
+    def test_stream_matches_sync_view(self):
+        """
+        Test full, ranged and conditional downloads through the fast path.
+        """
+        audio = storage.save_audio_file(
+            self.note, SimpleUploadedFile("field.wav", make_wav(duration_ms=1000), content_type="audio/wav")
+        )
+        with audio.audio.open("rb") as f:
+            content = f.read()
+        url = f"/api/audio/{audio.id}/stream/"
+
+        status_code, headers, body = self.call("GET", url)
+        self.assertEqual(status_code, 200)
+        self.assertEqual(body, content)
+        self.assertEqual(headers["content-length"], str(len(content)))
+        self.assertEqual(headers["etag"], f'"{audio.blob_id}"')
+
+        status_code, headers, body = self.call("GET", url, headers=[(b"range", b"bytes=100-199")])
+        self.assertEqual(status_code, 206)
+        self.assertEqual(body, content[100:200])
+        self.assertEqual(headers["content-range"], f"bytes 100-199/{len(content)}")
+
+        status_code, _, body = self.call("GET", url, headers=[(b"if-none-match", headers["etag"].encode())])
+        self.assertEqual(status_code, 304)
+        self.assertEqual(body, b"")
+
+        other_token = str(RefreshToken.for_user(self.other).access_token)
+        status_code, _, _ = self.call("GET", url, token=other_token)
+        self.assertEqual(status_code, 404)
+
+    def test_cors_and_passthrough(self):
+        """
+        Test that CORS headers are added and other requests reach Django.
+        """
+        status_code, headers, _ = self.call(
+            "PUT", "/api/uploads/00000000-0000-0000-0000-000000000000/", headers=[(b"origin", b"https://app.example")]
+        )
+        self.assertEqual(status_code, 404)
+        self.assertEqual(headers["access-control-allow-origin"], "*")
+
+        status_code, _, _ = self.call("GET", "/api/notes/")
+        self.assertEqual(status_code, 204)
+        status_code, _, _ = self.call("POST", "/api/uploads/00000000-0000-0000-0000-000000000000/")
+        self.assertEqual(status_code, 204)
+        self.assertEqual(self.passed_through, ["/api/notes/", "/api/uploads/00000000-0000-0000-0000-000000000000/"])
+
+        status_code, _, _ = self.call("GET", "/api/audio/not-a-number/stream/")
+        self.assertEqual(status_code, 404)
+
+    @override_settings(METRICS_TOKEN="scrape-secret")
+    def test_transfers_are_recorded_in_metrics(self):
+        """
+        Test that chunk uploads and streams on the fast path show up in /api/metrics/.
+        """
+        for histogram in metrics.REGISTRY:
+            histogram.clear()
+        content = make_wav(duration_ms=500)
+        upload = AudioUpload.objects.create(
+            user=self.user, note=self.note, filename="field.wav", content_type="audio/wav", size=len(content)
+        )
+        uploads.allocate(upload)
+        headers = [
+            (b"content-range", f"bytes 0-{len(content) - 1}/{len(content)}".encode()),
+            (b"content-length", str(len(content)).encode()),
+        ]
+        status_code, _, _ = self.call("PUT", f"/api/uploads/{upload.id}/", [content], headers=headers)
+        self.assertEqual(status_code, 200)
+        audio = storage.save_audio_file(self.note, SimpleUploadedFile("field.wav", content, content_type="audio/wav"))
+        self.assertEqual(self.call("GET", f"/api/audio/{audio.id}/stream/")[0], 200)
+
+        body = self.client_class().get('/api/metrics/', HTTP_AUTHORIZATION="Bearer scrape-secret").content.decode()
+        self.assertIn('notes_request_duration_seconds_count{view="uploads-detail",method="PUT"} 1', body)
+        self.assertIn('notes_request_duration_seconds_count{view="audio-stream",method="GET"} 1', body)
+        self.assertIn(
+            f'notes_request_upload_bytes_sum{{view="uploads-detail",method="PUT"}} {float(len(content))!r}', body
+        )
+        self.assertIn(
+            f'notes_request_media_written_bytes_sum{{view="uploads-detail",method="PUT"}} {float(len(content))!r}', body
+        )
+        self.assertGreater(metrics.SQL_QUERIES._series[("uploads-detail", "PUT")]["sum"], 0)
+        upload.delete()
+
+    def test_disallowed_host_is_rejected(self):
+        """
+        Test that the fast path validates the Host header like Django's handler.
+        """
+        upload = AudioUpload.objects.create(
+            user=self.user, note=self.note, filename="field.wav", content_type="audio/wav", size=10
+        )
+        uploads.allocate(upload)
+        range_header = (b"content-range", b"bytes 0-9/10")
+        with self.assertLogs("django.security.DisallowedHost", "ERROR"):
+            status_code, _, _ = self.call(
+                "PUT", f"/api/uploads/{upload.id}/", [b"x" * 10], headers=[range_header], host=b"evil.example"
+            )
+        self.assertEqual(status_code, 400)
+        upload.refresh_from_db()
+        self.assertEqual(upload.received_ranges, [])
+        upload.delete()
+
+
+class CachedAuthenticationTest(NotesTestCase):
+    """
+    Tests for resolving JWT users through the cache.
+    """
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="cacheduser", password="password123")
+        token = str(RefreshToken.for_user(self.user).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.note = Note.objects.create(user=self.user, title="Mine", description="Body")
+
+    def test_warm_requests_skip_user_query(self):
+        """
+        Test that only the first request loads the user row.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(f'/api/notes/{self.note.id}/')
+        self.assertTrue(any("auth_user" in query["sql"] for query in queries))
+
+        self.client.post('/api/notes/', {"title": "Second", "description": "Body"}, format="multipart")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/notes/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(any("auth_user" in query["sql"] for query in queries))
+
+    def test_cache_holds_no_credentials(self):
+        """
+        Test that the cached user keeps only the listed fields and no password hash.
+        """
+        self.client.get('/api/notes/')
+        cached = cache.get(authentication.user_cache_key(self.user.id))
+        self.assertEqual(set(cached), set(authentication.CACHED_USER_FIELDS))
+
+        user = authentication.CachedJWTAuthentication().get_user(RefreshToken.for_user(self.user).access_token)
+        self.assertEqual((user.pk, user.username, user.is_active), (self.user.pk, "cacheduser", True))
+        self.assertIn("password", user.get_deferred_fields())
+
+    def test_deactivation_takes_effect_immediately(self):
+        """
+        Test that saving the user drops the cached row.
+        """
+        self.assertEqual(self.client.get('/api/notes/').status_code, status.HTTP_200_OK)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/notes/').status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deleted_user_is_rejected(self):
+        """
+        Test that deleting the user drops the cached row.
+        """
+        self.assertEqual(self.client.get('/api/notes/').status_code, status.HTTP_200_OK)
+        self.user.delete()
+        self.assertEqual(self.client.get('/api/notes/').status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class ReplicaRoutingTest(NotesTestCase):
+    """
+    Tests for sending note reads to replicas with read-your-writes stickiness.
+    """
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="replicauser", password="password123")
+        token = str(RefreshToken.for_user(self.user).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.router = routers.ReplicaRouter()
+
+    @override_settings(DATABASE_READ_REPLICAS=["replica"])
+    def test_router_decisions(self):
+        """
+        Test that only reads inside replica_reads() go to the replica, until the user writes.
+        """
+        self.assertIsNone(self.router.db_for_read(Note))
+        with routers.replica_reads(self.user.id):
+            self.assertEqual(self.router.db_for_read(Note), "replica")
+            self.assertEqual(self.router.db_for_write(Note), "default")
+        self.assertIsNone(self.router.db_for_read(Note))
+
+        Note.objects.create(user=self.user, title="Fresh", description="Body")
+        with routers.replica_reads(self.user.id):
+            self.assertIsNone(self.router.db_for_read(Note))
+
+        other = User.objects.create_user(username="replicaother", password="password456")
+        with routers.replica_reads(other.id):
+            self.assertEqual(self.router.db_for_read(Note), "replica")
+
+    @override_settings(DATABASE_READ_REPLICAS=[])
+    def test_no_replicas_configured(self):
+        """
+        Test that reads stay on the primary without replicas.
+        """
+        with routers.replica_reads(self.user.id):
+            self.assertIsNone(self.router.db_for_read(Note))
+
+    def test_list_reads_follow_stickiness(self):
+        """
+        Test that list reads use the replica, and the primary right after the user's own write.
+        """
+        note = Note.objects.create(user=self.user, title="Before", description="Body")
+        cache.clear()
+        decisions = []
+        original = routers.ReplicaRouter.db_for_read
+
+        def spy(router, model, **hints):
+            alias = original(router, model, **hints)
+            if model is Note:
+                decisions.append(alias)
+            return alias
+
+        # The test database stands in for the replica so the reads succeed.
+        with override_settings(DATABASE_READ_REPLICAS=["default"]), \
+                mock.patch.object(routers.ReplicaRouter, "db_for_read", spy):
+            response = self.client.get('/api/notes/')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(decisions, ["default"])
+
+            self.client.patch(f'/api/notes/{note.id}/', {"title": "After"}, format="json")
+            decisions.clear()
+            response = self.client.get('/api/notes/')
+            self.assertEqual(response.json()["results"][0]["title"], "After")
+            self.assertEqual(decisions, [None])
+
+
+class BenchmarkCommandTest(NotesTestCase):
+    """
+    Tests for the benchmark management command.
+    """
+    @override_settings(ALLOWED_HOSTS=["notes.example.com"])
+    def test_writes_results_and_cleans_up(self):
+        """
+        Test that a tiny run reports every scenario and removes only its own data.
+        """
+        unrelated = jobs.enqueue("delete_file", name="audio_files/unrelated.wav")
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, "bench.json")
+            call_command(
+                "benchmark", users=1, notes=3, audio=1, iterations=2, warmup=0, output=output, stdout=StringIO()
+            )
+            with open(output) as source:
+                report = json.load(source)
+
+        self.assertEqual(set(report["results"]), set(benchmark.SCENARIOS))
+        self.assertEqual(report["results"]["list_cached"]["queries"], 0)
+        self.assertEqual(report["results"]["list"]["requests"], 2)
+        self.assertFalse(User.objects.filter(username__startswith="benchmark-").exists())
+        self.assertFalse(AudioBlob.objects.exists())
+        self.assertFalse(Tombstone.objects.exists())
+        self.assertEqual(list(Job.objects.all()), [unrelated])
+
+    def test_compare_flags_regressions(self):
+        """
+        Test that slower percentiles beyond the tolerance and extra queries are reported.
+        """
+        baseline = {"list": {"p50_ms": 10.0, "p95_ms": 20.0, "queries": 2}}
+        self.assertEqual(benchmark.compare({"list": {"p50_ms": 12.0, "p95_ms": 24.0, "queries": 2}}, baseline, 0.25), [])
+
+        regressions = benchmark.compare({"list": {"p50_ms": 15.0, "p95_ms": 20.0, "queries": 3}}, baseline, 0.25)
+        self.assertEqual(len(regressions), 2)
+        self.assertIn("p50_ms", regressions[0])
+        self.assertIn("queries 2 -> 3", regressions[1])
+
+
+@override_settings(METRICS_TOKEN="scrape-secret")
+class RequestMetricsTest(NotesTestCase):
+    """
+    Tests for the request metrics middleware, the metrics endpoint and slow-request profiling.
+    """
+    def setUp(self):
+        super().setUp()
+        for histogram in metrics.REGISTRY:
+            histogram.clear()
+        self.user = User.objects.create_user(username="measured", password="password123")
+        token = str(RefreshToken.for_user(self.user).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def scrape(self):
+        # A separate client, since the user's JWT credentials would override the header.
+        response = self.client_class().get('/api/metrics/', HTTP_AUTHORIZATION="Bearer scrape-secret")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        return response.content.decode()
+
+    def test_requests_are_recorded_per_view(self):
+        """
+        Test that duration, SQL and upload/media byte histograms are labelled by view.
+        """
+        wav = make_wav(duration_ms=500)
+        self.client.post(
+            '/api/notes/',
+            {"title": "Measured", "description": "Body",
+             "uploaded_audios": [SimpleUploadedFile("m.wav", wav, content_type="audio/wav")]},
+            format="multipart",
+        )
+        self.client.get('/api/notes/')
+
+        body = self.scrape()
+        self.assertIn('notes_request_duration_seconds_count{view="notes-list",method="GET"} 1', body)
+        self.assertIn('notes_request_duration_seconds_bucket{view="notes-list",method="POST",le="+Inf"} 1', body)
+        self.assertIn('notes_request_sql_queries_count{view="notes-list",method="POST"} 1', body)
+
+        written = [
+            line for line in body.splitlines()
+            if line.startswith('notes_request_media_written_bytes_sum{view="notes-list",method="POST"}')
+        ]
+        self.assertGreaterEqual(float(written[0].split()[-1]), len(wav))
+        self.assertEqual(metrics.SQL_QUERIES._series[("notes-list", "GET")]["sum"], 2)
+
+    def test_endpoint_requires_token(self):
+        """
+        Test that scrapes need the configured token and the endpoint is off without one.
+        """
+        client = self.client_class()
+        response = client.get('/api/metrics/', HTTP_AUTHORIZATION="Bearer wrong")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        with override_settings(METRICS_TOKEN=""):
+            response = client.get('/api/metrics/', HTTP_AUTHORIZATION="Bearer ")
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_slow_requests_are_profiled(self):
+        """
+        Test that sampled requests over the threshold leave a cProfile dump and fast ones do not.
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            with override_settings(PROFILE_SAMPLE_RATE=1.0, PROFILE_SLOW_REQUEST_MS=0, PROFILE_DIR=tmp):
+                self.client.get('/api/notes/')
+            dumps = os.listdir(tmp)
+            self.assertEqual(len(dumps), 1)
+            self.assertTrue(dumps[0].startswith("notes-list-GET-"))
+            pstats.Stats(os.path.join(tmp, dumps[0]))
+
+            with override_settings(PROFILE_SAMPLE_RATE=1.0, PROFILE_SLOW_REQUEST_MS=60_000, PROFILE_DIR=tmp):
+                self.client.get('/api/notes/')
+            self.assertEqual(len(os.listdir(tmp)), 1)
+
+
+@override_settings(AUDIO_COMPACT_SAMPLE_RATE=16000, AUDIO_COMPACT_PROCESSES=1)
+class AudioCompactionTest(NotesTestCase):
+    """
+    Tests for compacting WAV blobs to mono at a lower sample rate.
+    """
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="compactuser", password="password123")
+        self.addCleanup(compaction.shutdown_pool)
+
+    def lecture_wav(self, seconds=1, sample_rate=48000):
+        """
+        Build a stereo WAV with a 440 Hz tone in both channels and a 12 kHz tone
+        that would alias to 4 kHz if it survived resampling to 16 kHz.
+        """
+        t = np.arange(sample_rate * seconds) / sample_rate
+        mono = 0.5 * np.sin(2 * np.pi * 440 * t) + 0.3 * np.sin(2 * np.pi * 12000 * t)
+        samples = np.round(np.stack([mono, mono], axis=1) * 32767).astype("<i2")
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wav:
+            wav.setnchannels(2)
+            wav.setsampwidth(2)
+            wav.setframerate(sample_rate)
+            wav.writeframes(samples.tobytes())
+        return buffer.getvalue()
+
+    def write_temp(self, content=b""):
+        handle = tempfile.NamedTemporaryFile(suffix=".wav", delete=False)
+        with handle:
+            handle.write(content)
+        self.addCleanup(lambda: os.path.exists(handle.name) and os.remove(handle.name))
+        return handle.name
+
+    def test_downmix_and_resample(self):
+        """
+        Test that the copy is mono at the target rate, keeps the tone and filters out aliases.
+        """
+        source, dest = self.write_temp(self.lecture_wav()), self.write_temp()
+        self.assertEqual(dsp.compact_wav(source, dest, 16000), (16000, 16000))
+
+        with wave.open(dest, "rb") as wav:
+            self.assertEqual((wav.getnchannels(), wav.getsampwidth(), wav.getframerate()), (1, 2, 16000))
+            samples = np.frombuffer(wav.readframes(wav.getnframes()), dtype="<i2") / 32768
+        spectrum = np.abs(np.fft.rfft(samples)) * 2 / len(samples)
+        self.assertAlmostEqual(spectrum[440], 0.5, delta=0.01)
+        self.assertLess(spectrum[4000], 0.001)
+
+    def test_compact_files_are_skipped(self):
+        """
+        Test that mono 16-bit audio at or below the target rate and non-WAV data are not rewritten.
+        """
+        dest = self.write_temp()
+        self.assertIsNone(dsp.compact_wav(self.write_temp(make_wav(sample_rate=16000)), dest, 16000))
+        self.assertIsNone(dsp.compact_wav(self.write_temp(b"ID3" + bytes(100)), dest, 16000))
+        self.assertEqual(os.path.getsize(dest), 0)
+
+    def test_stage_replaces_shared_blob(self):
+        """
+        Test that every file on a blob moves to the compacted copy and the original is purged.
+        """
+        original = self.lecture_wav()
+        stages = ["notes.compaction.compact_blob", "notes.waveform.generate_peaks"]
+        with override_settings(AUDIO_PROCESSING_STAGES=stages):
+            for title in ("One", "Two"):
+                note = Note.objects.create(user=self.user, title=title, description="Body")
+                storage.save_audio_file(note, SimpleUploadedFile("talk.wav", original, content_type="audio/wav"))
+            old = AudioBlob.objects.get()
+            old_path = old.file.path
+            with self.assertLogs("notes.compaction", "INFO") as logs:
+                jobs.run_pending()
+
+        blob = AudioBlob.objects.get()
+        self.assertNotEqual(blob.sha256, old.sha256)
+        self.assertEqual(blob.ref_count, 2)
+        self.assertLess(blob.size, len(original) / 5)
+        self.assertIn(f"{len(original) - blob.size} saved", logs.output[0])
+        self.assertFalse(os.path.exists(old_path))
+        self.assertTrue(os.path.exists(waveform.peaks_path(blob.sha256)))
+        self.assertFalse(os.path.exists(waveform.peaks_path(old.sha256)))
+        for audio_file in AudioFile.objects.all():
+            self.assertEqual(audio_file.blob_id, blob.sha256)
+            self.assertEqual(audio_file.audio.name, blob.file.name)
+            self.assertEqual((audio_file.sample_rate, audio_file.channels, audio_file.duration_ms), (16000, 1, 1000))
+        self.assertEqual(StorageUsage.objects.get(user=self.user).audio_bytes, 2 * blob.size)
+
+    def test_compaction_invalidates_cached_notes(self):
+        """
+        Test that list and detail responses cached before compaction show the new file and size.
+        """
+        token = str(RefreshToken.for_user(self.user).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        note = Note.objects.create(user=self.user, title="Talk", description="Body")
+        with override_settings(AUDIO_PROCESSING_STAGES=["notes.compaction.compact_blob"]):
+            storage.save_audio_file(note, SimpleUploadedFile("talk.wav", self.lecture_wav(), content_type="audio/wav"))
+            detail = self.client.get(f'/api/notes/{note.id}/')
+            listed = self.client.get('/api/notes/')
+            with self.assertLogs("notes.compaction", "INFO"):
+                jobs.run_pending()
+
+        blob = AudioBlob.objects.get()
+        response = self.client.get(f'/api/notes/{note.id}/', HTTP_IF_NONE_MATCH=detail["ETag"])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["audio_bytes"], blob.size)
+        self.assertIn(blob.file.name, response.data["audio_files"][0]["audio"])
+
+        response = self.client.get('/api/notes/', HTTP_IF_NONE_MATCH=listed["ETag"])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["results"][0]["audio_bytes"], blob.size)
+
+    def test_compactaudio_command(self):
+        """
+        Test that the command compacts existing blobs and reports the total saved.
+        """
+        note = Note.objects.create(user=self.user, title="Old", description="Body")
+        with override_settings(AUDIO_PROCESSING_STAGES=[]):
+            storage.save_audio_file(note, SimpleUploadedFile("old.wav", self.lecture_wav(), content_type="audio/wav"))
+            storage.save_audio_file(note, SimpleUploadedFile("small.wav", make_wav(), content_type="audio/wav"))
+            out = StringIO()
+            call_command("compactaudio", stdout=out)
+        self.assertIn("Compacted 1 of 2 WAV blobs", out.getvalue())
+        self.assertEqual(sorted(note.audio_files.values_list("sample_rate", flat=True)), [8000, 16000])
+
+    @override_settings(AUDIO_COMPACT_PROCESSES=1, AUDIO_PROCESSING_STAGES=[])
+    def test_compactaudio_bounds_work_in_flight(self):
+        """
+        Test that the command keeps at most two blobs per process submitted at once.
+        """
+        note = Note.objects.create(user=self.user, title="Many", description="Body")
+        for seed in range(5):
+            upload = SimpleUploadedFile(f"{seed}.wav", make_wav(seed=seed), content_type="audio/wav")
+            storage.save_audio_file(note, upload)
+
+        in_flight, peak = [0], [0]
+        submit, finish = compaction.submit, compaction.finish
+
+        def counting_submit(blob):
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+            return submit(blob)
+
+        def counting_finish(*args):
+            in_flight[0] -= 1
+            return finish(*args)
+
+        out = StringIO()
+        with mock.patch.object(compaction, "submit", counting_submit):
+            with mock.patch.object(compaction, "finish", counting_finish):
+                call_command("compactaudio", stdout=out)
+        self.assertIn("of 5 WAV blobs", out.getvalue())
+        self.assertEqual(peak[0], 2)
+
+
+class NoteSparseFieldsTest(NotesTestCase):
+    """
+    Tests for `?fields=`/`?omit=` and the compact note list.
+    """
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="sparseuser", password="password123")
+        token = str(RefreshToken.for_user(self.user).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        for i in range(3):
+            note = Note.objects.create(user=self.user, title=f"Note {i}", description="Long body " * 50)
+            for j in range(i):
+                AudioFile.objects.create(
+                    note=note,
+                    audio=SimpleUploadedFile(f"audio{i}_{j}.wav", b"audio data", content_type="audio/wav"),
+                )
+        # Warm the auth cache so query counts cover the notes only.
+        self.client.get('/api/notes/', {"fields": "id"})
+
+    def test_fields_and_omit(self):
+        """
+        Test that only the selected fields are returned and dropped ones are not queried.
+        """
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/notes/', {"fields": "id,title"})
+        self.assertEqual([set(note) for note in response.data["results"]], [{"id", "title"}] * 3)
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/notes/', {"omit": "audio_files,description"})
+        self.assertEqual(set(response.data["results"][0]), {
+            "id", "title", "audio_count", "audio_bytes", "audio_duration_ms", "user", "created_at", "updated_at",
+        })
+
+        note = Note.objects.get(title="Note 2")
+        response = self.client.get(f'/api/notes/{note.id}/', {"fields": "audio_files"})
+        self.assertEqual(list(response.data), ["audio_files"])
+        self.assertEqual(len(response.data["audio_files"]), 2)
+
+    def test_unknown_field_is_rejected(self):
+        """
+        Test that asking for a field the serializer does not have is a 400.
+        """
+        response = self.client.get('/api/notes/', {"fields": "id,secret"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("secret", response.data["fields"][0])
+
+    def test_writes_ignore_fields(self):
+        """
+        Test that `?fields=` does not hide fields from an update.
+        """
+        note = Note.objects.get(title="Note 0")
+        response = self.client.patch(f'/api/notes/{note.id}/?fields=id', {"title": "Renamed"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        note.refresh_from_db()
+        self.assertEqual(note.title, "Renamed")
+
+    def test_compact_list(self):
+        """
+        Test that the compact list has audio counts, matches the full timestamps and pages by cursor.
+        """
+        full = self.client.get('/api/notes/')
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/notes/', {"compact": "1", "page_size": 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        first = response.data["results"][0]
+        self.assertEqual(list(first), ["id", "title", "created_at", "updated_at", "audio_count"])
+        self.assertEqual(first["audio_count"], 2)
+        self.assertEqual(first["created_at"], full.data["results"][0]["created_at"])
+        self.assertLess(len(response.content) * 5, len(full.content))
+
+        response = self.client.get(response.data["next"])
+        self.assertEqual([note["audio_count"] for note in response.data["results"]], [0])
+        self.assertIsNone(response.data["next"])
+
+
+class GcMediaCommandTest(NotesTestCase):
+    """
+    Tests for the orphaned media garbage collector.
+    """
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.media_root = media_root.name
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        self.user = User.objects.create_user(username="gcuser", password="password123")
+        self.note = Note.objects.create(user=self.user, title="Kept", description="Body")
+        self.audio_file = storage.save_audio_file(
+            self.note, SimpleUploadedFile("kept.wav", make_wav(), content_type="audio/wav")
+        )
+
+    def make_file(self, relative, age=7200):
+        path = os.path.join(self.media_root, relative)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as out:
+            out.write(b"orphan")
+        stamp = time.time() - age
+        os.utime(path, (stamp, stamp))
+        return path
+
+    def gc(self, *args):
+        out = StringIO()
+        call_command("gc_media", "--grace", "3600", *args, stdout=out)
+        return out.getvalue()
+
+    def test_orphans_and_dangling_rows(self):
+        """
+        Test that a dry run only reports and a real run removes orphans and dangling rows.
+        """
+        fake = "f" * 64
+        orphans = [
+            self.make_file(storage.blob_name(fake, ".wav")),
+            self.make_file(storage.sidecar_name(fake, waveform.PEAKS_SUFFIX)),
+            self.make_file(f"{storage.TEMP_DIR}/crashed.part"),
+            self.make_file(f"audio_uploads/{uuid.uuid4()}.part"),
+            self.make_file("audio_notes/legacy.wav"),
+        ]
+        dangling = AudioFile.objects.create(note=self.note, audio="audio_notes/missing.wav")
+        AudioFile.objects.filter(pk=dangling.pk).update(uploaded_at=timezone.now() - timedelta(hours=2))
+        AudioBlob.objects.filter(pk=self.audio_file.blob_id).update(
+            ref_count=3, created_at=timezone.now() - timedelta(hours=2)
+        )
+
+        output = self.gc("--dry-run")
+        self.assertIn("Would remove 5 orphaned files (30 bytes), 1 audio files", output)
+        self.assertIn("would fix 1 reference counts", output)
+        self.assertTrue(all(os.path.exists(path) for path in orphans))
+        self.assertTrue(AudioFile.objects.filter(pk=dangling.pk).exists())
+
+        output = self.gc()
+        self.assertIn("Removed 5 orphaned files", output)
+        self.assertFalse(any(os.path.exists(path) for path in orphans))
+        self.assertFalse(AudioFile.objects.filter(pk=dangling.pk).exists())
+        self.assertEqual(AudioBlob.objects.get(pk=self.audio_file.blob_id).ref_count, 1)
+        self.assertTrue(os.path.exists(self.audio_file.audio.path))
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, ".gc_media.json")))
+
+    def test_grace_period(self):
+        """
+        Test that recent files, such as uploads still in flight, are left alone.
+        """
+        recent = self.make_file(f"{storage.TEMP_DIR}/uploading.part", age=60)
+        self.assertIn("2 within the grace period", self.gc())
+        self.assertTrue(os.path.exists(recent))
+
+    def test_resumes_from_checkpoint(self):
+        """
+        Test that directories recorded in the checkpoint are skipped until a restart.
+        """
+        orphan = self.make_file(f"{storage.TEMP_DIR}/crashed.part")
+        checkpoint = os.path.join(self.media_root, "gc.json")
+        with open(checkpoint, "w") as out:
+            json.dump(
+                {"dry_run": False, "done_dirs": [storage.TEMP_DIR], "blobs_after": "", "files_after": 0,
+                 "stats": {"orphaned_files": 4}},
+                out,
+            )
+
+        output = self.gc("--checkpoint", checkpoint)
+        self.assertIn("Resuming from", output)
+        self.assertIn("Removed 4 orphaned files", output)
+        self.assertTrue(os.path.exists(orphan))
+        self.assertFalse(os.path.exists(checkpoint))
+
+        self.gc("--checkpoint", checkpoint, "--restart")
+        self.assertFalse(os.path.exists(orphan))
+
+
+class AudioUsageCountersTest(NotesTestCase):
+    """
+    Tests for the denormalised audio counters, quotas and their repair.
+    """
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="usageuser", password="password123")
+        token = str(RefreshToken.for_user(self.user).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def create_note(self, *wavs):
+        data = {
+            "title": "Counted",
+            "description": "Body",
+            "uploaded_audios": [
+                SimpleUploadedFile(f"a{i}.wav", wav, content_type="audio/wav") for i, wav in enumerate(wavs)
+            ],
+        }
+        response = self.client.post('/api/notes/', data, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        return Note.objects.get(pk=response.data["id"])
+
+    def counters(self, obj):
+        obj.refresh_from_db()
+        return obj.audio_count, obj.audio_bytes, obj.audio_duration_ms
+
+    def test_counters_follow_audio_changes(self):
+        """
+        Test that adding, removing and cascading deletes keep note and user totals in step.
+        """
+        short, long = make_wav(duration_ms=100), make_wav(duration_ms=300, seed=1)
+        note = self.create_note(short, long)
+        other = self.create_note(short)
+        usage = StorageUsage.objects.get(user=self.user)
+        self.assertEqual(self.counters(note), (2, len(short) + len(long), 400))
+        self.assertEqual(self.counters(usage), (3, 2 * len(short) + len(long), 500))
+
+        removed = note.audio_files.get(duration_ms=100).id
+        response = self.client.patch(f'/api/notes/{note.id}/', {"removed_audio_ids": [removed]}, format="json")
+        self.assertEqual(response.data["audio_count"], 1)
+        self.assertEqual(response.data["audio_bytes"], len(long))
+        self.assertEqual(self.counters(usage), (2, len(short) + len(long), 400))
+
+        self.client.delete(f'/api/notes/{other.id}/')
+        self.assertEqual(self.counters(usage), (1, len(long), 300))
+
+        response = self.client.get('/api/notes/', {"compact": "1"})
+        self.assertEqual(response.data["results"][0]["audio_count"], 1)
+
+    @override_settings(AUDIO_QUOTA_BYTES=1000)
+    def test_quota(self):
+        """
+        Test that uploads past the quota are rejected with a single usage lookup.
+        """
+        wav = make_wav(duration_ms=50)
+        self.create_note(wav)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                '/api/notes/',
+                {"title": "Big", "description": "Body",
+                 "uploaded_audios": [SimpleUploadedFile("big.wav", make_wav(duration_ms=100), content_type="audio/wav")]},
+                format='multipart',
+            )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("quota", str(response.data["uploaded_audios"]))
+        self.assertEqual(len(queries), 1)
+
+        note = Note.objects.get()
+        response = self.client.post(
+            '/api/uploads/',
+            {"note": note.id, "filename": "big.wav", "content_type": "audio/wav", "size": 1000},
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("quota", str(response.data["size"]))
+
+    @override_settings(AUDIO_QUOTA_BYTES=1000)
+    def test_quota_counts_removed_audio(self):
+        """
+        Test that replacing a recording is checked against the quota net of the removed file.
+        """
+        note = self.create_note(make_wav(duration_ms=50))
+        removed = note.audio_files.get().id
+        replacement = make_wav(duration_ms=50, seed=1)
+        response = self.client.patch(
+            f'/api/notes/{note.id}/',
+            {"removed_audio_ids": [removed],
+             "uploaded_audios": [SimpleUploadedFile("new.wav", replacement, content_type="audio/wav")]},
+            format='multipart',
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertEqual(response.data["audio_bytes"], len(replacement))
+
+    def test_repair_usage(self):
+        """
+        Test that the repair command recomputes drifted counters.
+        """
+        wav = make_wav()
+        note = self.create_note(wav)
+        Note.objects.filter(pk=note.pk).update(audio_count=5, audio_bytes=1)
+        StorageUsage.objects.filter(user=self.user).delete()
+
+        out = StringIO()
+        call_command("repair_usage", "--dry-run", stdout=out)
+        self.assertIn("Found 1 notes and 1 users", out.getvalue())
+        self.assertEqual(self.counters(note)[0], 5)
+
+        call_command("repair_usage", stdout=out)
+        self.assertEqual(self.counters(note), (1, len(wav), 100))
+        self.assertEqual(self.counters(StorageUsage.objects.get(user=self.user)), (1, len(wav), 100))
+        out = StringIO()
+        call_command("repair_usage", stdout=out)
+        self.assertIn("Fixed 0 notes and 0 users", out.getvalue())
+
+
+class NoteChangesFeedTest(NotesTestCase):
+    """
+    Tests for the delta sync changes feed.
+    """
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="syncuser", password="password123")
+        token = str(RefreshToken.for_user(self.user).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def changes(self, since=None, **params):
+        if since:
+            params["since"] = since
+        response = self.client.get('/api/notes/changes/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        return response.data
+
+    @override_settings(SYNC_COMMIT_LAG_SECONDS=0)
+    def test_changes_since_cursor(self):
+        """
+        Test that each sync returns only what changed since the previous one, deletions included.
+        """
+        kept = Note.objects.create(user=self.user, title="Kept", description="Body")
+        doomed = Note.objects.create(user=self.user, title="Doomed", description="Body")
+        first = self.changes()
+        self.assertEqual([note["title"] for note in first["notes"]], ["Kept", "Doomed"])
+
+        with self.assertNumQueries(1):
+            empty = self.changes(first["cursor"])
+        self.assertEqual((empty["notes"], empty["deleted"]), ([], {"notes": [], "audio_files": []}))
+
+        self.client.patch(f'/api/notes/{kept.id}/', {"title": "Edited"}, format="json")
+        self.client.delete(f'/api/notes/{doomed.id}/')
+        response = self.client.post(
+            '/api/notes/',
+            {"title": "Recorded", "description": "Body",
+             "uploaded_audios": [SimpleUploadedFile("a.wav", make_wav(), content_type="audio/wav")]},
+            format='multipart',
+        )
+        audio_id = response.data["audio_files"][0]["id"]
+        data = self.changes(empty["cursor"])
+        self.assertEqual([note["title"] for note in data["notes"]], ["Edited", "Recorded"])
+        self.assertEqual(data["deleted"], {"notes": [doomed.id], "audio_files": []})
+
+        recorded = Note.objects.get(title="Recorded")
+        self.client.patch(f'/api/notes/{recorded.id}/', {"removed_audio_ids": [audio_id]}, format="json")
+        data = self.changes(data["cursor"])
+        self.assertEqual([note["audio_files"] for note in data["notes"]], [[]])
+        self.assertEqual(data["deleted"], {"notes": [], "audio_files": [audio_id]})
+
+    @override_settings(SYNC_COMMIT_LAG_SECONDS=0)
+    def test_pages_through_ties(self):
+        """
+        Test that notes sharing one timestamp are paged through without loss or repeats.
+        """
+        Note.objects.bulk_create([Note(user=self.user, title=f"Note {i}", description="Body") for i in range(5)])
+        Note.objects.filter(user=self.user).update(updated_at=timezone.now() - timedelta(minutes=1))
+        seen, cursor = [], None
+        for _ in range(3):
+            data = self.changes(cursor, limit=2)
+            seen += [note["id"] for note in data["notes"]]
+            cursor = data["cursor"]
+        self.assertFalse(data["has_more"])
+        self.assertEqual(sorted(seen), sorted(Note.objects.values_list("id", flat=True)))
+
+    def test_recent_changes_are_repeated_within_commit_lag(self):
+        """
+        Test that the cursor stays behind the commit lag so late commits are not skipped.
+        """
+        Note.objects.create(user=self.user, title="Fresh", description="Body")
+        first = self.changes()
+        again = self.changes(first["cursor"])
+        self.assertEqual([note["title"] for note in again["notes"]], ["Fresh"])
+
+    def test_invalid_and_expired_cursors(self):
+        """
+        Test that garbage cursors are rejected and ones past the tombstone retention are gone.
+        """
+        self.assertEqual(self.client.get('/api/notes/changes/', {"since": "nonsense"}).status_code, 400)
+        old = sync.encode_cursor((timezone.now() - timedelta(days=365), 0, 0))
+        self.assertEqual(self.client.get('/api/notes/changes/', {"since": old}).status_code, 410)
+
+
+class NoteArchiveTest(NotesTestCase):
+    """
+    Tests for the streaming ZIP export and the batched import.
+    """
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="archiveuser", password="password123")
+        self.other = User.objects.create_user(username="importuser", password="password123")
+        self.login(self.user)
+
+    def login(self, user):
+        token = str(RefreshToken.for_user(user).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def create_note(self, title, *wavs):
+        data = {
+            "title": title,
+            "description": f"About {title}",
+            "uploaded_audios": [
+                SimpleUploadedFile(f"a{i}.wav", wav, content_type="audio/wav") for i, wav in enumerate(wavs)
+            ],
+        }
+        response = self.client.post('/api/notes/', data, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+
+    def export(self):
+        response = self.client.get('/api/notes/export/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "application/zip")
+        return list(response.streaming_content)
+
+    def import_archive(self, content):
+        upload = SimpleUploadedFile("export.zip", content, content_type="application/zip")
+        return self.client.post('/api/notes/import/', {"archive": upload}, format='multipart')
+
+    def test_round_trip(self):
+        """
+        Test that an export imports into another account with its audio shared and counted.
+        """
+        wav, other_wav = make_wav(duration_ms=200), make_wav(seed=1)
+        self.create_note("Lecture", wav, other_wav)
+        self.create_note("Empty")
+        content = b"".join(self.export())
+
+        with zipfile.ZipFile(io.BytesIO(content)) as archive:
+            self.assertIsNone(archive.testzip())
+            names = archive.namelist()
+            lecture = Note.objects.get(title="Lecture")
+            self.assertIn(f"notes/{lecture.id}/note.json", names)
+            self.assertEqual(len([name for name in names if name.endswith(".wav")]), 2)
+
+        self.login(self.other)
+        response = self.import_archive(content)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        self.assertEqual(response.data, {"notes": 2, "audio_files": 2})
+
+        imported = Note.objects.get(user=self.other, title="Lecture")
+        self.assertEqual(imported.description, "About Lecture")
+        self.assertEqual((imported.audio_count, imported.audio_bytes), (2, len(wav) + len(other_wav)))
+        self.assertEqual(sorted(imported.audio_files.values_list("duration_ms", flat=True)), [100, 200])
+        self.assertEqual(StorageUsage.objects.get(user=self.other).audio_bytes, len(wav) + len(other_wav))
+        self.assertEqual(AudioBlob.objects.get(pk=imported.audio_files.first().blob_id).ref_count, 2)
+        self.assertEqual(AudioBlob.objects.count(), 2)
+
+        response = self.client.get('/api/notes/')
+        self.assertEqual(len(response.data["results"]), 2)
+
+    def test_export_streams_in_small_chunks(self):
+        """
+        Test that the archive is sent as it is built rather than assembled in memory.
+        """
+        self.create_note("Long", make_wav(duration_ms=2000))
+        with mock.patch.object(storage, "CHUNK_SIZE", 1024):
+            chunks = self.export()
+        self.assertGreater(len(chunks), 20)
+        self.assertLess(max(len(chunk) for chunk in chunks), 4096)
+
+    def test_import_is_not_bound_by_note_upload_limits(self):
+        """
+        Test that an archive over the note upload limit is still imported.
+        """
+        self.create_note("Long", make_wav(duration_ms=500))
+        content = b"".join(self.export())
+        self.login(self.other)
+        with override_settings(NOTE_AUDIO_MAX_FILES=1, NOTE_AUDIO_MAX_SIZE=1000, DATA_UPLOAD_MAX_MEMORY_SIZE=1000):
+            self.assertGreater(len(content), 2000)
+            response = self.import_archive(content)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        self.assertEqual(response.data, {"notes": 1, "audio_files": 1})
+
+    @override_settings(AUDIO_QUOTA_BYTES=5000)
+    def test_import_rejects_bad_archives(self):
+        """
+        Test that invalid archives, missing audio and quota overruns import nothing.
+        """
+        self.create_note("Big", make_wav(duration_ms=200))
+        content = b"".join(self.export())
+        self.login(self.other)
+
+        self.assertEqual(self.import_archive(b"not a zip").status_code, status.HTTP_400_BAD_REQUEST)
+
+        broken = io.BytesIO()
+        with zipfile.ZipFile(io.BytesIO(content)) as source, zipfile.ZipFile(broken, "w") as target:
+            for info in source.infolist():
+                if not info.filename.endswith(".wav"):
+                    target.writestr(info, source.read(info))
+        response = self.import_archive(broken.getvalue())
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("not in the archive", response.data["archive"][0])
+
+        StorageUsage.objects.create(user=self.other, audio_bytes=4000)
+        response = self.import_archive(content)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("quota", response.data["archive"][0])
+        self.assertFalse(Note.objects.filter(user=self.other).exists())
+
+    def test_import_rejects_damaged_audio_before_writing(self):
+        """
+        Test that audio failing its CRC is caught by the check, before any note is written.
+        """
+        wav = make_wav(duration_ms=200)
+        self.create_note("First")
+        self.create_note("Second", wav)
+        content = bytearray(b"".join(self.export()))
+        content[content.find(wav) + len(wav) - 1] ^= 0xFF
+        self.login(self.other)
+
+        response = self.import_archive(bytes(content))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("Damaged archive", response.data["archive"][0])
+        self.assertFalse(Note.objects.filter(user=self.other).exists())
+
+    def test_import_failing_in_a_later_batch_keeps_earlier_batches_visible(self):
+        """
+        Test that a read error after a batch committed is a 400 and the committed notes are not served stale.
+        """
+        self.create_note("First", make_wav(seed=0))
+        self.create_note("Second", make_wav(seed=1))
+        content = b"".join(self.export())
+        self.login(self.other)
+        self.assertEqual(self.client.get('/api/notes/').data["results"], [])
+
+        member_chunks = archive._member_chunks
+        calls = []
+
+        def failing_member_chunks(zip_file, name):
+            calls.append(name)
+            if len(calls) > 1:
+                raise zipfile.BadZipFile(f"Bad CRC-32 for file {name!r}")
+            return member_chunks(zip_file, name)
+
+        with mock.patch.object(archive, "BATCH_SIZE", 1):
+            with mock.patch.object(archive, "_member_chunks", failing_member_chunks):
+                response = self.import_archive(content)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("Damaged archive", response.data["archive"][0])
+        self.assertEqual(Note.objects.filter(user=self.other).count(), 1)
+        self.assertEqual(len(self.client.get('/api/notes/').data["results"]), 1)
+
+
+class AudioUploadHandlerTest(NotesTestCase):
+    """
+    Tests for the upload handler that checks note audio while it is received.
+    """
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.temp_dir = os.path.join(media_root.name, storage.TEMP_DIR)
+        media = override_settings(MEDIA_ROOT=media_root.name)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        self.user = User.objects.create_user(username="handleruser", password="password123")
+        token = str(RefreshToken.for_user(self.user).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def post(self, *files):
+        data = {
+            "title": "Uploaded",
+            "description": "Body",
+            "uploaded_audios": [
+                SimpleUploadedFile(f"a{i}.wav", content, content_type="audio/wav") for i, content in enumerate(files)
+            ],
+        }
+        return self.client.post('/api/notes/', data, format='multipart')
+
+    def assertNoTempFiles(self):
+        self.assertEqual(os.listdir(self.temp_dir) if os.path.isdir(self.temp_dir) else [], [])
+
+    def test_upload_is_hashed_and_renamed_into_place(self):
+        """
+        Test that an accepted upload is stored without being copied or hashed again.
+        """
+        wav = make_wav()
+        with mock.patch.object(storage, "_write_temp", wraps=storage._write_temp) as write_temp:
+            response = self.post(wav)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        write_temp.assert_not_called()
+
+        audio_file = AudioFile.objects.get()
+        self.assertEqual(audio_file.blob_id, hashlib.sha256(wav).hexdigest())
+        self.assertEqual(audio_file.audio.read(), wav)
+        self.assertNoTempFiles()
+
+    def test_wrong_format_stops_after_first_chunk(self):
+        """
+        Test that junk is refused from its first bytes without receiving the rest.
+        """
+        original = uploads.AudioUploadHandler.receive_data_chunk
+        with mock.patch.object(
+            uploads.AudioUploadHandler, "receive_data_chunk", autospec=True, side_effect=original
+        ) as receive:
+            response = self.post(b"\0" * (1024 * 1024))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("unsupported format", response.data["uploaded_audios"][0])
+        self.assertEqual(receive.call_count, 1)
+        self.assertFalse(Note.objects.exists())
+        self.assertNoTempFiles()
+
+    @override_settings(NOTE_AUDIO_MAX_SIZE=2000, NOTE_AUDIO_MAX_FILES=2)
+    def test_size_and_count_limits(self):
+        """
+        Test that oversized files, too many files and oversized bodies are refused.
+        """
+        response = self.post(make_wav(duration_ms=200))
+        self.assertIn("exceeds the size limit", response.data["uploaded_audios"][0])
+
+        small = make_wav(duration_ms=10)
+        response = self.post(small, small, small)
+        self.assertIn("At most 2", response.data["uploaded_audios"][0])
+
+        with override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=100):
+            response = self.post(make_wav(duration_ms=300))
+        self.assertIn("Request body exceeds", response.data["uploaded_audios"][0])
+        self.assertFalse(Note.objects.exists())
+        self.assertNoTempFiles()
+
+
+class VoiceActivityTest(NotesTestCase):
+    """
+    Tests for voice activity detection and silence trimming.
+    """
+    RATE = 16000
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media = override_settings(MEDIA_ROOT=media_root.name)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        self.user = User.objects.create_user(username="vaduser", password="password123")
+        token = str(RefreshToken.for_user(self.user).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def recording(self, *parts):
+        """
+        Build a 16-bit WAV from `(milliseconds, level_db)` parts of 440 Hz tone; None is silence.
+        """
+        chunks = []
+        for duration_ms, level_db in parts:
+            t = np.arange(self.RATE * duration_ms // 1000) / self.RATE
+            amplitude = 0 if level_db is None else 10 ** (level_db / 20) * np.sqrt(2)
+            chunks.append(amplitude * np.sin(2 * np.pi * 440 * t))
+        samples = np.round(np.concatenate(chunks) * 32767).astype("<i2")
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(self.RATE)
+            wav.writeframes(samples.tobytes())
+        return buffer.getvalue()
+
+    def speech_ms(self, content, threshold_db=-45, min_silence_ms=1000):
+        with tempfile.NamedTemporaryFile(suffix=".wav") as temp:
+            temp.write(content)
+            temp.flush()
+            rate, _, segments = dsp.speech_segments(temp.name, threshold_db, min_silence_ms)
+        return [[start * 1000 // rate, end * 1000 // rate] for start, end in segments]
+
+    def test_segments(self):
+        """
+        Test that speech is found with padding, short pauses are bridged and quiet noise ignored.
+        """
+        content = self.recording(
+            (1000, None), (1000, -20), (500, None), (500, -20), (2000, -70), (500, -30), (500, None)
+        )
+        self.assertEqual(self.speech_ms(content), [[800, 3200], [4800, 5700]])
+        self.assertEqual(self.speech_ms(content, min_silence_ms=400), [[800, 2200], [2300, 3200], [4800, 5700]])
+        self.assertEqual(self.speech_ms(self.recording((1000, None))), [])
+
+        noise = np.random.default_rng(0).normal(0, 10 ** (-48 / 20), self.RATE)
+        with tempfile.NamedTemporaryFile(suffix=".wav") as temp:
+            with wave.open(temp.name, "wb") as wav:
+                wav.setnchannels(1)
+                wav.setsampwidth(2)
+                wav.setframerate(self.RATE)
+                wav.writeframes(np.round(noise * 32767).astype("<i2").tobytes())
+            _, _, segments = dsp.speech_segments(temp.name, -45, 1000)
+        # Hiss just under the threshold crosses zero often enough to count as a fricative.
+        self.assertEqual(segments, [(0, self.RATE)])
+
+    def test_segments_endpoint(self):
+        """
+        Test that the stage stores segments that the endpoint serves for every file on the blob.
+        """
+        note = Note.objects.create(user=self.user, title="Lecture", description="Body")
+        audio_file = storage.save_audio_file(
+            note, SimpleUploadedFile("a.wav", self.recording((1000, None), (1000, -20), (1000, None)))
+        )
+        response = self.client.get(f'/api/audio/{audio_file.id}/segments/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        vad.detect_speech(audio_file.blob)
+        response = self.client.get(f'/api/audio/{audio_file.id}/segments/')
+        self.assertEqual(response.data, {"duration_ms": 3000, "speech_ms": 1400, "segments": [[800, 2200]]})
+
+    @override_settings(AUDIO_VAD_TRIM=True, AUDIO_PROCESSING_STAGES=["notes.vad.detect_speech"])
+    def test_trim(self):
+        """
+        Test that trimming replaces the audio once and the trimmed copy gets its own segments.
+        """
+        note = Note.objects.create(user=self.user, title="Lecture", description="Body")
+        content = self.recording((1000, None), (1000, -20), (2000, None), (500, -20), (1000, None))
+        audio_file = storage.save_audio_file(note, SimpleUploadedFile("a.wav", content))
+        original = audio_file.blob_id
+        jobs.run_pending()
+
+        audio_file.refresh_from_db()
+        self.assertNotEqual(audio_file.blob_id, original)
+        self.assertEqual(audio_file.duration_ms, 1400 + 900)
+        self.assertEqual(AudioBlob.objects.filter(pk=original).count(), 0)
+        note.refresh_from_db()
+        self.assertEqual(note.audio_duration_ms, 2300)
+
+        response = self.client.get(f'/api/audio/{audio_file.id}/segments/')
+        self.assertEqual(response.data["segments"], [[0, 2300]])
+        self.assertEqual(response.data["speech_ms"], 2300)
+
+    @override_settings(AUDIO_VAD_TRIM=True, AUDIO_PROCESSING_STAGES=["notes.vad.detect_speech"])
+    def test_trim_invalidates_cached_notes(self):
+        """
+        Test that note responses cached before trimming show the trimmed file, size and duration.
+        """
+        note = Note.objects.create(user=self.user, title="Lecture", description="Body")
+        content = self.recording((1000, None), (1000, -20), (2000, None), (500, -20), (1000, None))
+        storage.save_audio_file(note, SimpleUploadedFile("a.wav", content))
+        detail = self.client.get(f'/api/notes/{note.id}/')
+        self.assertEqual(detail.data["audio_bytes"], len(content))
+        jobs.run_pending()
+
+        blob = AudioBlob.objects.get()
+        response = self.client.get(f'/api/notes/{note.id}/', HTTP_IF_NONE_MATCH=detail["ETag"])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["audio_bytes"], blob.size)
+        self.assertEqual(response.data["audio_duration_ms"], 2300)
+        self.assertIn(blob.file.name, response.data["audio_files"][0]["audio"])
@@ -0,0 +1,201 @@
+"""
+Helpers for the resumable chunked audio upload protocol, and the upload
+handler that checks multipart note uploads while they arrive.
+
+A client creates an `AudioUpload` session, PUTs byte ranges in any order with a
+`Content-Range: bytes <start>-<end>/<size>` header, polls the session for its
+current offset and finally asks for it to be turned into an `AudioFile`.
+"""
+import hashlib
+import os
+import re
+import tempfile
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers, StopUpload
+from django.http import QueryDict
+from django.utils.datastructures import MultiValueDict
+
+from . import audio_meta, metrics, storage
+
+CHUNK_SIZE = 64 * 1024
+
+CONTENT_RANGE_RE = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+
+
+def parse_content_range(header, size):
+    """
+    Parse a Content-Range header into a half-open `(start, end)` byte range.
+
+    Raises ValueError if the header is malformed or does not fit the upload.
+    """
+    match = CONTENT_RANGE_RE.match((header or "").strip())
+    if not match:
+        raise ValueError("Content-Range must look like 'bytes <start>-<end>/<size>'.")
+
+    start, last, total = (int(group) for group in match.groups())
+    if total != size:
+        raise ValueError(f"Content-Range total {total} does not match upload size {size}.")
+    if start > last or last >= size:
+        raise ValueError("Content-Range is outside the upload.")
+    return start, last + 1
+
+
+def merge_range(ranges, start, end):
+    """
+    Return `ranges` with `[start, end)` added, merging overlapping or adjacent ranges.
+    """
+    merged = []
+    for range_start, range_end in sorted([*ranges, [start, end]]):
+        if merged and range_start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], range_end)
+        else:
+            merged.append([range_start, range_end])
+    return merged
+
+
+def allocate(upload):
+    """
+    Create the temporary file backing an upload session, sized to the full upload.
+    """
+    os.makedirs(os.path.dirname(upload.temp_path), exist_ok=True)
+    with open(upload.temp_path, "wb") as part:
+        part.truncate(upload.size)
+
+
+def write_chunk(upload, start, end, stream):
+    """
+    Copy up to `end - start` bytes from `stream` into the upload at `start`.
+
+    The body is copied in CHUNK_SIZE pieces so memory use does not depend on the
+    chunk size the client picked. Returns the number of bytes written, which can
+    be short if the client disconnected.
+    """
+    remaining = end - start
+    written = 0
+    with open(upload.temp_path, "r+b") as part:
+        part.seek(start)
+        while remaining > 0:
+            data = stream.read(min(CHUNK_SIZE, remaining)) if stream else b""
+            if not data:
+                break
+            part.write(data)
+            written += len(data)
+            remaining -= len(data)
+    metrics.record_media_write(written)
+    return written
+
+
+class HashedUploadedFile(UploadedFile):
+    """
+    An uploaded file that `AudioUploadHandler` wrote under MEDIA_ROOT and hashed.
+
+    `storage.save_audio_file` renames it into blob storage; if it is never
+    saved, it is removed when the request closes its files.
+    """
+    def __init__(self, path, name, content_type, size, charset, sha256, content_type_extra=None):
+        super().__init__(open(path, "rb"), name, content_type, size, charset, content_type_extra)
+        self.path = path
+        self.sha256 = sha256
+
+    def temporary_file_path(self):
+        return self.path
+
+    def close(self):
+        try:
+            return self.file.close()
+        finally:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+class AudioUploadHandler(FileUploadHandler):
+    """
+    Receive the `uploaded_audios` files of a note request straight into media storage.
+
+    Each file is written to a temporary file in the media directory and hashed
+    as it arrives, so saving it is a rename. The upload stops without reading
+    the rest of the body as soon as a file does not start like WAV, MP3,
+    ADTS AAC, WebM or Ogg, grows past NOTE_AUDIO_MAX_SIZE or is one more than
+    NOTE_AUDIO_MAX_FILES, or the body is larger than those limits allow. The
+    reason is left in `request.audio_upload_error` for the serializer to
+    report. Other file fields go to the default handlers.
+    """
+    FIELD_NAME = "uploaded_audios"
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.files = 0
+        self.out = None
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        if settings.DATA_UPLOAD_MAX_MEMORY_SIZE is None:
+            return None
+        # Non-file fields are bounded by DATA_UPLOAD_MAX_MEMORY_SIZE.
+        limit = settings.NOTE_AUDIO_MAX_FILES * settings.NOTE_AUDIO_MAX_SIZE + settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+        if content_length > limit:
+            self.request.audio_upload_error = f"Request body exceeds the limit of {limit} bytes."
+            return QueryDict(encoding=encoding), MultiValueDict()
+        return None
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        if field_name != self.FIELD_NAME:
+            return
+        self.files += 1
+        if self.files > settings.NOTE_AUDIO_MAX_FILES:
+            self.reject(f"At most {settings.NOTE_AUDIO_MAX_FILES} audio files may be uploaded at once.")
+
+        temp_dir = os.path.join(settings.MEDIA_ROOT, storage.TEMP_DIR)
+        os.makedirs(temp_dir, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=temp_dir, suffix=".part")
+        self.out = os.fdopen(fd, "wb")
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.head = b""
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.out is None:
+            return raw_data
+        self.size += len(raw_data)
+        if self.size > settings.NOTE_AUDIO_MAX_SIZE:
+            self.reject(f"File {self.file_name} exceeds the size limit of {settings.NOTE_AUDIO_MAX_SIZE} bytes.")
+        if len(self.head) < audio_meta.SNIFF_SIZE:
+            self.head += raw_data[:audio_meta.SNIFF_SIZE - len(self.head)]
+            if len(self.head) == audio_meta.SNIFF_SIZE:
+                self.check_format()
+        self.digest.update(raw_data)
+        self.out.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if self.out is None:
+            return None
+        self.check_format()
+        self.out.close()
+        self.out = None
+        metrics.record_media_write(self.size)
+        return HashedUploadedFile(
+            self.path, self.file_name, self.content_type, self.size, self.charset,
+            self.digest.hexdigest(), self.content_type_extra,
+        )
+
+    def upload_interrupted(self):
+        self.discard()
+
+    def check_format(self):
+        if not audio_meta.sniff(self.head):
+            self.reject(f"File {self.file_name} has an unsupported format.")
+
+    def reject(self, message):
+        self.request.audio_upload_error = message
+        self.discard()
+        raise StopUpload(connection_reset=True)
+
+    def discard(self):
+        if self.out is not None:
+            self.out.close()
+            self.out = None
+            os.remove(self.path)
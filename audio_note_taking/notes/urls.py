@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import NoteViewSet, UserViewSet
+from .views import NoteViewSet, UserViewSet, AudioUploadViewSet, AudioFileViewSet, metrics_view
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
     TokenRefreshView,
@@ -9,9 +9,12 @@ from rest_framework_simplejwt.views import (
 router = DefaultRouter()
 router.register(r'users', UserViewSet, basename='users')
 router.register(r'notes', NoteViewSet, basename='notes')
+router.register(r'uploads', AudioUploadViewSet, basename='uploads')
+router.register(r'audio', AudioFileViewSet, basename='audio')
 
 urlpatterns = [
     path('', include(router.urls)),
     path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('metrics/', metrics_view, name='metrics'),
 ]
@@ -0,0 +1,137 @@
+"""
+Denormalised audio counters for notes and users.
+
+Every AudioFile adds its size and duration to its note and to the owner's
+StorageUsage row. The counters are changed with F() expressions from the
+AudioFile save and delete signals, so they are updated in the same
+transaction as the row, without reading them first. Quota checks and list
+badges then read one row instead of aggregating over audio files.
+`manage.py repair_usage` recomputes counters that have drifted.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import AudioFile, Note, StorageUsage
+
+COUNTERS = ("audio_count", "audio_bytes", "audio_duration_ms")
+
+
+def _increments(count, size, duration_ms):
+    return {
+        "audio_count": F("audio_count") + count,
+        "audio_bytes": F("audio_bytes") + size,
+        "audio_duration_ms": F("audio_duration_ms") + duration_ms,
+    }
+
+
+def adjust(note_id, user_id, count=0, size=0, duration_ms=0):
+    """
+    Add the given deltas to a note's counters and to its owner's usage.
+
+    The note's `updated_at` moves too, since its audio has changed.
+    """
+    Note.objects.filter(pk=note_id).update(updated_at=timezone.now(), **_increments(count, size, duration_ms))
+    updated = StorageUsage.objects.filter(user_id=user_id).update(**_increments(count, size, duration_ms))
+    if not updated and count > 0:
+        # The row is created with the first audio file of a user. A missing
+        # row on removal means the user is being deleted along with it.
+        StorageUsage.objects.get_or_create(user_id=user_id)
+        StorageUsage.objects.filter(user_id=user_id).update(**_increments(count, size, duration_ms))
+
+
+def adjust_user(user_id, count=0, size=0, duration_ms=0):
+    """
+    Add the given deltas to a user's usage only.
+
+    For audio removed together with its notes, whose own counters go with them.
+    """
+    StorageUsage.objects.filter(user_id=user_id).update(**_increments(count, size, duration_ms))
+
+
+def record_audio(audio_file, user_id, sign):
+    """
+    Count an AudioFile in (`sign=1`) or out (`sign=-1`) of the totals.
+    """
+    adjust(
+        audio_file.note_id,
+        user_id,
+        count=sign,
+        size=sign * (audio_file.size or 0),
+        duration_ms=sign * (audio_file.duration_ms or 0),
+    )
+
+
+def bytes_used(user_id):
+    """
+    Return the audio bytes stored by a user with a single primary key lookup.
+    """
+    return StorageUsage.objects.filter(user_id=user_id).values_list("audio_bytes", flat=True).first() or 0
+
+
+def check_quota(user_id, incoming):
+    """
+    Return an error message if `incoming` more bytes would exceed AUDIO_QUOTA_BYTES, else None.
+    """
+    quota = settings.AUDIO_QUOTA_BYTES
+    if not quota:
+        return None
+    used = bytes_used(user_id)
+    if used + incoming > quota:
+        return f"Storage quota exceeded: {used} of {quota} bytes used, {incoming} more requested."
+    return None
+
+
+def _totals(queryset, key):
+    return {
+        row[key]: (row["count"], row["size"], row["duration"])
+        for row in queryset.values(key).annotate(
+            count=Count("id"),
+            size=Coalesce(Sum("size"), 0),
+            duration=Coalesce(Sum("duration_ms"), 0),
+        )
+    }
+
+
+def repair_notes(note_ids, dry_run=False):
+    """
+    Recompute the counters of the given notes; returns the ids that had drifted.
+
+    The note rows are locked first, so an audio file committed meanwhile is
+    either counted here or increments the repaired value afterwards.
+    """
+    drifted = []
+    with transaction.atomic():
+        notes = list(Note.objects.select_for_update().filter(pk__in=note_ids).values("pk", *COUNTERS))
+        totals = _totals(AudioFile.objects.filter(note_id__in=note_ids), "note_id")
+        for note in notes:
+            actual = totals.get(note["pk"], (0, 0, 0))
+            if actual != tuple(note[name] for name in COUNTERS):
+                drifted.append(note["pk"])
+                if not dry_run:
+                    Note.objects.filter(pk=note["pk"]).update(**dict(zip(COUNTERS, actual)))
+    return drifted
+
+
+def repair_users(user_ids, dry_run=False):
+    """
+    Recompute the usage of the given users; returns the ids that had drifted.
+    """
+    drifted = []
+    with transaction.atomic():
+        if not dry_run:
+            StorageUsage.objects.bulk_create(
+                [StorageUsage(user_id=user_id) for user_id in user_ids], ignore_conflicts=True
+            )
+        rows = StorageUsage.objects.select_for_update().filter(user_id__in=user_ids).values("user_id", *COUNTERS)
+        stored = {row["user_id"]: tuple(row[name] for name in COUNTERS) for row in rows}
+        totals = _totals(AudioFile.objects.filter(note__user_id__in=user_ids), "note__user_id")
+        for user_id in user_ids:
+            actual = totals.get(user_id, (0, 0, 0))
+            if actual != stored.get(user_id, (0, 0, 0)):
+                drifted.append(user_id)
+                if not dry_run:
+                    StorageUsage.objects.filter(user_id=user_id).update(**dict(zip(COUNTERS, actual)))
+    return drifted
@@ -0,0 +1,91 @@
+"""
+Voice activity detection for recordings.
+
+The `detect_speech` processing stage finds the stretches of speech in a PCM
+WAV blob with `dsp.speech_segments` and writes them, in milliseconds, to a
+JSON sidecar next to the waveform peaks. Every AudioFile on the blob shares
+them, and `read_segments` serves them without touching the audio. With
+AUDIO_VAD_TRIM the blob is instead replaced by a copy with the long silences
+cut out, which is processed again as a new blob and gets its own segments.
+"""
+import json
+import logging
+import os
+import tempfile
+
+from django.conf import settings
+
+from . import dsp, storage
+from .models import AudioBlob
+
+logger = logging.getLogger(__name__)
+
+SEGMENTS_SUFFIX = ".segments.json"
+
+
+def segments_path(sha256):
+    file_storage = AudioBlob._meta.get_field("file").storage
+    return file_storage.path(storage.sidecar_name(sha256, SEGMENTS_SUFFIX))
+
+
+def write_segments(path, data):
+    """
+    Atomically write a segments sidecar to `path`.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "w") as out:
+        json.dump(data, out)
+    os.replace(temp_path, path)
+
+
+def trim_blob(blob, segments):
+    """
+    Replace `blob` with a copy holding only `segments`; returns whether it was replaced.
+    """
+    temp_dir = os.path.join(settings.MEDIA_ROOT, storage.TEMP_DIR)
+    os.makedirs(temp_dir, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=temp_dir, suffix=".part")
+    os.close(fd)
+    try:
+        if dsp.trim_wav(blob.file.path, temp_path, segments) is None:
+            return False
+        return storage.replace_blob(blob.sha256, temp_path, ".wav") is not None
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def detect_speech(blob):
+    """
+    Processing stage: store the speech segments of a new blob, trimming silence first if enabled.
+    """
+    result = dsp.speech_segments(blob.file.path, settings.AUDIO_VAD_THRESHOLD_DB, settings.AUDIO_VAD_MIN_SILENCE_MS)
+    if result is None:
+        return
+    sample_rate, frames, segments = result
+
+    speech_frames = sum(end - start for start, end in segments)
+    if settings.AUDIO_VAD_TRIM and segments and speech_frames < frames and trim_blob(blob, segments):
+        logger.info(
+            "Trimmed %d ms of silence from blob %s",
+            (frames - speech_frames) * 1000 // sample_rate, blob.sha256,
+        )
+        return
+
+    write_segments(segments_path(blob.sha256), {
+        "duration_ms": frames * 1000 // sample_rate,
+        "speech_ms": speech_frames * 1000 // sample_rate,
+        "segments": [[start * 1000 // sample_rate, end * 1000 // sample_rate] for start, end in segments],
+    })
+
+
+def read_segments(sha256):
+    """
+    Return a blob's stored segments, or None when it has not been analysed.
+    """
+    try:
+        with open(segments_path(sha256)) as source:
+            return json.load(source)
+    except FileNotFoundError:
+        return None
@@ -1,10 +1,26 @@
-from rest_framework import viewsets, permissions
+from rest_framework import viewsets, permissions, mixins, status
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from rest_framework.renderers import JSONRenderer
 from django.contrib.auth.models import User
-from .models import Note, AudioFile
-from .serializers import NoteSerializer, UserSerializer
+from .models import Note, AudioFile, AudioUpload, Tombstone
+from .serializers import (
+    NoteSerializer,
+    NoteBulkSerializer,
+    COMPACT_NOTE_FIELDS,
+    compact_notes,
+    UserSerializer,
+    AudioFileSerializer,
+    AudioUploadSerializer,
+)
+from . import archive, audio_meta, metrics, response_cache, routers, search, storage, streaming, sync, uploads, vad, waveform
+from .pagination import NoteCursorPagination, NoteSearchPagination
 from .permissions import IsOwner
+from django.conf import settings
 from django.db import transaction
-import os
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
 
 class NoteViewSet(viewsets.ModelViewSet):
     """
@@ -13,49 +29,282 @@ class NoteViewSet(viewsets.ModelViewSet):
     """
     serializer_class = NoteSerializer
     permission_classes = [permissions.IsAuthenticated, IsOwner]
+    pagination_class = NoteCursorPagination
+
+    def initial(self, request, *args, **kwargs):
+        """
+        Put the audio upload handler first on the actions that take note audio,
+        so uploads are checked as they arrive. Other actions, such as the
+        archive import, keep their own size limits.
+        """
+        if self.action in ("create", "update", "partial_update"):
+            request.upload_handlers.insert(0, uploads.AudioUploadHandler(request._request))
+        super().initial(request, *args, **kwargs)
+
+    @property
+    def search_query(self):
+        return self.request.query_params.get("q", "").strip() if self.action == "list" else ""
+
+    @property
+    def compact(self):
+        return self.action == "list" and self.request.query_params.get("compact") in ("1", "true")
+
+    @property
+    def paginator(self):
+        """
+        Use page numbers for ranked search results and cursors otherwise.
+        """
+        if not hasattr(self, "_paginator"):
+            self._paginator = NoteSearchPagination() if self.search_query else self.pagination_class()
+        return self._paginator
 
     def get_queryset(self):
         """
         Return notes that belong to the currently authenticated user.
+
+        Audio files are prefetched so the nested `audio_files` field costs a
+        single extra query for the whole page instead of one per note. With
+        `?q=` the list is restricted to matching notes, best matches first.
+        Reads leave out the columns and prefetch that `?fields=`/`?omit=`
+        drop, and `?compact=1` lists plain rows with the stored audio count.
+        """
+        queryset = Note.objects.filter(user=self.request.user).defer("search_vector")
+        if self.search_query:
+            queryset = search.search_notes(queryset, self.search_query)
+        if self.compact:
+            return queryset.values(*COMPACT_NOTE_FIELDS)
+
+        fields = self.get_serializer().fields if self.request.method in permissions.SAFE_METHODS else None
+        if fields is None or "audio_files" in fields:
+            queryset = queryset.prefetch_related("audio_files")
+        if fields is not None and "description" not in fields:
+            queryset = queryset.defer("description")
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        render = self.list_compact if self.compact else super().list
+        with routers.replica_reads(request.user.id):
+            return response_cache.cached_response(self, request, render, *args, **kwargs)
+
+    def list_compact(self, request, *args, **kwargs):
+        """
+        List notes as id, title, timestamps and audio count straight from `.values()` rows.
+        """
+        page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        return self.get_paginated_response(compact_notes(page))
+
+    def retrieve(self, request, *args, **kwargs):
+        with routers.replica_reads(request.user.id):
+            return response_cache.cached_response(self, request, super().retrieve, *args, **kwargs)
+
+    @action(detail=False, methods=["post"])
+    def bulk(self, request):
+        """
+        Create, update and delete many notes in one transaction.
+
+        Body: `{"create": [...], "update": [{"id": ...}, ...], "delete": [ids]}`.
+        Returns per-item results; deleting a missing note is reported as 404
+        without failing the batch, any other error rolls the whole batch back.
         """
-        return Note.objects.filter(user=self.request.user)
+        serializer = NoteBulkSerializer(data=request.data, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            results = serializer.save(user=request.user)
+        return Response(results)
+
+    @action(detail=False, methods=["get"])
+    def changes(self, request):
+        """
+        Return what changed since `?since=<cursor>`: notes created or updated
+        (with their audio files), ids of deleted notes and audio files, the
+        cursor to send next time and whether more changes are waiting.
+
+        Omit `since` for a first sync. Reads go to the primary, since a lagging
+        replica could hide changes from behind a cursor already handed out.
+        """
+        try:
+            since = sync.decode_cursor(request.query_params.get("since", ""))
+            limit = min(int(request.query_params.get("limit", settings.SYNC_PAGE_SIZE)), settings.SYNC_PAGE_SIZE)
+        except sync.CursorExpired as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_410_GONE)
+        except ValueError as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        rows, has_more = sync.read_changes(request.user.id, since, max(limit, 1))
+        note_ids = [object_id for _, kind, _, object_id in rows if kind == sync.NOTE_KIND]
+        notes = self.get_queryset().filter(pk__in=note_ids).order_by("updated_at", "id") if note_ids else []
+        return Response({
+            "notes": self.get_serializer(notes, many=True).data,
+            "deleted": {
+                "notes": [object_id for _, kind, _, object_id in rows if kind == Tombstone.NOTE],
+                "audio_files": [object_id for _, kind, _, object_id in rows if kind == Tombstone.AUDIO_FILE],
+            },
+            "cursor": sync.encode_cursor(sync.next_cursor(since, rows, has_more)),
+            "has_more": has_more,
+        })
+
+    @action(detail=False, methods=["get"], renderer_classes=[JSONRenderer, streaming.PassthroughRenderer])
+    def export(self, request):
+        """
+        Stream a ZIP archive of all the user's notes and audio files, built as it is sent.
+        """
+        response = StreamingHttpResponse(archive.export_chunks(request.user), content_type="application/zip")
+        filename = f"notes-{timezone.now():%Y%m%d}.zip"
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
+
+    @action(detail=False, methods=["post"], url_path="import")
+    def import_archive(self, request):
+        """
+        Add the notes and audio in an uploaded export (`archive` form field) to the user's notes.
+        """
+        upload = request.FILES.get("archive")
+        if upload is None:
+            return Response({"archive": ["No archive was uploaded."]}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            counts = archive.import_archive(request.user, upload)
+        except archive.ArchiveError as exc:
+            return Response({"archive": [str(exc)]}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(counts, status=status.HTTP_201_CREATED)
 
     def perform_create(self, serializer):
         """
         Automatically associate the note with the logged-in user during creation.
         """
-        serializer.save(user=self.request.user)
+        with transaction.atomic():
+            serializer.save(user=self.request.user)
 
     def perform_update(self, serializer):
         """
-        Handle updating a note and optionally uploading or deleting audio files.
+        Save the note and its audio changes in a single transaction.
+        """
+        with transaction.atomic():
+            serializer.save()
+
+    def perform_destroy(self, instance):
+        """
+        Delete the note, writing its tombstone and its audio files' in one insert.
+        """
+        with transaction.atomic(), sync.batched_tombstones():
+            instance.delete()
+
+class AudioUploadViewSet(mixins.CreateModelMixin,
+                         mixins.RetrieveModelMixin,
+                         mixins.DestroyModelMixin,
+                         viewsets.GenericViewSet):
+    """
+    ViewSet for resumable chunked audio uploads.
+
+    POST creates a session, PUT writes a byte range given by Content-Range,
+    GET reports the current offset and `finalize` turns a complete session
+    into an AudioFile on the session's note.
+    """
+    serializer_class = AudioUploadSerializer
+    permission_classes = [permissions.IsAuthenticated, IsOwner]
+
+    def get_queryset(self):
+        """
+        Return upload sessions that belong to the currently authenticated user.
+        """
+        return AudioUpload.objects.filter(user=self.request.user)
+
+    def perform_create(self, serializer):
+        """
+        Associate the session with the logged-in user and allocate its file on disk.
+        """
+        upload = serializer.save(user=self.request.user)
+        uploads.allocate(upload)
+
+    def update(self, request, *args, **kwargs):
+        """
+        Write one chunk of the upload, streaming the request body to disk.
+        """
+        upload = self.get_object()
+        try:
+            start, end = uploads.parse_content_range(request.META.get("HTTP_CONTENT_RANGE"), upload.size)
+        except ValueError as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        written = uploads.write_chunk(upload, start, end, request.stream)
+
+        with transaction.atomic():
+            upload = AudioUpload.objects.select_for_update().get(pk=upload.pk)
+            if written:
+                upload.received_ranges = uploads.merge_range(upload.received_ranges, start, start + written)
+                upload.save(update_fields=["received_ranges", "updated_at"])
+
+        return Response(self.get_serializer(upload).data)
+
+    @action(detail=True, methods=["post"])
+    def finalize(self, request, pk=None):
+        """
+        Move a completely received upload into storage as a new AudioFile.
         """
+        upload = self.get_object()
         with transaction.atomic():
-            instance = serializer.save()
+            upload = AudioUpload.objects.select_for_update().get(pk=upload.pk)
+            if not upload.is_complete:
+                return Response(
+                    {"detail": "Upload is incomplete.", "offset": upload.offset},
+                    status=status.HTTP_409_CONFLICT,
+                )
+            if audio_meta.probe_path(upload.temp_path) is None:
+                upload.delete()
+                return Response({"detail": "Unsupported audio format."}, status=status.HTTP_400_BAD_REQUEST)
+            audio_file = storage.save_audio_file_from_path(upload.note, upload.temp_path, upload.filename)
+            upload.delete()
+
+        serializer = AudioFileSerializer(audio_file, context=self.get_serializer_context())
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-            existing_audio_files = AudioFile.objects.filter(note=instance)
-            for audio_file in existing_audio_files:
-                if audio_file.audio and os.path.isfile(audio_file.audio.path):
-                    os.remove(audio_file.audio.path)
-                audio_file.delete()
+class AudioFileViewSet(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """
+    ViewSet for reading individual audio files and streaming their content.
+    """
+    serializer_class = AudioFileSerializer
+    permission_classes = [permissions.IsAuthenticated]
 
-            uploaded_audios = self.request.FILES.getlist("uploaded_audios")
-            for audio in uploaded_audios:
-                AudioFile.objects.create(note=instance, audio=audio)
-    
-    def destroy(self, request, *args, **kwargs):
+    def get_queryset(self):
         """
-        Override destroy to delete associated audio files from media storage.
+        Return audio files on notes that belong to the currently authenticated user.
+
+        Ownership is enforced by this single query, so other users get a 404.
         """
-        instance = self.get_object()
+        return AudioFile.objects.filter(note__user=self.request.user)
 
-        audio_files = AudioFile.objects.filter(note=instance)
-        for audio in audio_files:
-            if audio.audio and os.path.isfile(audio.audio.path):
-                os.remove(audio.audio.path)
-            audio.delete()
+    @action(detail=True, methods=["get"], renderer_classes=[JSONRenderer, streaming.PassthroughRenderer])
+    def stream(self, request, pk=None):
+        """
+        Stream the audio, honouring Range and If-None-Match or offloading to the proxy.
+        """
+        return streaming.serve_audio(request, self.get_object())
 
-        return super().destroy(request, *args, **kwargs)
+    @action(detail=True, methods=["get"])
+    def peaks(self, request, pk=None):
+        """
+        Return precomputed waveform peaks; `?peaks=<n>` asks for at least n of them.
+        """
+        audio_file = self.get_object()
+        try:
+            wanted = int(request.query_params["peaks"]) if "peaks" in request.query_params else None
+        except ValueError:
+            return Response({"detail": "peaks must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+
+        data = waveform.read_peaks(audio_file.blob_id, wanted) if audio_file.blob_id else None
+        if data is None:
+            return Response({"detail": "Waveform not available."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(data)
+
+    @action(detail=True, methods=["get"])
+    def segments(self, request, pk=None):
+        """
+        Return the speech segments found by voice activity detection, as `[start_ms, end_ms]` pairs.
+        """
+        audio_file = self.get_object()
+        data = vad.read_segments(audio_file.blob_id) if audio_file.blob_id else None
+        if data is None:
+            return Response({"detail": "Speech segments not available."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(data)
 
 class UserViewSet(viewsets.ModelViewSet):
     """
@@ -64,3 +313,16 @@ class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [permissions.AllowAny]
+
+def metrics_view(request):
+    """
+    Expose the request metrics in the Prometheus text format.
+
+    Scrapers authenticate with `Authorization: Bearer <METRICS_TOKEN>`; the
+    endpoint does not exist while METRICS_TOKEN is unset.
+    """
+    if not settings.METRICS_TOKEN:
+        raise Http404
+    if not constant_time_compare(request.META.get("HTTP_AUTHORIZATION", ""), f"Bearer {settings.METRICS_TOKEN}"):
+        return HttpResponse(status=401)
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,153 @@
+"""
+Precomputed waveform peaks for PCM WAV audio.
+
+Peaks are min/max sample pairs, scaled to int8, at several zoom levels. The
+finest level covers BASE_SAMPLES_PER_PEAK frames per peak and each coarser
+level LEVEL_FACTOR times more. The PCM data is memory-mapped and reduced in
+fixed-size blocks, so memory use does not grow with the length of the
+recording. Peaks are written once per blob to a binary sidecar:
+
+    header   "<4sBBxxI"  magic b"PEAK", version, level count, sample rate
+    levels   "<II"       samples per peak, peak count (one entry per level)
+    data     int8        interleaved min/max pairs, level by level
+"""
+import os
+import struct
+import tempfile
+
+import numpy as np
+
+from . import dsp, storage
+from .models import AudioBlob
+
+PEAKS_SUFFIX = ".peaks"
+MAGIC = b"PEAK"
+VERSION = 1
+HEADER = struct.Struct("<4sBBxxI")
+LEVEL = struct.Struct("<II")
+
+BASE_SAMPLES_PER_PEAK = 256
+LEVEL_FACTOR = 4
+LEVEL_COUNT = 4
+# Peaks reduced per block of the memory map
+PEAKS_PER_BLOCK = 4096
+
+
+def _to_int8(values, center, scale):
+    scaled = (values.astype(np.float64) - center) / scale * 127
+    return np.clip(np.round(scaled), -128, 127).astype(np.int8)
+
+
+def compute_peaks(path):
+    """
+    Compute peaks for the WAV file at `path`.
+
+    Returns `(sample_rate, levels)` where each level is `(samples_per_peak, peaks)`
+    and `peaks` is an int8 array of shape (count, 2), or None if the file is not
+    PCM WAV.
+    """
+    layout = dsp.read_layout(path)
+    if layout is None:
+        return None
+    reader = dsp.pcm_reader(path, layout)
+    if reader is None:
+        return None
+    samples, decode, center, scale = reader
+
+    spp = BASE_SAMPLES_PER_PEAK
+    block_frames = spp * PEAKS_PER_BLOCK
+    mins, maxs = [], []
+    for start in range(0, len(samples), block_frames):
+        block = decode(samples[start:start + block_frames]).reshape(-1, layout.channels)
+        full = len(block) // spp
+        if full:
+            grouped = block[:full * spp].reshape(full, spp * layout.channels)
+            mins.append(grouped.min(axis=1))
+            maxs.append(grouped.max(axis=1))
+        if len(block) > full * spp:
+            rest = block[full * spp:]
+            mins.append(rest.min(keepdims=True).ravel())
+            maxs.append(rest.max(keepdims=True).ravel())
+
+    if mins:
+        low = _to_int8(np.concatenate(mins), center, scale)
+        high = _to_int8(np.concatenate(maxs), center, scale)
+    else:
+        low = high = np.zeros(0, dtype=np.int8)
+
+    levels = []
+    for level in range(LEVEL_COUNT):
+        levels.append((spp, np.stack([low, high], axis=1)))
+        pad = -len(low) % LEVEL_FACTOR
+        low = np.pad(low, (0, pad), constant_values=127).reshape(-1, LEVEL_FACTOR).min(axis=1)
+        high = np.pad(high, (0, pad), constant_values=-128).reshape(-1, LEVEL_FACTOR).max(axis=1)
+        spp *= LEVEL_FACTOR
+    return layout.sample_rate, levels
+
+
+def write_peaks(path, sample_rate, levels):
+    """
+    Atomically write peak levels to a sidecar file at `path`.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "wb") as out:
+        out.write(HEADER.pack(MAGIC, VERSION, len(levels), sample_rate))
+        for samples_per_peak, peaks in levels:
+            out.write(LEVEL.pack(samples_per_peak, len(peaks)))
+        for _, peaks in levels:
+            out.write(peaks.tobytes())
+    os.replace(temp_path, path)
+
+
+def peaks_path(sha256):
+    file_storage = AudioBlob._meta.get_field("file").storage
+    return file_storage.path(storage.sidecar_name(sha256, PEAKS_SUFFIX))
+
+
+def generate_peaks(blob):
+    """
+    Processing stage: compute and store the peaks sidecar for a new blob.
+    """
+    result = compute_peaks(blob.file.path)
+    if result is not None:
+        write_peaks(peaks_path(blob.sha256), *result)
+
+
+def read_peaks(sha256, peaks=None):
+    """
+    Read one level from a blob's sidecar without touching the audio itself.
+
+    Picks the coarsest level with at least `peaks` peaks, the finest level if
+    none has that many, or the coarsest level when `peaks` is None. Returns
+    None when no sidecar exists.
+    """
+    try:
+        source = open(peaks_path(sha256), "rb")
+    except FileNotFoundError:
+        return None
+
+    with source:
+        magic, version, level_count, sample_rate = HEADER.unpack(source.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            return None
+        levels = [LEVEL.unpack(source.read(LEVEL.size)) for _ in range(level_count)]
+
+        chosen = len(levels) - 1
+        if peaks is not None:
+            chosen = 0
+            for index, (_, count) in enumerate(levels):
+                if count >= peaks:
+                    chosen = index
+
+        offset = HEADER.size + LEVEL.size * level_count + sum(count * 2 for _, count in levels[:chosen])
+        samples_per_peak, count = levels[chosen]
+        source.seek(offset)
+        data = np.frombuffer(source.read(count * 2), dtype=np.int8)
+
+    return {
+        "sample_rate": sample_rate,
+        "samples_per_peak": samples_per_peak,
+        "length": count,
+        "data": data.tolist(),
+    }